@@ -1,16 +1,8 @@
 import logging
 import json
+from typing import Optional
 from firebase_functions import https_fn
-from firebase_admin import auth, firestore
-import google.cloud.logging
-
-# Initialize logging
-client = google.cloud.logging.Client()
-client.setup_logging()
-logging.basicConfig(level=logging.INFO)
-
-# Initialize Firestore
-db = firestore.client()
+from src import runtime
 
 # CORS headers
 CORS_HEADERS = {
@@ -20,6 +12,19 @@ CORS_HEADERS = {
     'Access-Control-Max-Age': '3600'
 }
 
+# Free-tier newspapers always use the single-call generation path;
+# premium users may pick any strategy
+FREE_TIER_STRATEGY = 'compact'
+PREMIUM_DEFAULT_STRATEGY = 'standard'
+
+def resolve_generation_strategy(db, uid: str, requested: Optional[str]) -> str:
+    """The strategy for a new newspaper, from the user's tier on the server"""
+    user = db.collection('users').document(uid).get(field_paths=['membershipTier'])
+    tier = (user.to_dict() or {}).get('membershipTier') if user.exists else None
+    if tier != 'premium':
+        return FREE_TIER_STRATEGY
+    return requested or PREMIUM_DEFAULT_STRATEGY
+
 @https_fn.on_request(
     memory=512,
     timeout_sec=300,
@@ -38,6 +43,10 @@ def create_newspaper_api(req: https_fn.Request) -> https_fn.Response:
             {'Content-Type': 'application/json', **CORS_HEADERS}
         )
     
+    runtime.start_request()
+    db = runtime.get_firestore()
+    from firebase_admin import auth, firestore
+    
     try:
         # Auth check
         auth_header = req.headers.get('Authorization')
@@ -64,6 +73,7 @@ def create_newspaper_api(req: https_fn.Request) -> https_fn.Response:
         selected_papers = data.get('selectedPapers', [])
         template_id = data.get('templateId', 'default')
         newspaper_name = data.get('newspaperName', '研究新聞')
+        requested_strategy = data.get('generationStrategy')
         
         if len(selected_papers) < 3:
             return https_fn.Response(
@@ -72,12 +82,22 @@ def create_newspaper_api(req: https_fn.Request) -> https_fn.Response:
                 {'Content-Type': 'application/json', **CORS_HEADERS}
             )
         
+        newspaper_generator = runtime.timed_import('src.utils.newspaper_generator')
+        if requested_strategy is not None and requested_strategy not in newspaper_generator.GENERATION_STRATEGIES:
+            return https_fn.Response(
+                json.dumps({'error': f'Unknown generation strategy: {requested_strategy}'}), 
+                400, 
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+        generation_strategy = resolve_generation_strategy(db, uid, requested_strategy)
+        
         # Create newspaper
         newspaper_data = {
             'creatorId': uid,
             'name': newspaper_name,
             'selectedPapers': selected_papers[:5],
             'templateId': template_id,
+            'generationStrategy': generation_strategy,
             'processingStatus': 'pending',
             'isPublic': False,
             'shareSettings': {
@@ -88,18 +108,44 @@ def create_newspaper_api(req: https_fn.Request) -> https_fn.Response:
             'updatedAt': firestore.SERVER_TIMESTAMP,
         }
         
-        doc_ref = db.collection('newspapers').add(newspaper_data)
-        newspaper_id = doc_ref[1].id
+        # The newspaper and its generation job are written in one batch,
+        # with the newspaper already in its final initial state
+        persistence = runtime.timed_import('src.utils.persistence')
+        newspaper_ref = persistence.new_document(db, 'newspapers')
+        newspaper_id = newspaper_ref.id
+        writes = persistence.WriteGroup(db)
+        
+        # Enqueue generation; the job worker picks it up in the background
+        from src.jobs.backends import QueueFullError
+        try:
+            job_id = runtime.enqueue_job('generate_newspaper', {
+                'newspaper_id': newspaper_id
+            }, batch=writes)
+        except QueueFullError as e:
+            logging.warning(f'Generation queue full for newspaper {newspaper_id}: {str(e)}')
+            writes.create(newspaper_ref, newspaper_data)
+            writes.commit()
+            return https_fn.Response(
+                json.dumps({
+                    'error': 'Generation queue is full, please retry later',
+                    'newspaperId': newspaper_id,
+                }),
+                503,
+                {'Content-Type': 'application/json', 'Retry-After': '60', **CORS_HEADERS}
+            )
         
-        # Update status (simplified)
-        db.collection('newspapers').document(newspaper_id).update({
-            'processingStatus': 'processing'
+        writes.create(newspaper_ref, {
+            **newspaper_data,
+            'processingStatus': 'processing',
+            'generationJobId': job_id
         })
+        writes.commit()
         
         return https_fn.Response(
             json.dumps({
                 'success': True,
                 'newspaperId': newspaper_id,
+                'jobId': job_id,
             }),
             200,
             {'Content-Type': 'application/json', **CORS_HEADERS}
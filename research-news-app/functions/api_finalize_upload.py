@@ -0,0 +1,162 @@
+import logging
+import json
+import time
+from firebase_functions import https_fn
+from src import runtime
+
+# CORS headers
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+    'Access-Control-Max-Age': '3600'
+}
+
+@https_fn.on_request(
+    memory=512,
+    timeout_sec=300,
+    region="us-central1"
+)
+def finalize_upload_api(req: https_fn.Request) -> https_fn.Response:
+    """
+    Step 2 of a direct-to-Storage upload: validate the uploaded object
+    (PDF, size, SHA-256), create the paper document and enqueue its
+    analysis. Idempotent per session: repeated calls return the first
+    result. Body: {"sessionId": "..."}
+    """
+
+    if req.method == 'OPTIONS':
+        return https_fn.Response('', 204, CORS_HEADERS)
+
+    if req.method != 'POST':
+        return https_fn.Response(
+            json.dumps({'error': 'Method not allowed'}),
+            405,
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
+
+    runtime.start_request()
+    db = runtime.get_firestore()
+    from firebase_admin import auth, firestore, storage
+
+    try:
+        # Auth check
+        auth_header = req.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return https_fn.Response(
+                json.dumps({'error': 'Unauthorized'}),
+                401,
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+
+        token = auth_header.split(' ')[1]
+        decoded_token = auth.verify_id_token(token)
+        uid = decoded_token['uid']
+
+        data = req.get_json(silent=True) or {}
+        session_id = data.get('sessionId')
+        if not session_id:
+            return https_fn.Response(
+                json.dumps({'error': 'sessionId is required'}),
+                400,
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+
+        uploads = runtime.timed_import('src.utils.uploads')
+        leases = runtime.timed_import('src.utils.leases')
+        session_ref = db.collection(uploads.UPLOAD_SESSIONS_COLLECTION).document(session_id)
+        session_doc = session_ref.get()
+        if not session_doc.exists or session_doc.get('uploaderId') != uid:
+            return https_fn.Response(
+                json.dumps({'error': 'Upload session not found'}),
+                404,
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+        session = session_doc.to_dict()
+        if session.get('status') == 'rejected':
+            return https_fn.Response(
+                json.dumps({'error': session.get('error', 'Upload was rejected')}),
+                session.get('resultStatus', 400),
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+
+        # One finalize per session; retries get the stored result
+        claim = leases.claim_lease(db, session_ref, session_id, 'finalize_upload_api', status_field='status')
+        if claim['state'] == leases.LEASE_COMPLETED:
+            return https_fn.Response(
+                json.dumps(claim['document'].get('result', {})),
+                claim['document'].get('resultStatus', 200),
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+        if claim['state'] == leases.LEASE_IN_PROGRESS:
+            body = leases.in_progress_body(claim)
+            return https_fn.Response(
+                json.dumps(body),
+                202,
+                {'Content-Type': 'application/json', 'Retry-After': str(body['retryAfter']), **CORS_HEADERS}
+            )
+
+        try:
+            bucket = storage.bucket(session['bucket'])
+            blob = bucket.get_blob(session['blobName'])
+
+            def reject(message: str, status: int) -> https_fn.Response:
+                if blob is not None:
+                    blob.delete()
+                leases.release_lease(db, session_ref, session_id, {
+                    'status': 'rejected',
+                    'error': message,
+                    'resultStatus': status,
+                    'updatedAt': firestore.SERVER_TIMESTAMP
+                })
+                return https_fn.Response(
+                    json.dumps({'error': message}),
+                    status,
+                    {'Content-Type': 'application/json', **CORS_HEADERS}
+                )
+
+            if time.time() > session.get('finalizeBy', 0):
+                return reject('Upload session expired', 410)
+
+            if blob is None:
+                # Not uploaded (yet); the client can finish the upload and retry
+                leases.release_lease(db, session_ref, session_id, {'status': 'pending'})
+                return https_fn.Response(
+                    json.dumps({'error': 'Upload is not complete'}),
+                    409,
+                    {'Content-Type': 'application/json', **CORS_HEADERS}
+                )
+
+            try:
+                upload = uploads.stored_blob_digest(blob, session.get('maxBytes'))
+            except uploads.UploadRejected as e:
+                return reject(e.message, e.status)
+
+            status, body = uploads.register_uploaded_paper(db, uid, blob, session['filename'], upload, session.get('language', 'ja'))
+            leases.release_lease(db, session_ref, session_id, {
+                'status': 'completed',
+                'paperId': body.get('paperId'),
+                'result': body,
+                'resultStatus': status,
+                'updatedAt': firestore.SERVER_TIMESTAMP
+            })
+
+            headers = {'Content-Type': 'application/json', **CORS_HEADERS}
+            if status == 503:
+                headers['Retry-After'] = '60'
+            return https_fn.Response(json.dumps(body), status, headers)
+        except Exception:
+            # Let the client retry instead of waiting for the lease to expire
+            leases.release_lease(db, session_ref, session_id, {'status': 'pending'})
+            raise
+
+    except Exception as e:
+        logging.error(f'Finalize upload error: {str(e)}')
+        return https_fn.Response(
+            json.dumps({
+                'error': 'Failed to finalize upload',
+                'details': str(e)
+            }),
+            500,
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
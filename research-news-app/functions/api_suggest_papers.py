@@ -0,0 +1,148 @@
+import logging
+import json
+import time
+from firebase_functions import https_fn
+from src import runtime
+
+# CORS headers
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+    'Access-Control-Max-Age': '3600'
+}
+
+# Seed fields needed for access checks and the index query ('embedding'
+# is only inline on papers stored before details/embedding)
+SEED_FIELDS = ['uploaderId', 'groupIds', 'isPublic', 'embedding', 'metadata.keywords', 'aiAnalysis.relatedTopics']
+
+# Fields returned for each suggested paper
+SUGGESTION_FIELDS = ['title', 'authors', 'aiAnalysis.summary', 'aiAnalysis.academicField']
+
+@https_fn.on_request(
+    memory=512,
+    timeout_sec=60,
+    region="us-central1"
+)
+def suggest_papers_api(req: https_fn.Request) -> https_fn.Response:
+    """Suggest papers related to a seed paper for newspaper composition"""
+
+    if req.method == 'OPTIONS':
+        return https_fn.Response('', 204, CORS_HEADERS)
+
+    if req.method != 'POST':
+        return https_fn.Response(
+            json.dumps({'error': 'Method not allowed'}),
+            405,
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
+
+    runtime.start_request()
+    db = runtime.get_firestore()
+    from firebase_admin import auth
+    started = time.perf_counter()
+
+    try:
+        # Auth check
+        auth_header = req.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return https_fn.Response(
+                json.dumps({'error': 'Unauthorized'}),
+                401,
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+
+        token = auth_header.split(' ')[1]
+        decoded_token = auth.verify_id_token(token)
+        uid = decoded_token['uid']
+
+        # Parse request
+        data = req.get_json(silent=True) or {}
+        paper_id = data.get('paperId')
+        if not paper_id:
+            return https_fn.Response(
+                json.dumps({'error': 'paperId is required'}),
+                400,
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+
+        similarity_index = runtime.timed_import('src.utils.similarity_index')
+        top_k = max(1, min(int(data.get('topK') or similarity_index.DEFAULT_TOP_K), similarity_index.MAX_TOP_K))
+        exclude = tuple(data.get('excludePaperIds') or [])
+        group_id = data.get('groupId')
+
+        # Search the group's library if one is given, otherwise the user's
+        if group_id:
+            group = db.collection('groups').document(group_id).get(field_paths=['members'])
+            if not group.exists or uid not in (group.to_dict() or {}).get('members', []):
+                return https_fn.Response(
+                    json.dumps({'error': 'Access denied'}),
+                    403,
+                    {'Content-Type': 'application/json', **CORS_HEADERS}
+                )
+            scope = similarity_index.group_scope(group_id)
+        else:
+            scope = similarity_index.user_scope(uid)
+
+        seed_doc = db.collection('papers').document(paper_id).get(field_paths=SEED_FIELDS)
+        if not seed_doc.exists:
+            return https_fn.Response(
+                json.dumps({'error': 'Paper not found'}),
+                404,
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+        seed = seed_doc.to_dict()
+        if seed.get('uploaderId') != uid and not seed.get('isPublic') and group_id not in (seed.get('groupIds') or []):
+            return https_fn.Response(
+                json.dumps({'error': 'Access denied'}),
+                403,
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+        paper_store = runtime.timed_import('src.utils.paper_store')
+        seed.update(paper_store.get_embeddings(db, [paper_id], {paper_id: seed}).get(paper_id, {}))
+        if not seed.get('embedding'):
+            return https_fn.Response(
+                json.dumps({'error': 'Paper has not been analyzed yet'}),
+                409,
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+
+        suggestions = similarity_index.suggest_papers(db, scope, paper_id, seed, top_k, exclude)
+
+        # One batched read for the display fields of every suggestion
+        refs = [db.collection('papers').document(suggestion['paperId']) for suggestion in suggestions]
+        details = {doc.id: doc.to_dict() for doc in db.get_all(refs, field_paths=SUGGESTION_FIELDS) if doc.exists} if refs else {}
+        papers = []
+        for suggestion in suggestions:
+            paper = details.get(suggestion['paperId'])
+            if paper is None:
+                continue  # Deleted since it was indexed
+            papers.append({
+                **suggestion,
+                'title': paper.get('title', ''),
+                'authors': paper.get('authors', []),
+                'summary': paper.get('aiAnalysis', {}).get('summary', ''),
+                'academicField': paper.get('aiAnalysis', {}).get('academicField', '')
+            })
+
+        return https_fn.Response(
+            json.dumps({
+                'success': True,
+                'paperId': paper_id,
+                'papers': papers,
+                'tookMs': round((time.perf_counter() - started) * 1000, 1),
+            }),
+            200,
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
+
+    except Exception as e:
+        logging.error(f'Suggest papers error: {str(e)}')
+        return https_fn.Response(
+            json.dumps({
+                'error': 'Failed to suggest papers',
+                'details': str(e)
+            }),
+            500,
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
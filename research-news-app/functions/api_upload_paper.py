@@ -1,16 +1,7 @@
 import logging
 import json
 from firebase_functions import https_fn
-from firebase_admin import auth, firestore, storage
-import google.cloud.logging
-
-# Initialize logging
-client = google.cloud.logging.Client()
-client.setup_logging()
-logging.basicConfig(level=logging.INFO)
-
-# Initialize Firestore
-db = firestore.client()
+from src import runtime
 
 # CORS headers
 CORS_HEADERS = {
@@ -26,7 +17,11 @@ CORS_HEADERS = {
     region="us-central1"
 )
 def upload_paper_api(req: https_fn.Request) -> https_fn.Response:
-    """Upload paper Cloud Function"""
+    """
+    Upload paper Cloud Function (multipart). Files are limited to
+    uploads.max_streamed_upload_bytes() by the 32MB request limit; larger
+    ones go through create_upload_url_api and finalize_upload_api.
+    """
     
     if req.method == 'OPTIONS':
         return https_fn.Response('', 204, CORS_HEADERS)
@@ -38,6 +33,10 @@ def upload_paper_api(req: https_fn.Request) -> https_fn.Response:
             {'Content-Type': 'application/json', **CORS_HEADERS}
         )
     
+    runtime.start_request()
+    db = runtime.get_firestore()
+    from firebase_admin import auth, storage
+    
     try:
         # Auth check
         auth_header = req.headers.get('Authorization')
@@ -52,68 +51,61 @@ def upload_paper_api(req: https_fn.Request) -> https_fn.Response:
         decoded_token = auth.verify_id_token(token)
         uid = decoded_token['uid']
         
-        # File handling
-        files = req.files.to_dict()
-        if 'file' not in files:
+        # Stream the file part straight to Storage while the multipart body
+        # is parsed: hashed, size-limited and sniffed on the way, so the PDF
+        # is never held in memory or spooled to (memory-backed) /tmp
+        uploads = runtime.timed_import('src.utils.uploads')
+        max_bytes = uploads.max_streamed_upload_bytes()
+        if req.content_length and req.content_length > max_bytes + uploads.MULTIPART_OVERHEAD_BYTES:
             return https_fn.Response(
-                json.dumps({'error': 'No file provided'}), 
-                400, 
+                json.dumps({'error': uploads.too_large_message(max_bytes), 'directUpload': max_bytes < uploads.max_upload_bytes()}), 
+                413, 
                 {'Content-Type': 'application/json', **CORS_HEADERS}
             )
         
-        file = files['file']
-        if not file.filename.endswith('.pdf'):
-            return https_fn.Response(
-                json.dumps({'error': 'Only PDF files are allowed'}), 
-                400, 
-                {'Content-Type': 'application/json', **CORS_HEADERS}
-            )
-        
-        # Upload to Storage
-        import time
-        timestamp = int(time.time() * 1000)
-        filename = f"papers/{uid}/{timestamp}_{file.filename}"
-        
-        bucket = storage.bucket('ronshin-72b20.firebasestorage.app')
-        blob = bucket.blob(filename)
-        blob.upload_from_string(
-            file.read(),
-            content_type='application/pdf'
-        )
-        
-        # Make blob publicly readable or use Firebase Storage URL
-        # Since papers should be accessible to authenticated users, we'll use the public URL format
-        url = f"https://firebasestorage.googleapis.com/v0/b/{bucket.name}/o/{blob.name.replace('/', '%2F')}?alt=media"
+        bucket = storage.bucket(uploads.UPLOAD_BUCKET)
+        sinks = []
         
-        # Save to Firestore
-        paper_data = {
-            'uploaderId': uid,
-            'title': file.filename.replace('.pdf', ''),
-            'authors': [],
-            'fileUrl': url,
-            'fileSize': file.content_length or 0,
-            'processingStatus': 'pending',
-            'createdAt': firestore.SERVER_TIMESTAMP,
-            'updatedAt': firestore.SERVER_TIMESTAMP,
-        }
+        def stream_file(total_content_length, content_type, filename=None, content_length=None):
+            if sinks:
+                raise uploads.UploadRejected('Only one file per upload')
+            if not filename or not filename.endswith('.pdf'):
+                raise uploads.UploadRejected('Only PDF files are allowed')
+            sinks.append(uploads.StreamingBlobUpload(bucket.blob(uploads.paper_blob_name(uid, filename)), max_bytes))
+            return sinks[-1]
         
-        doc_ref = db.collection('papers').add(paper_data)
-        paper_id = doc_ref[1].id
+        # stream_factory decides where file parts are written while parsing
+        from werkzeug.formparser import FormDataParser
+        parser = FormDataParser(stream_factory=stream_file, silent=False)
         
-        # Trigger analysis (simplified - just update the document)
-        db.collection('papers').document(paper_id).update({
-            'processingStatus': 'processing'
-        })
+        try:
+            try:
+                _, form, files = parser.parse(req.stream, req.mimetype, req.content_length, req.mimetype_params)
+            except ValueError:
+                raise uploads.UploadRejected('Malformed multipart body')
+            files = files.to_dict()
+            if 'file' not in files:
+                raise uploads.UploadRejected('No file provided')
+            file = files['file']
+            upload = sinks[0].finish()
+        except uploads.UploadRejected as e:
+            for sink in sinks:
+                sink.abort()
+            return https_fn.Response(
+                json.dumps({'error': e.message}), 
+                e.status, 
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+        except Exception:
+            for sink in sinks:
+                sink.abort()
+            raise
         
-        return https_fn.Response(
-            json.dumps({
-                'success': True,
-                'paperId': paper_id,
-                'fileUrl': url,
-            }),
-            200,
-            {'Content-Type': 'application/json', **CORS_HEADERS}
-        )
+        status, body = uploads.register_uploaded_paper(db, uid, sinks[0].blob, file.filename, upload, form.get('language', 'ja'))
+        headers = {'Content-Type': 'application/json', **CORS_HEADERS}
+        if status == 503:
+            headers['Retry-After'] = '60'
+        return https_fn.Response(json.dumps(body), status, headers)
         
     except Exception as e:
         logging.error(f'Upload error: {str(e)}')
@@ -0,0 +1,114 @@
+import logging
+import json
+import time
+import uuid
+from firebase_functions import https_fn
+from src import runtime
+
+# CORS headers
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+    'Access-Control-Max-Age': '3600'
+}
+
+@https_fn.on_request(
+    memory=256,
+    timeout_sec=60,
+    region="us-central1"
+)
+def create_upload_url_api(req: https_fn.Request) -> https_fn.Response:
+    """
+    Step 1 of a direct-to-Storage upload: issue a short-lived signed URL
+    for a resumable upload to papers/{uid}/..., and an upload session to
+    pass to finalize_upload_api once the upload is complete.
+    Body: {"filename": "paper.pdf", "size": bytes?, "language": "ja"}
+    """
+
+    if req.method == 'OPTIONS':
+        return https_fn.Response('', 204, CORS_HEADERS)
+
+    if req.method != 'POST':
+        return https_fn.Response(
+            json.dumps({'error': 'Method not allowed'}),
+            405,
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
+
+    runtime.start_request()
+    db = runtime.get_firestore()
+    from firebase_admin import auth, firestore, storage
+
+    try:
+        # Auth check
+        auth_header = req.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return https_fn.Response(
+                json.dumps({'error': 'Unauthorized'}),
+                401,
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+
+        token = auth_header.split(' ')[1]
+        decoded_token = auth.verify_id_token(token)
+        uid = decoded_token['uid']
+
+        data = req.get_json(silent=True) or {}
+        filename = str(data.get('filename') or '').split('/')[-1]
+        if not filename.endswith('.pdf'):
+            return https_fn.Response(
+                json.dumps({'error': 'Only PDF files are allowed'}),
+                400,
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+
+        uploads = runtime.timed_import('src.utils.uploads')
+        max_bytes = uploads.max_upload_bytes()
+        if int(data.get('size') or 0) > max_bytes:
+            return https_fn.Response(
+                json.dumps({'error': uploads.too_large_message(max_bytes)}),
+                413,
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+
+        bucket = storage.bucket(uploads.UPLOAD_BUCKET)
+        blob = bucket.blob(uploads.paper_blob_name(uid, filename))
+        upload = uploads.signed_upload_url(blob, max_bytes)
+
+        now = time.time()
+        session_id = uuid.uuid4().hex
+        db.collection(uploads.UPLOAD_SESSIONS_COLLECTION).document(session_id).set({
+            'uploaderId': uid,
+            'bucket': bucket.name,
+            'blobName': blob.name,
+            'filename': filename,
+            'language': data.get('language', 'ja'),
+            'maxBytes': max_bytes,
+            'status': 'pending',
+            'urlExpiresAt': now + uploads.UPLOAD_URL_SECONDS,
+            'finalizeBy': now + uploads.UPLOAD_FINALIZE_GRACE_SECONDS,
+            'createdAt': firestore.SERVER_TIMESTAMP
+        })
+
+        return https_fn.Response(
+            json.dumps({
+                'success': True,
+                'sessionId': session_id,
+                'objectName': blob.name,
+                'upload': upload,
+            }),
+            200,
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
+
+    except Exception as e:
+        logging.error(f'Create upload URL error: {str(e)}')
+        return https_fn.Response(
+            json.dumps({
+                'error': 'Failed to create upload URL',
+                'details': str(e)
+            }),
+            500,
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
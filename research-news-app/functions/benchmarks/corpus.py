@@ -0,0 +1,106 @@
+"""
+Deterministic corpus of synthetic papers as PDFs, for the offline
+pipeline benchmark. Papers have the usual section headings so section
+selection and map-reduce see realistic structure; "scanned" PDFs have
+no text layer and take the native ingestion path.
+"""
+import os
+import random
+from typing import Dict, Any, List
+
+# Pages per corpus size. Up to 50 pages auto mode ingests the PDF
+# natively; "large" is long enough for map-reduce
+CORPUS_SIZES = {
+    'small': 2,
+    'medium': 12,
+    'large': 60,
+    'scanned': 3,
+}
+
+LINES_PER_PAGE = 58
+WORDS_PER_LINE = 14
+
+SECTIONS = ['Abstract', '1 Introduction', '2 Related Work', '3 Methods', '4 Results', '5 Discussion', '6 Conclusion', 'References']
+
+VOCABULARY = (
+    'model data analysis results method learning network performance accuracy '
+    'experiment dataset training evaluation baseline proposed approach significant '
+    'protein cell signal quantum material energy climate temperature sample '
+    'measurement error improvement framework algorithm structure function system '
+    'observed increase decrease compared previous study field theory evidence'
+).split()
+
+def paper_lines(name: str, pages: int, seed: int = 0) -> List[str]:
+    """Text lines of a synthetic paper, about LINES_PER_PAGE per page"""
+    rng = random.Random(f"{seed}:{name}")
+    total = pages * LINES_PER_PAGE
+    lines = [
+        f"Synthetic Study {name.title()}: {' '.join(rng.sample(VOCABULARY, 4)).title()}",
+        f"A. Author, B. Author, C. Author",
+        f"Journal of Benchmarks, 2024. doi:10.0000/bench.{seed}.{name}",
+    ]
+    per_section = max(2, (total - len(lines)) // len(SECTIONS) - 1)
+    for section in SECTIONS:
+        lines.append(section)
+        for i in range(per_section):
+            if section == 'References':
+                lines.append(f"[{i + 1}] {' '.join(rng.choices(VOCABULARY, k=8)).title()}. Proc. Bench {2000 + i % 24}.")
+            else:
+                words = rng.choices(VOCABULARY, k=WORDS_PER_LINE)
+                lines.append(' '.join(words) + (f" ({rng.randint(1, 99)}.{rng.randint(0, 9)}%)." if i % 5 == 4 else '.'))
+    return lines[:total]
+
+def _escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def build_pdf(pages: List[List[str]]) -> bytes:
+    """A minimal PDF with one Helvetica text stream per page (empty pages have no text layer)"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for lines in pages:
+        stream = ''.join(['BT /F1 9 Tf 11 TL 40 800 Td '] + [f"({_escape(line)}) Tj T* " for line in lines] + ['ET']) if lines else ''
+        stream_bytes = stream.encode('latin-1', 'replace')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream_bytes), stream_bytes))
+        content_number = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_number
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b' '.join(b"%d 0 R" % kid for kid in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(out)
+
+def build_paper_pdf(name: str, pages: int, scanned: bool = False, seed: int = 0) -> bytes:
+    if scanned:
+        return build_pdf([[] for _ in range(pages)])
+    lines = paper_lines(name, pages, seed)
+    return build_pdf([lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)])
+
+def generate_corpus(directory: str, sizes: List[str], seed: int = 0) -> List[Dict[str, Any]]:
+    """Write one PDF per size to directory; returns [{name, size, path, pages, bytes}]"""
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for size in sizes:
+        if size not in CORPUS_SIZES:
+            raise ValueError(f"Unknown corpus size: {size} (choose from {', '.join(CORPUS_SIZES)})")
+        pdf_bytes = build_paper_pdf(size, CORPUS_SIZES[size], scanned=size == 'scanned', seed=seed)
+        path = os.path.join(directory, f"{size}.pdf")
+        with open(path, 'wb') as f:
+            f.write(pdf_bytes)
+        corpus.append({'name': size, 'size': size, 'path': path, 'pages': CORPUS_SIZES[size], 'bytes': len(pdf_bytes)})
+    return corpus
@@ -0,0 +1,757 @@
+"""
+Deterministic in-process stand-ins for the Google services the
+pipelines call, for the offline benchmark: a GenerativeModel returning
+canned JSON, a text embedding model, an in-memory Firestore and Storage
+backed by a local directory. Each takes a ServiceProfile for latency and
+error injection and counts the calls made to it.
+
+install() puts them behind src.runtime, so the functions code runs
+unchanged (the real client libraries must be importable).
+"""
+import base64
+import copy
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional, Tuple
+
+class ServiceProfile:
+    """Injected latency (seconds, plus uniform jitter) and error rate of one fake service"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def roll(self) -> Tuple[float, bool]:
+        """(delay, fail) for the next call; deterministic for a given seed and call order"""
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = self.error_rate > 0 and self._random.random() < self.error_rate
+        return delay, fail
+
+    def apply(self, stats: Counter, what: str) -> None:
+        """Sleep for the injected latency and raise the injected error, if any"""
+        from google.api_core import exceptions as api_exceptions
+        delay, fail = self.roll()
+        if delay:
+            time.sleep(delay)
+        if fail:
+            stats['injectedErrors'] += 1
+            raise api_exceptions.ServiceUnavailable(f"Injected {what} error")
+
+def _digest(text: str) -> int:
+    return int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:12], 16)
+
+# ---------------------------------------------------------------- Vertex AI
+
+# Prompt kinds, recognised by the JSON keys (or wording) each prompt asks for
+PROMPT_KINDS = [
+    ('compact', '"subArticles"'),
+    ('relationship', '"connectionMap"'),
+    ('theme', '"newspaperTitle"'),
+    ('mainArticle', '"subheadline"'),
+    ('analysis', '"keypoints"'),
+    ('subArticle', '"headline"'),
+]
+MAP_PROMPT_PATTERN = re.compile(r'Part \d+/\d+:|第\d+部/全\d+部:')
+PAPER_NUMBER_PATTERN = re.compile(r'^(?:Paper |論文)(\d+):', re.MULTILINE)
+
+FIELDS = ['Machine Learning', 'Materials Science', 'Molecular Biology', 'Climate Science', 'Quantum Physics']
+TOPICS = ['representation learning', 'protein folding', 'energy storage', 'climate models', 'error correction',
+          'graph networks', 'gene expression', 'thin films', 'ocean heat', 'benchmarks']
+
+def classify_prompt(prompt: str) -> str:
+    for kind, marker in PROMPT_KINDS:
+        if marker in prompt:
+            return kind
+    if MAP_PROMPT_PATTERN.search(prompt):
+        return 'map'
+    return 'text'
+
+def canned_analysis(key: str) -> Dict[str, Any]:
+    """Analysis JSON for a paper, varied by key so papers differ"""
+    n = _digest(key)
+    topics = [TOPICS[(n + i) % len(TOPICS)] for i in range(5)]
+    return {
+        "title": f"Benchmark Paper {n % 100000:05d}",
+        "authors": ["A. Author", "B. Author"],
+        "journal": "Journal of Benchmarks",
+        "publicationDate": "2024-01-01",
+        "doi": f"10.0000/bench.{n % 100000}",
+        "abstract": f"We study {topics[0]} and {topics[1]}. " * 8,
+        "keywords": topics[:3],
+        "summary": f"A study of {topics[0]} that improves on prior work in {topics[1]}.",
+        "keypoints": [f"Finding about {topic}" for topic in topics],
+        "significance": f"Advances {topics[0]}.",
+        "relatedTopics": topics,
+        "academicField": FIELDS[n % len(FIELDS)],
+        "technicalLevel": "intermediate",
+        "aiConfidenceScore": 80,
+        "figuresReferences": ["Figure 1", "Table 1"]
+    }
+
+def canned_response(kind: str, prompt: str) -> str:
+    """Deterministic response text for one prompt"""
+    numbers = [int(number) for number in PAPER_NUMBER_PATTERN.findall(prompt)]
+    paper_count = max(numbers) if numbers else 3
+    n = _digest(prompt)
+    if kind == 'analysis':
+        return json.dumps(canned_analysis(prompt[-2000:]), ensure_ascii=False)
+    if kind == 'relationship':
+        return json.dumps({
+            "mainPaperIndex": 0,
+            "overallTheme": "Benchmark research",
+            "newspaperTitle": "The Benchmark Times",
+            "connectionMap": {f"0-{i}": "Related" for i in range(1, paper_count)},
+            "subArticleOrder": list(range(1, paper_count))
+        })
+    if kind == 'theme':
+        return json.dumps({"overallTheme": "Benchmark research", "newspaperTitle": f"The Benchmark Times {n % 100}"})
+    if kind == 'mainArticle':
+        return json.dumps({"headline": "Benchmark breakthrough", "subheadline": "Measured offline", "content": "Lorem ipsum. " * 60})
+    if kind == 'subArticle':
+        return json.dumps({"headline": f"Sub article {n % 1000}", "content": "Lorem ipsum. " * 25})
+    if kind == 'compact':
+        return json.dumps({
+            "mainPaperIndex": 0,
+            "overallTheme": "Benchmark research",
+            "newspaperTitle": "The Benchmark Times",
+            "subArticleOrder": list(range(1, paper_count)),
+            "mainArticle": {"headline": "Benchmark breakthrough", "subheadline": "Measured offline", "content": "Lorem ipsum. " * 60},
+            "subArticles": [{"paperIndex": i, "headline": f"Sub article {i}", "content": "Lorem ipsum. " * 25} for i in range(1, paper_count)],
+            "sidebar": "Keywords: benchmarks, latency, throughput. " * 5
+        })
+    if kind == 'map':
+        return "Notes: the research question, methods and results of this part (42.0% improvement). " * 6
+    return "Keywords: benchmarks, latency, throughput. A short explanation of the field and its outlook. " * 4
+
+def prompt_text(contents: Any) -> Tuple[str, int]:
+    """(text of the prompt, number of non-text parts such as PDF documents)"""
+    if isinstance(contents, str):
+        return contents, 0
+    if isinstance(contents, (list, tuple)):
+        texts, others = [], 0
+        for part in contents:
+            text, part_others = prompt_text(part)
+            texts.append(text)
+            others += part_others
+        return '\n'.join(texts), others
+    return '', 1
+
+class FakeGenerativeModel:
+    """
+    GenerativeModel stand-in: canned JSON per prompt kind, latency of
+    profile.latency plus latency_per_1k_tokens per thousand input tokens,
+    injected ServiceUnavailable errors and non-JSON (malformed) replies
+    """
+
+    def __init__(self, profile: Optional[ServiceProfile] = None, latency_per_1k_tokens: float = 0.0, malformed_rate: float = 0.0, seed: int = 0):
+        self.profile = profile or ServiceProfile(seed=seed)
+        self.latency_per_1k_tokens = latency_per_1k_tokens
+        self.malformed_rate = malformed_rate
+        self._random = random.Random(seed + 1)
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        self.calls_by_kind = Counter()
+
+    def generate_content(self, contents: Any, *args, **kwargs) -> Any:
+        from src.ai.vertex_client import estimate_tokens
+        prompt, documents = prompt_text(contents)
+        kind = classify_prompt(prompt)
+        input_tokens = estimate_tokens(contents)
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['inputTokens'] += input_tokens
+            self.stats['documentParts'] += documents
+            self.calls_by_kind[kind] += 1
+            malformed = self.malformed_rate > 0 and self._random.random() < self.malformed_rate
+        if self.latency_per_1k_tokens:
+            time.sleep(self.latency_per_1k_tokens * input_tokens / 1000)
+        self.profile.apply(self.stats, 'model')
+
+        text = "I could not produce a structured answer." if malformed else canned_response(kind, prompt)
+        output_tokens = len(text) // 4 + 1
+        with self._lock:
+            self.stats['malformed'] += int(malformed)
+            self.stats['outputTokens'] += output_tokens
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=input_tokens,
+                candidates_token_count=output_tokens,
+                total_token_count=input_tokens + output_tokens
+            )
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, 'byKind': dict(self.calls_by_kind)}
+
+class FakeEmbeddingModel:
+    """TextEmbeddingModel stand-in: a unit vector seeded by each input's text"""
+
+    def __init__(self, profile: Optional[ServiceProfile] = None, dimensions: int = 768):
+        self.profile = profile or ServiceProfile()
+        self.dimensions = dimensions
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def get_embeddings(self, inputs: List[Any]) -> List[Any]:
+        import numpy as np
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['texts'] += len(inputs)
+        self.profile.apply(self.stats, 'embedding')
+        embeddings = []
+        for item in inputs:
+            text = getattr(item, 'text', item)
+            vector = np.random.default_rng(_digest(text)).standard_normal(self.dimensions)
+            embeddings.append(SimpleNamespace(values=(vector / np.linalg.norm(vector)).tolist()))
+        return embeddings
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+# ---------------------------------------------------------------- Firestore
+
+def _get_path(data: Dict[str, Any], path: str) -> Tuple[bool, Any]:
+    value = data
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+def _set_path(data: Dict[str, Any], path: str, value: Any) -> None:
+    parts = path.split('.')
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            data[part] = {}
+        data = data[part]
+    data[parts[-1]] = value
+
+def _delete_path(data: Dict[str, Any], path: str) -> None:
+    parts = path.split('.')
+    for part in parts[:-1]:
+        data = data.get(part)
+        if not isinstance(data, dict):
+            return
+    data.pop(parts[-1], None)
+
+def _project(data: Dict[str, Any], field_paths: Optional[List[str]]) -> Dict[str, Any]:
+    if field_paths is None:
+        return copy.deepcopy(data)
+    projected = {}
+    for path in field_paths:
+        found, value = _get_path(data, path)
+        if found:
+            _set_path(projected, path, copy.deepcopy(value))
+    return projected
+
+def _resolve(value: Any, now: datetime.datetime) -> Any:
+    from firebase_admin import firestore
+    if value is firestore.SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, dict):
+        return {key: _resolve(item, now) for key, item in value.items() if item is not firestore.DELETE_FIELD}
+    if isinstance(value, list):
+        return [_resolve(item, now) for item in value]
+    return value
+
+def _merge(target: Dict[str, Any], data: Dict[str, Any]) -> None:
+    from firebase_admin import firestore
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+class FakeSnapshot:
+    def __init__(self, reference: 'FakeDocumentReference', data: Optional[Dict[str, Any]]):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path: str) -> Any:
+        return copy.deepcopy(_get_path(self._data or {}, field_path)[1])
+
+class FakeDocumentReference:
+    def __init__(self, client: 'FakeFirestore', path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self) -> 'FakeCollectionReference':
+        return FakeCollectionReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def collection(self, name: str) -> 'FakeCollectionReference':
+        return FakeCollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, field_paths: Optional[List[str]] = None, transaction: Optional['FakeTransaction'] = None) -> FakeSnapshot:
+        self._client._rpc('get')
+        return self._client._snapshot(self, field_paths)
+
+    def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        self._client._commit([('set', self, data, merge)], 'write')
+
+    def create(self, data: Dict[str, Any]) -> None:
+        self._client._commit([('create', self, data, False)], 'write')
+
+    def update(self, fields: Dict[str, Any]) -> None:
+        self._client._commit([('update', self, fields, False)], 'write')
+
+    def delete(self) -> None:
+        self._client._commit([('delete', self, None, False)], 'write')
+
+class FakeQuery:
+    OPERATORS = {
+        '==': lambda value, operand: value == operand,
+        '!=': lambda value, operand: value != operand,
+        '<': lambda value, operand: value < operand,
+        '<=': lambda value, operand: value <= operand,
+        '>': lambda value, operand: value > operand,
+        '>=': lambda value, operand: value >= operand,
+        'in': lambda value, operand: value in operand,
+        'not-in': lambda value, operand: value not in operand,
+        'array_contains': lambda value, operand: isinstance(value, list) and operand in value,
+        'array_contains_any': lambda value, operand: isinstance(value, list) and any(item in value for item in operand),
+    }
+
+    def __init__(self, client: 'FakeFirestore', collection_path: str, filters=(), orders=(), limit_count: Optional[int] = None, field_paths: Optional[List[str]] = None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit_count
+        self._field_paths = field_paths
+
+    def _copy(self, **changes) -> 'FakeQuery':
+        state = {
+            'filters': self._filters, 'orders': self._orders,
+            'limit_count': self._limit, 'field_paths': self._field_paths, **changes
+        }
+        return FakeQuery(self._client, self._collection_path, **state)
+
+    def where(self, field_path: str, op_string: str, value: Any) -> 'FakeQuery':
+        if op_string not in self.OPERATORS:
+            raise ValueError(f"Unsupported operator in fake Firestore: {op_string}")
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path: str, direction: str = 'ASCENDING') -> 'FakeQuery':
+        return self._copy(orders=self._orders + [(field_path, direction)])
+
+    def limit(self, count: int) -> 'FakeQuery':
+        return self._copy(limit_count=count)
+
+    def select(self, field_paths: List[str]) -> 'FakeQuery':
+        return self._copy(field_paths=list(field_paths))
+
+    def _matches(self) -> List[Tuple[str, Dict[str, Any]]]:
+        matches = []
+        for path, data in self._client._documents_in(self._collection_path):
+            keep = True
+            for field_path, op_string, operand in self._filters:
+                found, value = _get_path(data, field_path)
+                # Like Firestore, documents without the field never match
+                if not found or not self.OPERATORS[op_string](value, operand):
+                    keep = False
+                    break
+            if keep:
+                matches.append((path, data))
+        for field_path, direction in reversed(self._orders):
+            matches = [match for match in matches if _get_path(match[1], field_path)[0]]
+            matches.sort(key=lambda match: _get_path(match[1], field_path)[1], reverse=str(direction).upper().startswith('DESC'))
+        if self._limit is not None:
+            matches = matches[:self._limit]
+        return matches
+
+    def stream(self, transaction: Optional['FakeTransaction'] = None):
+        self._client._rpc('query')
+        matches = self._matches()
+        self._client._count('documentReads', max(1, len(matches)))
+        for path, data in matches:
+            yield FakeSnapshot(FakeDocumentReference(self._client, path), _project(data, self._field_paths))
+
+    def get(self, transaction: Optional['FakeTransaction'] = None) -> List[FakeSnapshot]:
+        return list(self.stream(transaction))
+
+    def count(self) -> 'FakeAggregation':
+        return FakeAggregation(self)
+
+class FakeAggregation:
+    def __init__(self, query: FakeQuery):
+        self._query = query
+
+    def get(self) -> List[List[Any]]:
+        self._query._client._rpc('aggregation')
+        return [[SimpleNamespace(alias='count', value=len(self._query._matches()))]]
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client: 'FakeFirestore', path: str):
+        super().__init__(client, path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id: Optional[str] = None) -> FakeDocumentReference:
+        return FakeDocumentReference(self._client, f"{self._collection_path}/{document_id or self._client._auto_id()}")
+
+    def add(self, data: Dict[str, Any]) -> Tuple[datetime.datetime, FakeDocumentReference]:
+        ref = self.document()
+        ref.create(data)
+        return datetime.datetime.now(datetime.timezone.utc), ref
+
+class FakeWriteBatch:
+    def __init__(self, client: 'FakeFirestore'):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference: FakeDocumentReference, data: Dict[str, Any], merge: bool = False) -> None:
+        self._writes.append(('set', reference, data, merge))
+
+    def create(self, reference: FakeDocumentReference, data: Dict[str, Any]) -> None:
+        self._writes.append(('create', reference, data, False))
+
+    def update(self, reference: FakeDocumentReference, fields: Dict[str, Any]) -> None:
+        self._writes.append(('update', reference, fields, False))
+
+    def delete(self, reference: FakeDocumentReference) -> None:
+        self._writes.append(('delete', reference, None, False))
+
+    def commit(self) -> None:
+        writes, self._writes = self._writes, []
+        self._client._commit(writes, 'batchCommit')
+
+class FakeTransaction(FakeWriteBatch):
+    """Writes are buffered and committed when the transactional function returns"""
+
+    def commit(self) -> None:
+        writes, self._writes = self._writes, []
+        self._client._commit(writes, 'transactionCommit')
+
+def fake_transactional(to_wrap):
+    """
+    Replacement for firestore.transactional: transactions run one at a
+    time (no optimistic retries needed), committing on success
+    """
+    def run(transaction: FakeTransaction, *args, **kwargs):
+        client = transaction._client
+        with client._transaction_lock:
+            client._rpc('transaction')
+            result = to_wrap(transaction, *args, **kwargs)
+            transaction.commit()
+        return result
+    return run
+
+class FakeFirestore:
+    """In-memory Firestore client covering the API surface used by the functions code"""
+
+    def __init__(self, profile: Optional[ServiceProfile] = None):
+        self.profile = profile or ServiceProfile()
+        self._documents: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+        self._transaction_lock = threading.RLock()
+        self._ids = random.Random(0)
+        self.stats = Counter()
+
+    def _auto_id(self) -> str:
+        with self._lock:
+            return ''.join(self._ids.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(20))
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += amount
+
+    def _rpc(self, kind: str) -> None:
+        self._count('rpcs')
+        self._count(f'{kind}Rpcs')
+        self.profile.apply(self.stats, 'Firestore')
+
+    def _snapshot(self, reference: FakeDocumentReference, field_paths: Optional[List[str]] = None) -> FakeSnapshot:
+        with self._lock:
+            data = self._documents.get(reference.path)
+            self.stats['documentReads'] += 1
+            return FakeSnapshot(reference, None if data is None else _project(data, field_paths))
+
+    def _documents_in(self, collection_path: str) -> List[Tuple[str, Dict[str, Any]]]:
+        prefix = collection_path + '/'
+        with self._lock:
+            return [
+                (path, data) for path, data in self._documents.items()
+                if path.startswith(prefix) and '/' not in path[len(prefix):]
+            ]
+
+    def _commit(self, writes: List[tuple], kind: str) -> None:
+        from google.api_core import exceptions as api_exceptions
+        if not writes:
+            return
+        self._rpc(kind)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            staged = dict(self._documents)
+            for op, reference, data, merge in writes:
+                current = staged.get(reference.path)
+                if op == 'delete':
+                    staged.pop(reference.path, None)
+                elif op == 'create':
+                    if current is not None:
+                        raise api_exceptions.AlreadyExists(f"Document already exists: {reference.path}")
+                    staged[reference.path] = _resolve(copy.deepcopy(data), now)
+                elif op == 'set':
+                    if merge and current is not None:
+                        document = copy.deepcopy(current)
+                        _merge(document, _resolve_top(data, now))
+                        staged[reference.path] = document
+                    else:
+                        staged[reference.path] = _resolve(copy.deepcopy(data), now)
+                else:
+                    if current is None:
+                        raise api_exceptions.NotFound(f"No document to update: {reference.path}")
+                    document = copy.deepcopy(current)
+                    for field_path, value in data.items():
+                        _apply_field(document, field_path, copy.deepcopy(value), now)
+                    staged[reference.path] = document
+            self._documents = staged
+            self.stats['documentWrites'] += len(writes)
+
+    def collection(self, name: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, name)
+
+    def document(self, path: str) -> FakeDocumentReference:
+        return FakeDocumentReference(self, path)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs) -> FakeTransaction:
+        return FakeTransaction(self)
+
+    def get_all(self, references: List[FakeDocumentReference], field_paths: Optional[List[str]] = None, transaction: Optional[FakeTransaction] = None):
+        references = list(references)
+        self._rpc('getAll')
+        return [self._snapshot(reference, field_paths) for reference in references]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+def _resolve_top(data: Dict[str, Any], now: datetime.datetime) -> Dict[str, Any]:
+    """Resolve server timestamps but keep DELETE_FIELD markers for _merge"""
+    from firebase_admin import firestore
+    return {key: value if value is firestore.DELETE_FIELD else _resolve(copy.deepcopy(value), now) for key, value in data.items()}
+
+def _apply_field(document: Dict[str, Any], field_path: str, value: Any, now: datetime.datetime) -> None:
+    from firebase_admin import firestore
+    if value is firestore.DELETE_FIELD:
+        _delete_path(document, field_path)
+    else:
+        _set_path(document, field_path, _resolve(value, now))
+
+# ---------------------------------------------------------------- Storage
+
+class LocalBlob:
+    def __init__(self, bucket: 'LocalBucket', name: str):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+        self.generation = None
+        self.size = None
+        self.md5_hash = None
+        self.crc32c = None
+
+    @property
+    def _path(self) -> str:
+        return os.path.join(self.bucket._directory, self.name)
+
+    def _check_generation(self, if_generation_match: Optional[int]) -> None:
+        from google.api_core import exceptions as api_exceptions
+        if if_generation_match is None:
+            return
+        current = self.bucket.client._generation(self.bucket.name, self.name)
+        if current != if_generation_match:
+            raise api_exceptions.PreconditionFailed(f"Generation mismatch for {self.name}: {current} != {if_generation_match}")
+
+    def _refresh(self) -> None:
+        self.generation = self.bucket.client._generation(self.bucket.name, self.name) or None
+        self.size = os.path.getsize(self._path) if os.path.exists(self._path) else None
+        self.md5_hash = None
+        if self.size is not None:
+            # Base64 like the Storage metadata; crc32c is left unset
+            with open(self._path, 'rb') as f:
+                self.md5_hash = base64.b64encode(hashlib.md5(f.read()).digest()).decode('ascii')
+
+    def exists(self) -> bool:
+        self.bucket.client._rpc('metadata')
+        return os.path.exists(self._path)
+
+    def reload(self) -> None:
+        from google.api_core import exceptions as api_exceptions
+        self.bucket.client._rpc('metadata')
+        if not os.path.exists(self._path):
+            raise api_exceptions.NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        self._refresh()
+
+    def download_as_bytes(self, if_generation_match: Optional[int] = None, start: Optional[int] = None, end: Optional[int] = None, **kwargs) -> bytes:
+        """The whole object, or bytes start..end inclusive like a range read"""
+        from google.api_core import exceptions as api_exceptions
+        client = self.bucket.client
+        client._rpc('download')
+        with client._lock:
+            if not os.path.exists(self._path):
+                raise api_exceptions.NotFound(f"No such object: {self.bucket.name}/{self.name}")
+            self._check_generation(if_generation_match)
+            with open(self._path, 'rb') as f:
+                f.seek(start or 0)
+                data = f.read() if end is None else f.read(end - (start or 0) + 1)
+        client._count('bytesRead', len(data))
+        return data
+
+    def upload_from_string(self, data: Any, content_type: Optional[str] = None, if_generation_match: Optional[int] = None, **kwargs) -> None:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        client = self.bucket.client
+        client._rpc('upload')
+        with client._lock:
+            self._check_generation(if_generation_match)
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            with open(self._path, 'wb') as f:
+                f.write(data)
+            client._bump_generation(self.bucket.name, self.name)
+            self.content_type = content_type
+            self._refresh()
+        client._count('bytesWritten', len(data))
+
+    def open(self, mode: str = 'rb', if_generation_match: Optional[int] = None, **kwargs):
+        if 'r' in mode:
+            self.reload()
+            return open(self._path, mode)
+        return _LocalBlobWriter(self, if_generation_match)
+
+    def delete(self) -> None:
+        client = self.bucket.client
+        client._rpc('delete')
+        with client._lock:
+            if os.path.exists(self._path):
+                os.remove(self._path)
+            client._forget(self.bucket.name, self.name)
+
+class _LocalBlobWriter:
+    """blob.open('wb'): buffered to a temporary file and published on close"""
+
+    def __init__(self, blob: LocalBlob, if_generation_match: Optional[int]):
+        self._blob = blob
+        self._if_generation_match = if_generation_match
+        self._chunks = []
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self._blob.upload_from_string(b''.join(self._chunks), if_generation_match=self._if_generation_match)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class LocalBucket:
+    def __init__(self, client: 'LocalStorageClient', name: str):
+        self.client = client
+        self.name = name
+        self._directory = os.path.join(client.root, name)
+
+    def blob(self, name: str) -> LocalBlob:
+        return LocalBlob(self, name)
+
+    def get_blob(self, name: str) -> Optional[LocalBlob]:
+        blob = LocalBlob(self, name)
+        self.client._rpc('metadata')
+        if not os.path.exists(blob._path):
+            return None
+        blob._refresh()
+        return blob
+
+class LocalStorageClient:
+    """Cloud Storage stand-in keeping objects as files under root/bucket/name"""
+
+    def __init__(self, root: str, profile: Optional[ServiceProfile] = None):
+        self.root = root
+        self.profile = profile or ServiceProfile()
+        self._generations: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.RLock()
+        self.stats = Counter()
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += amount
+
+    def _rpc(self, kind: str) -> None:
+        self._count('rpcs')
+        self._count(f'{kind}Rpcs')
+        self.profile.apply(self.stats, 'Storage')
+
+    def _generation(self, bucket: str, name: str) -> int:
+        """Current generation; 0 if the object does not exist"""
+        with self._lock:
+            if (bucket, name) not in self._generations and os.path.exists(os.path.join(self.root, bucket, name)):
+                self._generations[(bucket, name)] = 1
+            return self._generations.get((bucket, name), 0)
+
+    def _bump_generation(self, bucket: str, name: str) -> None:
+        with self._lock:
+            self._generations[(bucket, name)] = self._generation(bucket, name) + 1
+
+    def _forget(self, bucket: str, name: str) -> None:
+        with self._lock:
+            self._generations.pop((bucket, name), None)
+
+    def bucket(self, name: str) -> LocalBucket:
+        return LocalBucket(self, name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+# ---------------------------------------------------------------- Wiring
+
+def install(model: FakeGenerativeModel, embedding_model: FakeEmbeddingModel, firestore_client: FakeFirestore, storage_client: LocalStorageClient) -> None:
+    """
+    Route src.runtime's shared clients (and firestore.transactional) to the
+    fakes; ID tokens are accepted as the uid they name
+    """
+    from firebase_admin import auth, firestore
+    from src import runtime
+    from src.ai.embeddings import EMBEDDING_MODEL_NAME
+    from src.ai.vertex_client import RateLimitedModel
+    from src.jobs.backends import InMemoryJobBackend
+
+    firestore.transactional = fake_transactional
+    auth.verify_id_token = lambda token, **kwargs: {'uid': token}
+    for name in ('logging', 'firebase', 'vertexai'):
+        runtime.set_client(name, True)
+    runtime.set_client('firestore', firestore_client)
+    runtime.set_client('storage', storage_client)
+    runtime.set_client('jobs', InMemoryJobBackend())
+    runtime.set_client(f'model:{runtime.DEFAULT_MODEL_NAME}', RateLimitedModel(model, runtime.get_rate_limiter()))
+    runtime.set_client(f'embedding:{EMBEDDING_MODEL_NAME}', embedding_model)
@@ -0,0 +1,142 @@
+"""
+Compare the native PDF ingestion path with the text extraction path.
+
+For every PDF, each path runs in a fresh process so peak RSS is not
+shared between them. Reported per path and file (JSON on stdout):
+local preparation latency, peak traced Python memory, peak RSS, input
+token estimate and, with --live, the Vertex AI call latency.
+
+    cd functions
+    python -m benchmarks.pdf_ingestion paper1.pdf paper2.pdf [--live] [--repeat 3]
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Dict, Any, List
+
+PATHS = ("native", "text")
+
+def prepare_native(pdf_bytes: bytes) -> Dict[str, Any]:
+    """Local work of the native path: page count, excerpt, document Part"""
+    import PyPDF2
+    from src.ai import paper_analysis
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    page_count = len(reader.pages)
+    excerpt = paper_analysis.extract_text_from_pdf(reader, max_chars=paper_analysis.NATIVE_EXCERPT_CHARS)
+    part, ingestion = paper_analysis.build_pdf_part(pdf_bytes, "benchmark-bucket", "benchmark.pdf")
+    prompt = paper_analysis.build_analysis_prompt("", "ja", "native")
+    return {
+        'contents': [part, prompt],
+        'estimatedTokens': page_count * paper_analysis.NATIVE_TOKENS_PER_PAGE + paper_analysis.estimate_tokens(prompt),
+        'pages': page_count,
+        'excerptChars': len(excerpt),
+        'ingestion': ingestion
+    }
+
+def prepare_text(pdf_bytes: bytes) -> Dict[str, Any]:
+    """Local work of the text path: full extraction and section selection"""
+    import PyPDF2
+    from src.ai import paper_analysis
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    page_count = len(reader.pages)
+    text = paper_analysis.extract_text_from_pdf(reader, max_chars=paper_analysis.ANALYSIS_TEXT_CHARS)
+    selection = paper_analysis.select_sections(text)
+    prompt = paper_analysis.build_analysis_prompt(selection['text'], "ja", "select")
+    return {
+        'contents': prompt,
+        'estimatedTokens': paper_analysis.estimate_tokens(prompt),
+        'pages': page_count,
+        'extractedChars': len(text)
+    }
+
+def run_path(path: str, pdf_file: str, live: bool) -> Dict[str, Any]:
+    """Run one path on one file (called in a child process)"""
+    with open(pdf_file, 'rb') as f:
+        pdf_bytes = f.read()
+    # Import before measuring so only the path's own work is timed
+    import PyPDF2
+    from src.ai import paper_analysis
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    prepared = prepare_native(pdf_bytes) if path == "native" else prepare_text(pdf_bytes)
+    prepare_seconds = time.perf_counter() - started
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        'path': path,
+        'file': os.path.basename(pdf_file),
+        'bytes': len(pdf_bytes),
+        'prepareSeconds': prepare_seconds,
+        'tracedPeakBytes': traced_peak,
+        **{key: value for key, value in prepared.items() if key != 'contents'}
+    }
+
+    if live:
+        from src import runtime
+        model = runtime.get_generative_model()
+        started = time.perf_counter()
+        try:
+            response = model.generate_content(prepared['contents'], estimated_tokens=prepared['estimatedTokens'])
+            usage = getattr(response, 'usage_metadata', None)
+            result['promptTokens'] = getattr(usage, 'prompt_token_count', None)
+        except Exception as e:
+            result['error'] = str(e)
+        result['modelSeconds'] = time.perf_counter() - started
+
+    # ru_maxrss is in kilobytes on Linux
+    result['peakRssBytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return result
+
+def _child(queue, path: str, pdf_file: str, live: bool) -> None:
+    try:
+        queue.put(run_path(path, pdf_file, live))
+    except Exception as e:
+        queue.put({'path': path, 'file': os.path.basename(pdf_file), 'error': str(e)})
+
+def run_isolated(path: str, pdf_file: str, live: bool) -> Dict[str, Any]:
+    """Run a path in a fresh spawned process and return its measurements"""
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(queue, path, pdf_file, live))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Median of the numeric measurements of repeated runs"""
+    summary = dict(runs[-1])
+    for key in ('prepareSeconds', 'modelSeconds', 'tracedPeakBytes', 'peakRssBytes'):
+        values = [run[key] for run in runs if run.get(key) is not None]
+        if values:
+            summary[key] = statistics.median(values)
+    summary['repeats'] = len(runs)
+    return summary
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdfs', nargs='+', help='PDF files to benchmark')
+    parser.add_argument('--live', action='store_true', help='also call Vertex AI (needs credentials)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per path and file (median is reported)')
+    args = parser.parse_args(argv)
+
+    results = []
+    for pdf_file in args.pdfs:
+        for path in PATHS:
+            runs = [run_isolated(path, pdf_file, args.live) for _ in range(max(1, args.repeat))]
+            results.append(summarize(runs))
+    json.dump({'results': results}, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,481 @@
+"""
+Offline benchmark of the analysis and newspaper generation pipelines.
+
+Runs analyze_paper, generate_newspaper_content and the main.py HTTP
+handlers against the deterministic fakes in benchmarks/fakes.py (canned
+GenerativeModel and embeddings, in-memory Firestore, Storage in a local
+directory) with configurable latency and error injection, on a generated
+corpus of PDFs in several sizes (benchmarks/corpus.py). Each stage runs
+in a fresh process so peak RSS is per stage. Reported per stage and
+variant (corpus size or generation strategy), as JSON: latency
+percentiles, throughput, peak RSS, LLM calls by prompt kind, embedding
+calls, rate limiter counters and Firestore/Storage operations.
+
+    cd functions
+    python -m benchmarks.pipelines [--stages analyze_paper,generate_newspaper]
+        [--sizes small,medium,large,scanned] [--repeat 3] [--concurrency 4]
+        [--model-latency 0.2] [--model-error-rate 0.05] [--output after.json]
+    python -m benchmarks.pipelines --compare before.json after.json [--threshold 0.1]
+
+Needs the packages in requirements.txt, but no credentials or network.
+"""
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Dict, Any, List, Callable, Optional, Tuple
+
+from benchmarks.corpus import CORPUS_SIZES, generate_corpus
+
+STAGES = (
+    'analyze_paper',
+    'generate_newspaper',
+    'analyze_paper_http',
+    'analyze_papers_batch_http',
+    'generate_newspaper_http',
+    'regenerate_newspaper_http',
+)
+STRATEGIES = ('standard', 'compact')
+
+BUCKET = 'benchmark-bucket'
+UPLOADER_ID = 'benchmark-user'
+
+# Metrics compared by --compare; higher is worse for all but throughput
+COMPARED_METRICS = (
+    ('latency.p50', False),
+    ('latency.p95', False),
+    ('throughputPerSecond', True),
+    ('peakRssBytes', False),
+    ('llm.calls', False),
+    ('llm.inputTokens', False),
+    ('embeddings.calls', False),
+    ('firestore.rpcs', False),
+    ('firestore.documentWrites', False),
+    ('storage.rpcs', False),
+    ('errors', False),
+)
+
+# ------------------------------------------------------------------ child side
+
+def build_services(config: Dict[str, Any], storage_root: str) -> SimpleNamespace:
+    """Create the fakes for one stage and route src.runtime to them"""
+    from benchmarks import fakes
+    seed = config['seed']
+    services = SimpleNamespace(
+        model=fakes.FakeGenerativeModel(
+            fakes.ServiceProfile(config['modelLatency'], config['modelJitter'], config['modelErrorRate'], seed),
+            latency_per_1k_tokens=config['modelLatencyPer1kTokens'],
+            malformed_rate=config['malformedRate'],
+            seed=seed
+        ),
+        embedding_model=fakes.FakeEmbeddingModel(fakes.ServiceProfile(config['embeddingLatency'], seed=seed + 2)),
+        firestore=fakes.FakeFirestore(fakes.ServiceProfile(config['firestoreLatency'], error_rate=config['firestoreErrorRate'], seed=seed + 3)),
+        storage=fakes.LocalStorageClient(storage_root, fakes.ServiceProfile(config['storageLatency'], error_rate=config['storageErrorRate'], seed=seed + 4))
+    )
+    fakes.install(services.model, services.embedding_model, services.firestore, services.storage)
+    return services
+
+def counters(services: SimpleNamespace) -> Dict[str, Any]:
+    from src import runtime
+    limiter = runtime.get_rate_limiter().get_stats()
+    for gauge in ('queueSecondsAvg', 'queueSecondsMax', 'concurrencyLimit', 'inFlight'):
+        limiter.pop(gauge, None)
+    return {
+        'llm': services.model.snapshot(),
+        'embeddings': services.embedding_model.snapshot(),
+        'rateLimiter': limiter,
+        'firestore': services.firestore.snapshot(),
+        'storage': services.storage.snapshot(),
+    }
+
+def counter_delta(after: Any, before: Any) -> Any:
+    if isinstance(after, dict):
+        before = before if isinstance(before, dict) else {}
+        delta = {key: counter_delta(value, before.get(key)) for key, value in after.items()}
+        return {key: value for key, value in delta.items() if value not in (0, 0.0, {})}
+    if isinstance(after, (int, float)):
+        return after - (before or 0)
+    return after
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    return {
+        'mean': sum(values) / len(values),
+        'min': min(values),
+        'p50': percentile(values, 0.5),
+        'p95': percentile(values, 0.95),
+        'max': max(values),
+    }
+
+def measure(services: SimpleNamespace, stage: str, variant: str, ops: List[Callable[[], bool]], concurrency: int) -> Dict[str, Any]:
+    """Run ops (each returns True on success) on concurrency threads and summarize"""
+    def timed(op):
+        started = time.perf_counter()
+        try:
+            ok, error = bool(op()), None
+        except Exception as e:
+            ok, error = False, f"{type(e).__name__}: {e}"
+        return time.perf_counter() - started, ok, error
+
+    before = counters(services)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        outcomes = list(executor.map(timed, ops))
+    wall = time.perf_counter() - started
+    errors = [error or 'unsuccessful response' for _, ok, error in outcomes if not ok]
+    return {
+        'stage': stage,
+        'variant': variant,
+        'ops': len(outcomes),
+        'errors': len(errors),
+        'errorSamples': sorted(set(errors))[:3],
+        'concurrency': concurrency,
+        'wallSeconds': wall,
+        'throughputPerSecond': len(outcomes) / wall if wall > 0 else None,
+        'latency': latency_summary([seconds for seconds, _, _ in outcomes]),
+        **counter_delta(counters(services), before),
+        # ru_maxrss is in kilobytes on Linux; the peak of this stage's process so far
+        'peakRssBytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+def http_call(handler, body: Dict[str, Any], uid: Optional[str] = None) -> Tuple[int, Any]:
+    """
+    Call a main.py HTTP handler with a JSON POST, signed in as uid (see
+    fakes.install); returns (status, JSON body)
+    """
+    from werkzeug.test import EnvironBuilder
+    from firebase_functions import https_fn
+    headers = {'Authorization': f'Bearer {uid}'} if uid else {}
+    request = https_fn.Request(EnvironBuilder(method='POST', json=body, headers=headers).get_environ())
+    response = handler(request)
+    try:
+        payload = json.loads(response.get_data())
+    except ValueError:
+        payload = None
+    return response.status_code, payload
+
+def http_succeeded(status: int, payload: Any) -> bool:
+    return status == 200 and isinstance(payload, dict) and payload.get('success') is True
+
+def upload_corpus(services: SimpleNamespace, corpus: List[Dict[str, Any]], copies: int, prefix: str) -> Dict[str, List[Dict[str, str]]]:
+    """Store each PDF and create `copies` pending paper documents for it"""
+    from firebase_admin import firestore
+    db = services.firestore
+    bucket = services.storage.bucket(BUCKET)
+    papers = {}
+    for item in corpus:
+        blob_name = f"papers/{UPLOADER_ID}/{item['name']}.pdf"
+        with open(item['path'], 'rb') as f:
+            bucket.blob(blob_name).upload_from_string(f.read(), content_type='application/pdf')
+        file_url = f"gs://{BUCKET}/{blob_name}"
+        papers[item['name']] = []
+        for copy_index in range(copies):
+            paper_id = f"{prefix}-{item['name']}-{copy_index}"
+            db.collection('papers').document(paper_id).set({
+                'uploaderId': UPLOADER_ID,
+                'title': item['name'],
+                'authors': [],
+                'fileUrl': file_url,
+                'fileSize': item['bytes'],
+                'processingStatus': 'pending',
+                'createdAt': firestore.SERVER_TIMESTAMP,
+                'updatedAt': firestore.SERVER_TIMESTAMP,
+            })
+            papers[item['name']].append({'paperId': paper_id, 'fileUrl': file_url})
+    return papers
+
+def seed_analyzed_papers(services: SimpleNamespace, count: int) -> List[str]:
+    """Completed papers with canned analyses and embeddings, stored by save_paper_analysis"""
+    import main
+    from benchmarks import fakes
+    from src.ai.embeddings import embed_analysis, EMBEDDING_MODEL_NAME
+    paper_ids = []
+    for index in range(count):
+        paper_id = f"analyzed-{index}"
+        analysis = fakes.canned_analysis(paper_id)
+        result = {
+            'metadata': {'abstract': analysis['abstract'], 'keywords': analysis['keywords'], 'extractedText': analysis['abstract'] * 20, 'language': 'en'},
+            'aiAnalysis': {key: analysis[key] for key in ('summary', 'keypoints', 'significance', 'relatedTopics', 'academicField', 'technicalLevel', 'aiConfidenceScore')},
+            'paperInfo': {key: analysis[key] for key in ('title', 'authors', 'journal', 'publicationDate', 'doi')},
+        }
+        result['embedding'] = embed_analysis(result)
+        result['embeddingModel'] = EMBEDDING_MODEL_NAME
+        services.firestore.collection('papers').document(paper_id).set({'uploaderId': UPLOADER_ID, 'processingStatus': 'processing'})
+        main.save_paper_analysis(services.firestore, paper_id, result)
+        paper_ids.append(paper_id)
+    return paper_ids
+
+def seed_newspapers(services: SimpleNamespace, paper_ids: List[str], strategy: str, language: str, count: int) -> List[str]:
+    from firebase_admin import firestore
+    newspaper_ids = []
+    for index in range(count):
+        newspaper_id = f"newspaper-{strategy}-{index}"
+        services.firestore.collection('newspapers').document(newspaper_id).set({
+            'creatorId': UPLOADER_ID,
+            'name': 'Benchmark',
+            'selectedPapers': paper_ids,
+            'template': {},
+            'language': language,
+            'generationStrategy': strategy,
+            'processingStatus': 'pending',
+            'isPublic': False,
+            'createdAt': firestore.SERVER_TIMESTAMP,
+        })
+        newspaper_ids.append(newspaper_id)
+    return newspaper_ids
+
+def run_stage(stage: str, config: Dict[str, Any], corpus: List[Dict[str, Any]], storage_root: str) -> List[Dict[str, Any]]:
+    """Run one stage (called in a child process); one result per variant"""
+    logging.basicConfig(level=config['logLevel'])
+    logging.getLogger().setLevel(config['logLevel'])
+    from langdetect import DetectorFactory
+    DetectorFactory.seed = 0
+
+    services = build_services(config, storage_root)
+    import main
+    from src.ai import paper_analysis
+    from src.utils import newspaper_generator
+
+    repeat, concurrency, language = config['repeat'], config['concurrency'], config['language']
+    results = []
+
+    if stage == 'analyze_paper':
+        papers = upload_corpus(services, corpus, repeat, 'direct')
+        for name, copies in papers.items():
+            ops = [
+                (lambda paper=paper: bool(paper_analysis.analyze_paper(
+                    paper['paperId'], paper['fileUrl'], UPLOADER_ID, language,
+                    use_cache=False, analysis_mode=config['analysisMode']
+                ).get('aiAnalysis')))
+                for paper in copies
+            ]
+            results.append(measure(services, stage, name, ops, concurrency))
+
+    elif stage == 'generate_newspaper':
+        paper_ids = seed_analyzed_papers(services, config['papers'])
+        papers, _ = main.fetch_papers(services.firestore, paper_ids, newspaper_generator.PAPER_FIELDS)
+        for strategy in STRATEGIES:
+            ops = [
+                (lambda: bool(newspaper_generator.generate_newspaper_content(papers, {}, 'benchmark-newspaper', language, strategy=strategy)))
+                for _ in range(repeat)
+            ]
+            results.append(measure(services, stage, strategy, ops, concurrency))
+
+    elif stage == 'analyze_paper_http':
+        papers = upload_corpus(services, corpus, repeat, 'http')
+        for name, copies in papers.items():
+            ops = [
+                (lambda paper=paper: http_succeeded(*http_call(main.analyze_paper_http, {
+                    'paper_id': paper['paperId'],
+                    'file_url': paper['fileUrl'],
+                    'uploader_id': UPLOADER_ID,
+                    'language': language,
+                    'force_reanalyze': True,
+                })))
+                for paper in copies
+            ]
+            results.append(measure(services, stage, name, ops, concurrency))
+
+    elif stage == 'analyze_papers_batch_http':
+        papers = upload_corpus(services, corpus, repeat, 'batch')
+        ops = []
+        for copy_index in range(repeat):
+            items = [
+                {'paper_id': copies[copy_index]['paperId'], 'language': language, 'force_reanalyze': True}
+                for copies in papers.values()
+            ]
+            ops.append(lambda items=items: http_succeeded(*http_call(main.analyze_papers_batch_http, {'papers': items, 'max_concurrency': concurrency}, uid=UPLOADER_ID)))
+        # Papers of one batch run concurrently inside the handler; batches run one at a time
+        results.append(measure(services, stage, 'all', ops, 1))
+
+    elif stage in ('generate_newspaper_http', 'regenerate_newspaper_http'):
+        paper_ids = seed_analyzed_papers(services, config['papers'])
+        regenerate = stage == 'regenerate_newspaper_http'
+        for strategy in STRATEGIES:
+            newspaper_ids = seed_newspapers(services, paper_ids, strategy, language, repeat)
+            if regenerate:
+                # First generation is setup; the measured runs reuse its sections
+                for newspaper_id in newspaper_ids:
+                    http_call(main.generate_newspaper_http, {'newspaper_id': newspaper_id})
+            ops = [
+                (lambda newspaper_id=newspaper_id: http_succeeded(*http_call(main.generate_newspaper_http, {
+                    'newspaper_id': newspaper_id,
+                    'regenerate': regenerate,
+                })))
+                for newspaper_id in newspaper_ids
+            ]
+            results.append(measure(services, stage, strategy, ops, concurrency))
+
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+    return results
+
+def _child(queue, stage: str, config: Dict[str, Any], corpus: List[Dict[str, Any]], storage_root: str) -> None:
+    try:
+        queue.put(run_stage(stage, config, corpus, storage_root))
+    except Exception as e:
+        logging.exception(f"Stage {stage} failed")
+        queue.put([{'stage': stage, 'error': f"{type(e).__name__}: {e}"}])
+
+def run_isolated(stage: str, config: Dict[str, Any], corpus: List[Dict[str, Any]], storage_root: str) -> List[Dict[str, Any]]:
+    """Run a stage in a fresh spawned process and return its measurements"""
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(queue, stage, config, corpus, storage_root))
+    process.start()
+    results = queue.get()
+    process.join()
+    return results
+
+# ------------------------------------------------------------------ comparison
+
+def metric(result: Dict[str, Any], path: str) -> Any:
+    value = result
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part, 0 if part in ('calls', 'inputTokens', 'rpcs', 'documentWrites') else None)
+    return value
+
+def compare(before: Dict[str, Any], after: Dict[str, Any], threshold: float) -> Dict[str, Any]:
+    """Per stage/variant changes between two reports; regressions exceed threshold"""
+    previous = {(result['stage'], result.get('variant')): result for result in before.get('stages', [])}
+    changes, regressions = [], []
+    for result in after.get('stages', []):
+        key = (result['stage'], result.get('variant'))
+        if key not in previous:
+            continue
+        for path, higher_is_better in COMPARED_METRICS:
+            old, new = metric(previous[key], path), metric(result, path)
+            if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else None)
+            entry = {'stage': key[0], 'variant': key[1], 'metric': path, 'before': old, 'after': new, 'change': change}
+            changes.append(entry)
+            worse = (change is None and new > old) or (change is not None and (-change if higher_is_better else change) > threshold)
+            if worse:
+                regressions.append(entry)
+    return {
+        'before': before.get('commit'),
+        'after': after.get('commit'),
+        'threshold': threshold,
+        'regressions': regressions,
+        'changes': changes,
+    }
+
+# ------------------------------------------------------------------ parent side
+
+def git_commit() -> Any:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def write_json(data: Dict[str, Any], output: Any) -> None:
+    if output:
+        with open(output, 'w') as f:
+            json.dump(data, f, indent=2, default=str)
+            f.write('\n')
+    else:
+        json.dump(data, sys.stdout, indent=2, default=str)
+        sys.stdout.write('\n')
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma-separated stages to run')
+    parser.add_argument('--sizes', default=','.join(CORPUS_SIZES), help='comma-separated corpus sizes')
+    parser.add_argument('--pdf', action='append', default=[], help='also benchmark this PDF (repeatable)')
+    parser.add_argument('--repeat', type=int, default=3, help='operations per stage variant')
+    parser.add_argument('--concurrency', type=int, default=1, help='operations run at once')
+    parser.add_argument('--papers', type=int, default=5, help='papers per newspaper')
+    parser.add_argument('--language', default='ja', help='target language')
+    parser.add_argument('--analysis-mode', default='auto', help='analysis_mode for the analyze_paper stage')
+    parser.add_argument('--model-latency', type=float, default=0.0, help='seconds per model call')
+    parser.add_argument('--model-jitter', type=float, default=0.0, help='extra uniform random seconds per model call')
+    parser.add_argument('--model-latency-per-1k-tokens', type=float, default=0.0, help='extra seconds per 1000 input tokens')
+    parser.add_argument('--model-error-rate', type=float, default=0.0, help='fraction of model calls failing with ServiceUnavailable')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='fraction of model replies without JSON')
+    parser.add_argument('--embedding-latency', type=float, default=0.0, help='seconds per embedding call')
+    parser.add_argument('--firestore-latency', type=float, default=0.0, help='seconds per Firestore RPC')
+    parser.add_argument('--firestore-error-rate', type=float, default=0.0, help='fraction of Firestore RPCs failing')
+    parser.add_argument('--storage-latency', type=float, default=0.0, help='seconds per Storage request')
+    parser.add_argument('--storage-error-rate', type=float, default=0.0, help='fraction of Storage requests failing')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the corpus and injected errors')
+    parser.add_argument('--workdir', help='directory for the corpus and Storage objects (default: temporary)')
+    parser.add_argument('--log-level', default='ERROR', help='log level of the pipelines')
+    parser.add_argument('--output', help='write the report here instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two reports instead of running')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change counted as a regression by --compare')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            before = json.load(f)
+        with open(args.compare[1]) as f:
+            after = json.load(f)
+        comparison = compare(before, after, args.threshold)
+        write_json(comparison, args.output)
+        return 1 if comparison['regressions'] else 0
+
+    stages = [stage for stage in args.stages.split(',') if stage]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)} (choose from {', '.join(STAGES)})")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='pipeline-benchmark-')
+    corpus = generate_corpus(os.path.join(workdir, 'corpus'), [size for size in args.sizes.split(',') if size], args.seed)
+    for path in args.pdf:
+        name = os.path.splitext(os.path.basename(path))[0]
+        corpus.append({'name': name, 'size': 'file', 'path': path, 'pages': None, 'bytes': os.path.getsize(path)})
+
+    config = {
+        'repeat': max(1, args.repeat),
+        'concurrency': max(1, args.concurrency),
+        'papers': max(3, args.papers),
+        'language': args.language,
+        'analysisMode': args.analysis_mode,
+        'modelLatency': args.model_latency,
+        'modelJitter': args.model_jitter,
+        'modelLatencyPer1kTokens': args.model_latency_per_1k_tokens,
+        'modelErrorRate': args.model_error_rate,
+        'malformedRate': args.malformed_rate,
+        'embeddingLatency': args.embedding_latency,
+        'firestoreLatency': args.firestore_latency,
+        'firestoreErrorRate': args.firestore_error_rate,
+        'storageLatency': args.storage_latency,
+        'storageErrorRate': args.storage_error_rate,
+        'seed': args.seed,
+        'logLevel': args.log_level.upper(),
+    }
+
+    results = []
+    for stage in stages:
+        results.extend(run_isolated(stage, config, corpus, os.path.join(workdir, 'storage', stage)))
+
+    write_json({
+        'commit': git_commit(),
+        'createdAt': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'config': config,
+        'corpus': [{key: value for key, value in item.items() if key != 'path'} for item in corpus],
+        'stages': results,
+    }, args.output)
+    return 0 if all('error' not in result for result in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,31 +1,38 @@
 import logging
 import json
-from firebase_functions import https_fn
-from firebase_admin import initialize_app, firestore
-import google.cloud.logging
+import queue
+import threading
+from typing import Dict, Any, List, Optional, Tuple, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from firebase_functions import https_fn, firestore_fn, scheduler_fn
+from src import runtime
 
-# Initialize logging
-client = google.cloud.logging.Client()
-client.setup_logging()
-logging.basicConfig(level=logging.INFO)
-
-# Initialize Firebase Admin
-initialize_app()
-
-# Initialize Firestore
-db = firestore.client()
-
-# Import our modules
-from src.ai.paper_analysis import analyze_paper
-from src.utils.newspaper_generator import generate_newspaper_content
+# Cloud Logging, Firebase Admin, Firestore, Vertex AI and the analysis/generation
+# modules are initialized lazily by src.runtime on the code path that needs
+# them, so OPTIONS preflights and cold starts don't pay for them
 
 # Import API functions (if they're in the same directory)
 try:
     from api_upload_paper import upload_paper_api
     from api_create_newspaper import create_newspaper_api
+    from api_suggest_papers import suggest_papers_api
+    from api_upload_url import create_upload_url_api
+    from api_finalize_upload import finalize_upload_api
 except ImportError:
     pass  # These functions might be deployed separately
 
+# Bulk analysis limits
+BATCH_MAX_ITEMS = 50
+BATCH_DEFAULT_CONCURRENCY = 4
+BATCH_MAX_CONCURRENCY = 8
+
+# Background job workers: each invocation drains the queue until shortly
+# before the function timeout; max_instances bounds global LLM concurrency
+JOB_WORKER_TIMEOUT_SEC = 540
+JOB_WORKER_DRAIN_SECONDS = 480
+JOB_WORKER_CONCURRENCY = 2
+JOB_WORKER_MAX_INSTANCES = 10
+
 # CORS headers
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
@@ -34,6 +41,417 @@ CORS_HEADERS = {
     'Access-Control-Max-Age': '3600'
 }
 
+def fetch_papers(db, paper_ids: List[str], field_paths: Optional[List[str]] = None) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Fetch papers with a single batched get_all, optionally projected to field_paths.
+    When the embedding is requested it is read from the embedding documents
+    in the same call. Returns (papers in the order of paper_ids, IDs that
+    do not exist).
+    """
+    paper_store = runtime.timed_import('src.utils.paper_store')
+    paper_refs = [db.collection('papers').document(paper_id) for paper_id in paper_ids]
+    # Embeddings are in their own details documents; read them in the same call
+    embedding_refs = {}
+    if field_paths is None or 'embedding' in field_paths:
+        embedding_refs = {paper_id: paper_store.embedding_ref(db, paper_id) for paper_id in paper_ids}
+    snapshots = {doc.reference.path: doc for doc in db.get_all(paper_refs + list(embedding_refs.values()), field_paths=field_paths)}
+    
+    papers = []
+    missing_paper_ids = []
+    for paper_id, paper_ref in zip(paper_ids, paper_refs):
+        paper_doc = snapshots.get(paper_ref.path)
+        if paper_doc is not None and paper_doc.exists:
+            paper = {
+                'id': paper_id,
+                **paper_doc.to_dict()
+            }
+            embedding_doc = snapshots.get(embedding_refs[paper_id].path) if paper_id in embedding_refs else None
+            if embedding_doc is not None and embedding_doc.exists:
+                paper.update(embedding_doc.to_dict() or {})
+            papers.append(paper)
+        else:
+            missing_paper_ids.append(paper_id)
+    return papers, missing_paper_ids
+
+def save_paper_analysis(db, paper_id: str, result: Dict[str, Any], request_id: Optional[str] = None) -> None:
+    """
+    Store an analyze_paper result on the paper document and mark it
+    completed. With request_id the write only happens while that request
+    still holds the paper's processing lease.
+    """
+    from firebase_admin import firestore
+    paper_store = runtime.timed_import('src.utils.paper_store')
+    fields = {
+        'processingStatus': 'completed',
+        **paper_store.summary_fields(result),
+        'title': result['paperInfo'].get('title', ''),
+        'authors': result['paperInfo'].get('authors', []),
+        'journal': result['paperInfo'].get('journal', ''),
+        'publicationDate': result['paperInfo'].get('publicationDate', ''),
+        'doi': result['paperInfo'].get('doi', ''),
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+        # Papers analyzed before the split kept the embedding inline
+        'embedding': firestore.DELETE_FIELD,
+        'embeddingModel': firestore.DELETE_FIELD
+    }
+    # The full analysis (with the extracted text) and the embedding go to
+    # details documents, written together with the lean paper document
+    paper_ref = db.collection('papers').document(paper_id)
+    details = [(paper_store.analysis_details_ref(db, paper_id), {
+        **paper_store.details_document(result),
+        'updatedAt': firestore.SERVER_TIMESTAMP
+    })]
+    embedding = paper_store.embedding_document(result)
+    if embedding:
+        details.append((paper_store.embedding_ref(db, paper_id), embedding))
+    if request_id:
+        leases = runtime.timed_import('src.utils.leases')
+        if not leases.release_lease(db, paper_ref, request_id, fields, extra_sets=details):
+            return
+    else:
+        persistence = runtime.timed_import('src.utils.persistence')
+        writes = persistence.WriteGroup(db).update(paper_ref, fields)
+        for ref, data in details:
+            writes.set(ref, data)
+        writes.commit()
+    index_analyzed_paper(db, paper_id, result)
+
+def index_analyzed_paper(db, paper_id: str, result: Dict[str, Any]) -> None:
+    """Add the paper to its similarity indexes; failures only cost suggestions"""
+    if not result.get('embedding'):
+        return
+    try:
+        similarity_index = runtime.timed_import('src.utils.similarity_index')
+        snapshot = db.collection('papers').document(paper_id).get(field_paths=['uploaderId', 'groupIds'])
+        paper = {
+            **(snapshot.to_dict() or {}),
+            'embedding': result['embedding'],
+            'metadata': result['metadata'],
+            'aiAnalysis': result['aiAnalysis']
+        }
+        similarity_index.index_paper(paper_id, paper)
+    except Exception as e:
+        logging.error(f"Failed to index paper {paper_id}: {str(e)}")
+
+def public_analysis_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """analyze_paper result without binary fields, for JSON responses"""
+    return {key: value for key, value in result.items() if key != 'embedding'}
+
+def stored_analysis_result(db, paper_id: str, paper: Dict[str, Any]) -> Dict[str, Any]:
+    """Analysis result as stored for a completed paper (from its details document)"""
+    paper_store = runtime.timed_import('src.utils.paper_store')
+    details = paper_store.get_analysis_details(db, paper_id, paper) or {}
+    return {
+        'paperInfo': {field: paper.get(field) for field in paper_store.PAPER_INFO_FIELDS},
+        'metadata': details.get('metadata', {}),
+        'aiAnalysis': details.get('aiAnalysis', {})
+    }
+
+def deduplicated_response(claim: Dict[str, Any], doc_ref, wait: bool, build_result: Callable[[Dict[str, Any]], Any]) -> https_fn.Response:
+    """
+    Response for a caller whose document is already being processed by
+    another request (or was completed under the same request ID): the
+    stored result, or 202 with the current status unless wait is set and
+    the run finishes in time.
+    """
+    leases = runtime.timed_import('src.utils.leases')
+    document = claim['document']
+    if claim['state'] == leases.LEASE_IN_PROGRESS:
+        document = leases.wait_for_release(doc_ref) if wait else None
+        if document is None:
+            body = leases.in_progress_body(claim)
+            return https_fn.Response(
+                json.dumps(body),
+                202,
+                {'Content-Type': 'application/json', 'Retry-After': str(body['retryAfter']), **CORS_HEADERS}
+            )
+    
+    status = document.get('processingStatus')
+    if status != 'completed':
+        return https_fn.Response(
+            json.dumps({'error': document.get('processingError') or f'Processing ended with status {status}', 'deduplicated': True}),
+            500,
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
+    return https_fn.Response(
+        json.dumps({"success": True, "result": build_result(document), "deduplicated": True}, ensure_ascii=False),
+        200,
+        {'Content-Type': 'application/json', **CORS_HEADERS}
+    )
+
+def mark_paper_failed(db, paper_id: str, error: Exception, request_id: Optional[str] = None) -> None:
+    """
+    Mark a paper as failed; errors while updating are only logged. With
+    request_id only a run that still holds the lease can mark it failed.
+    """
+    from firebase_admin import firestore
+    try:
+        fields = {
+            'processingStatus': 'failed',
+            'processingError': str(error),
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        }
+        paper_ref = db.collection('papers').document(paper_id)
+        if request_id:
+            runtime.timed_import('src.utils.leases').release_lease(db, paper_ref, request_id, fields)
+        else:
+            paper_ref.update(fields)
+    except Exception as update_error:
+        logging.error(f"Failed to update paper status: {str(update_error)}")
+
+def mark_newspaper_failed(db, newspaper_id: str, error: Exception, request_id: Optional[str] = None) -> None:
+    """
+    Mark a newspaper as failed; errors while updating are only logged. With
+    request_id only a run that still holds the lease can mark it failed.
+    """
+    from firebase_admin import firestore
+    try:
+        fields = {
+            'processingStatus': 'failed',
+            'processingError': str(error),
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        }
+        newspaper_ref = db.collection('newspapers').document(newspaper_id)
+        if request_id:
+            runtime.timed_import('src.utils.leases').release_lease(db, newspaper_ref, request_id, fields)
+        else:
+            newspaper_ref.update(fields)
+    except Exception as update_error:
+        logging.error(f"Failed to update newspaper status: {str(update_error)}")
+
+class NewspaperRequestError(Exception):
+    """A newspaper cannot be generated as requested (maps to an HTTP error)"""
+    
+    def __init__(self, message: str, status: int = 400, details: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.status = status
+        self.details = details or {}
+
+class NewspaperBusyError(Exception):
+    """The newspaper is being generated by another request (or already was, under the same request ID)"""
+    
+    def __init__(self, claim: Dict[str, Any]):
+        super().__init__('Newspaper generation already in progress')
+        self.claim = claim
+
+def prepare_newspaper_generation(db, newspaper_id: str, request_id: Optional[str] = None, owner: str = 'generate_newspaper_http', regenerate: bool = False, refresh: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Claim the newspaper's processing lease (marking it processing), load
+    its papers and resolve the generation strategy. Raises
+    NewspaperBusyError if another request holds the lease and
+    NewspaperRequestError for invalid requests (releasing the lease).
+    With regenerate, the stored content and generation state are kept so
+    only changed sections (and those in refresh) are regenerated.
+    """
+    leases = runtime.timed_import('src.utils.leases')
+    request_id = request_id or leases.new_request_id()
+    newspaper_ref = db.collection('newspapers').document(newspaper_id)
+    
+    try:
+        claim = leases.claim_lease(db, newspaper_ref, request_id, owner)
+    except LookupError:
+        raise NewspaperRequestError(f'Newspaper {newspaper_id} not found', 404)
+    if claim['state'] != leases.LEASE_ACQUIRED:
+        raise NewspaperBusyError(claim)
+    
+    newspaper_data = claim['document']
+    try:
+        generation = load_newspaper_generation(db, newspaper_id, newspaper_data)
+        newspaper_generator = runtime.timed_import('src.utils.newspaper_generator')
+        unknown = [section for section in refresh or [] if section not in newspaper_generator.REFRESHABLE_SECTIONS and not section.startswith('subArticle:')]
+        if unknown:
+            raise NewspaperRequestError(f'Unknown sections to refresh: {unknown}')
+    except NewspaperRequestError as e:
+        mark_newspaper_failed(db, newspaper_id, e, request_id)
+        raise
+    return {
+        **generation,
+        'newspaperRef': newspaper_ref,
+        'requestId': request_id,
+        'storedContent': newspaper_data.get('content'),
+        'previousContent': newspaper_data.get('content') if regenerate else None,
+        'previousState': newspaper_data.get('generationState') if regenerate else None,
+        'refresh': list(refresh or [])
+    }
+
+def load_newspaper_generation(db, newspaper_id: str, newspaper_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Fetch the newspaper's papers and resolve the generation strategy"""
+    # Get papers
+    paper_ids = newspaper_data.get('selectedPapers', [])
+    if len(paper_ids) < 3:
+        raise NewspaperRequestError('At least 3 papers are required')
+        
+    # Fetch paper details in one batched read, limited to the fields the generator uses
+    newspaper_generator = runtime.timed_import('src.utils.newspaper_generator')
+    papers, missing_paper_ids = fetch_papers(db, paper_ids[:5], newspaper_generator.PAPER_FIELDS)  # Max 5 papers
+    if missing_paper_ids:
+        logging.warning(f"Papers not found for newspaper_id {newspaper_id}: {missing_paper_ids}")
+            
+    if len(papers) < 3:
+        raise NewspaperRequestError('Could not fetch enough valid papers', 400, {'missingPapers': missing_paper_ids})
+        
+    template = newspaper_data.get('template', {})
+    
+    # Generation strategy as resolved from the creator's tier when the
+    # newspaper was created; requests cannot override it
+    strategy = newspaper_data.get('generationStrategy') or 'standard'
+    if strategy not in newspaper_generator.GENERATION_STRATEGIES:
+        raise NewspaperRequestError(f'Unknown generation strategy: {strategy}')
+    
+    return {
+        'newspaperId': newspaper_id,
+        'papers': papers,
+        'missingPaperIds': missing_paper_ids,
+        'template': template,
+        'language': newspaper_data.get('language', 'ja'),
+        'strategy': strategy
+    }
+
+def run_newspaper_generation(db, generation: Dict[str, Any], on_section: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+    """Generate the newspaper, writing sections as they finish, and store the result"""
+    from firebase_admin import firestore
+    newspaper_generator = runtime.timed_import('src.utils.newspaper_generator')
+    progress = runtime.timed_import('src.utils.progress')
+    
+    leases = runtime.timed_import('src.utils.leases')
+    newspaper_ref = generation['newspaperRef']
+    request_id = generation['requestId']
+    # Sections are only written while this run holds the lease
+    progress_writer = progress.ThrottledDocumentWriter(
+        newspaper_ref,
+        write=lambda fields: leases.update_if_leased(db, newspaper_ref, request_id, fields)
+    )
+    record_progress = progress.NewspaperProgress(progress_writer)
+    
+    def handle_section(section, payload):
+        # Write each finished section to the document (throttled)
+        record_progress(section, payload)
+        if on_section:
+            on_section(section, payload)
+    
+    try:
+        result, state = newspaper_generator.generate_newspaper_sections(
+            generation['papers'],
+            generation['template'],
+            generation['newspaperId'],
+            generation['language'],
+            strategy=generation['strategy'],
+            on_section=handle_section,
+            previous_content=generation.get('previousContent'),
+            previous_state=generation.get('previousState'),
+            refresh=generation.get('refresh', [])
+        )
+    except Exception:
+        # Roll back the sections written so far to the content stored
+        # before this run; the caller then marks the newspaper failed
+        progress_writer.discard()
+        if progress_writer.writes:
+            try:
+                leases.update_if_leased(db, newspaper_ref, request_id, {
+                    'content': generation.get('storedContent') or firestore.DELETE_FIELD,
+                    'generationProgress': firestore.DELETE_FIELD
+                })
+            except Exception as e:
+                logging.error(f"Failed to roll back partial content of {generation['newspaperId']}: {str(e)}")
+        raise
+    
+    # Write the last pending sections, then the generated content;
+    # skipped if this run's lease expired and another run took over
+    progress_writer.flush()
+    leases.release_lease(db, newspaper_ref, request_id, {
+        'content': result,
+        'generationState': state,
+        'processingStatus': 'completed',
+        'updatedAt': firestore.SERVER_TIMESTAMP
+    })
+    
+    logging.info(f"Newspaper generation completed for newspaper_id: {generation['newspaperId']}")
+    return result
+
+def format_event(event: str, payload: Any) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def stream_events(run: Callable[[Callable[[str, Any], None]], Any], on_error: Callable[[Exception], None], extra: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    """
+    Run run(on_section) on a worker thread and yield a "section" event for
+    every section it reports, then "completed" (or "error").
+    """
+    events = queue.Queue()
+    
+    def worker():
+        try:
+            result = run(lambda section, payload: events.put(("section", {"section": section, "payload": payload})))
+            events.put(("completed", {"success": True, "result": result, **(extra or {})}))
+        except Exception as e:
+            logging.error(f"Error in streamed generation: {str(e)}")
+            on_error(e)
+            events.put(("error", {"error": str(e)}))
+        finally:
+            events.put(None)
+    
+    threading.Thread(target=worker, daemon=True).start()
+    while True:
+        item = events.get()
+        if item is None:
+            break
+        yield format_event(*item)
+
+def analyze_batch_item(db, item: Dict[str, Any], uid: str) -> Dict[str, Any]:
+    """
+    Analyze one of uid's papers and persist its result or failure
+    immediately. The file and uploader are taken from the paper document,
+    not from the request.
+    """
+    if not isinstance(item, dict):
+        return {'paperId': None, 'success': False, 'error': 'Invalid batch item'}
+    
+    paper_id = item.get("paper_id")
+    if not paper_id:
+        return {'paperId': paper_id, 'success': False, 'error': 'Missing required parameters'}
+    
+    paper_ref = db.collection('papers').document(paper_id)
+    paper = paper_ref.get(field_paths=['uploaderId', 'fileUrl'])
+    if not paper.exists or paper.get('uploaderId') != uid or item.get('uploader_id', uid) != uid:
+        return {'paperId': paper_id, 'success': False, 'error': 'Paper not found'}
+    
+    leases = runtime.timed_import('src.utils.leases')
+    request_id = leases.new_request_id()
+    try:
+        claim = leases.claim_lease(db, paper_ref, request_id, 'analyze_papers_batch_http')
+        if claim['state'] != leases.LEASE_ACQUIRED:
+            return {'paperId': paper_id, 'success': False, 'error': 'Analysis already in progress', 'status': 'processing'}
+        
+        paper_analysis = runtime.timed_import('src.ai.paper_analysis')
+        result = paper_analysis.analyze_paper(
+            paper_id,
+            claim['document']['fileUrl'],
+            uid,
+            item.get("language", "ja"),
+            use_cache=not item.get("force_reanalyze", False)
+        )
+        save_paper_analysis(db, paper_id, result, request_id)
+        return {'paperId': paper_id, 'success': True, 'result': public_analysis_result(result)}
+    except Exception as e:
+        logging.error(f"Error analyzing paper {paper_id} in batch: {str(e)}")
+        mark_paper_failed(db, paper_id, e, request_id)
+        return {'paperId': paper_id, 'success': False, 'error': str(e)}
+
+def run_analysis_batch(db, items: List[Dict[str, Any]], uid: str, max_concurrency: int = BATCH_DEFAULT_CONCURRENCY) -> List[Dict[str, Any]]:
+    """
+    Analyze uid's papers on a bounded thread pool.
+    Downloads and PDF parsing of one paper overlap with LLM calls of the
+    others; each paper's Firestore status is written as soon as it finishes.
+    Results are returned in request order.
+    """
+    max_concurrency = max(1, min(max_concurrency, BATCH_MAX_CONCURRENCY, len(items)))
+    results = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {executor.submit(analyze_batch_item, db, item, uid): i for i, item in enumerate(items)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
 @https_fn.on_request(
     memory=512,  # 512MB
     timeout_sec=540,  # 9 minutes
@@ -55,6 +473,9 @@ def analyze_paper_http(req: https_fn.Request) -> https_fn.Response:
             {'Content-Type': 'application/json', **CORS_HEADERS}
         )
     
+    runtime.start_request()
+    db = runtime.get_firestore()
+    
     try:
         # Parse request data
         data = req.get_json()
@@ -70,6 +491,7 @@ def analyze_paper_http(req: https_fn.Request) -> https_fn.Response:
         file_url = data.get("file_url")  
         uploader_id = data.get("uploader_id")
         target_language = data.get("language", "ja")
+        use_cache = not data.get("force_reanalyze", False)
         
         logging.info(f"analyze_paper_http called with paper_id: {paper_id}")
         
@@ -79,28 +501,34 @@ def analyze_paper_http(req: https_fn.Request) -> https_fn.Response:
                 400, 
                 {'Content-Type': 'application/json', **CORS_HEADERS}
             )
+        
+        # Single flight: only the request holding the paper's lease runs the analysis
+        leases = runtime.timed_import('src.utils.leases')
+        request_id = leases.request_id_from(req, data)
+        paper_ref = db.collection('papers').document(paper_id)
+        try:
+            claim = leases.claim_lease(db, paper_ref, request_id, 'analyze_paper_http')
+        except LookupError:
+            return https_fn.Response(
+                json.dumps({'error': f'Paper {paper_id} not found'}), 
+                404, 
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+        if claim['state'] != leases.LEASE_ACQUIRED:
+            logging.info(f"Paper {paper_id} is already being analyzed ({claim['state']}), not starting another run")
+            return deduplicated_response(claim, paper_ref, data.get('wait', False), lambda paper: stored_analysis_result(db, paper_id, paper))
             
         # Perform analysis
-        result = analyze_paper(paper_id, file_url, uploader_id, target_language)
+        paper_analysis = runtime.timed_import('src.ai.paper_analysis')
+        result = paper_analysis.analyze_paper(paper_id, file_url, uploader_id, target_language, use_cache=use_cache)
         
         # Update Firestore
-        paper_ref = db.collection('papers').document(paper_id)
-        paper_ref.update({
-            'processingStatus': 'completed',
-            'metadata': result['metadata'],
-            'aiAnalysis': result['aiAnalysis'],
-            'title': result['paperInfo'].get('title', ''),
-            'authors': result['paperInfo'].get('authors', []),
-            'journal': result['paperInfo'].get('journal', ''),
-            'publicationDate': result['paperInfo'].get('publicationDate', ''),
-            'doi': result['paperInfo'].get('doi', ''),
-            'updatedAt': firestore.SERVER_TIMESTAMP
-        })
+        save_paper_analysis(db, paper_id, result, request_id)
         
         logging.info(f"Paper analysis completed for paper_id: {paper_id}")
         
         return https_fn.Response(
-            json.dumps({"success": True, "result": result}),
+            json.dumps({"success": True, "result": public_analysis_result(result)}),
             200,
             {'Content-Type': 'application/json', **CORS_HEADERS}
         )
@@ -108,16 +536,9 @@ def analyze_paper_http(req: https_fn.Request) -> https_fn.Response:
     except Exception as e:
         logging.error(f"Error in analyze_paper_http: {str(e)}")
         
-        # Update paper status to failed
-        if 'paper_id' in locals() and paper_id:
-            try:
-                db.collection('papers').document(paper_id).update({
-                    'processingStatus': 'failed',
-                    'processingError': str(e),
-                    'updatedAt': firestore.SERVER_TIMESTAMP
-                })
-            except Exception as update_error:
-                logging.error(f"Failed to update paper status: {str(update_error)}")
+        # Update paper status to failed (only if this request holds the lease)
+        if 'request_id' in locals() and paper_id:
+            mark_paper_failed(db, paper_id, e, request_id)
                 
         return https_fn.Response(
             json.dumps({'error': str(e)}),
@@ -125,6 +546,97 @@ def analyze_paper_http(req: https_fn.Request) -> https_fn.Response:
             {'Content-Type': 'application/json', **CORS_HEADERS}
         )
 
+@https_fn.on_request(
+    memory=1024,  # Several PDFs are held in memory at once
+    timeout_sec=540,  # 9 minutes
+    region="us-central1"
+)
+def analyze_papers_batch_http(req: https_fn.Request) -> https_fn.Response:
+    """
+    Analyze several of the caller's papers in one invocation with bounded
+    concurrency. Requires a Firebase ID token (Authorization: Bearer).
+    Body: {"papers": [{paper_id, language, force_reanalyze?}], "max_concurrency": 4}
+    One failing paper does not fail the batch; per-item results are returned.
+    """
+    # Handle preflight OPTIONS request
+    if req.method == 'OPTIONS':
+        return https_fn.Response('', 204, CORS_HEADERS)
+    
+    # Only allow POST requests
+    if req.method != 'POST':
+        return https_fn.Response(
+            json.dumps({'error': 'Method not allowed'}), 
+            405, 
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
+    
+    runtime.start_request()
+    db = runtime.get_firestore()
+    
+    # Auth check
+    auth_header = req.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return https_fn.Response(
+            json.dumps({'error': 'Unauthorized'}),
+            401,
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
+    try:
+        from firebase_admin import auth
+        uid = auth.verify_id_token(auth_header.split(' ')[1])['uid']
+    except Exception as e:
+        logging.warning(f"Rejected batch analysis token: {str(e)}")
+        return https_fn.Response(
+            json.dumps({'error': 'Unauthorized'}),
+            401,
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
+    
+    try:
+        data = req.get_json()
+        items = data.get("papers") if data else None
+        if not items or not isinstance(items, list):
+            return https_fn.Response(
+                json.dumps({'error': 'Invalid request data'}), 
+                400, 
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+        
+        if len(items) > BATCH_MAX_ITEMS:
+            return https_fn.Response(
+                json.dumps({'error': f'At most {BATCH_MAX_ITEMS} papers per batch'}), 
+                400, 
+                {'Content-Type': 'application/json', **CORS_HEADERS}
+            )
+        
+        max_concurrency = int(data.get("max_concurrency") or BATCH_DEFAULT_CONCURRENCY)
+        logging.info(f"analyze_papers_batch_http called with {len(items)} papers (concurrency {max_concurrency})")
+        
+        results = run_analysis_batch(db, items, uid, max_concurrency)
+        succeeded = sum(1 for item_result in results if item_result['success'])
+        
+        logging.info(f"Batch analysis finished: {succeeded}/{len(results)} succeeded")
+        logging.info(f"Vertex AI limiter: {runtime.get_rate_limiter().get_stats()}")
+        
+        return https_fn.Response(
+            json.dumps({
+                "success": succeeded == len(results),
+                "succeeded": succeeded,
+                "failed": len(results) - succeeded,
+                "results": results
+            }),
+            200,
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
+        
+    except Exception as e:
+        logging.error(f"Error in analyze_papers_batch_http: {str(e)}")
+        return https_fn.Response(
+            json.dumps({'error': str(e)}),
+            500,
+            {'Content-Type': 'application/json', **CORS_HEADERS}
+        )
+
 @https_fn.on_request(
     memory=512,  # 512MB
     timeout_sec=540,  # 9 minutes  
@@ -133,6 +645,9 @@ def analyze_paper_http(req: https_fn.Request) -> https_fn.Response:
 def generate_newspaper_http(req: https_fn.Request) -> https_fn.Response:
     """
     HTTP version of generate_newspaper_function with manual CORS handling
+    Body: {"newspaper_id", "stream"?, "regenerate"?, "refresh"?}
+    regenerate reuses stored sections whose inputs are unchanged; refresh
+    forces sections to be regenerated (e.g. ["subArticle:<paperId>"]).
     """
     # Handle preflight OPTIONS request
     if req.method == 'OPTIONS':
@@ -146,6 +661,9 @@ def generate_newspaper_http(req: https_fn.Request) -> https_fn.Response:
             {'Content-Type': 'application/json', **CORS_HEADERS}
         )
     
+    runtime.start_request()
+    db = runtime.get_firestore()
+    
     try:
         # Parse request data
         data = req.get_json()
@@ -167,67 +685,42 @@ def generate_newspaper_http(req: https_fn.Request) -> https_fn.Response:
             
         logging.info(f"Starting newspaper generation for newspaper_id: {newspaper_id}")
         
-        # Get newspaper document
-        newspaper_ref = db.collection('newspapers').document(newspaper_id)
-        newspaper_doc = newspaper_ref.get()
-        
-        if not newspaper_doc.exists:
+        request_id = runtime.timed_import('src.utils.leases').request_id_from(req, data)
+        try:
+            generation = prepare_newspaper_generation(
+                db,
+                newspaper_id,
+                request_id,
+                regenerate=bool(data.get('regenerate')),
+                refresh=data.get('refresh') or []
+            )
+        except NewspaperBusyError as e:
+            logging.info(f"Newspaper {newspaper_id} is already being generated ({e.claim['state']}), not starting another run")
+            newspaper_ref = db.collection('newspapers').document(newspaper_id)
+            return deduplicated_response(e.claim, newspaper_ref, data.get('wait', False), lambda newspaper: newspaper.get('content'))
+        except NewspaperRequestError as e:
             return https_fn.Response(
-                json.dumps({'error': f'Newspaper {newspaper_id} not found'}), 
-                404, 
+                json.dumps({'error': str(e), **e.details}), 
+                e.status, 
                 {'Content-Type': 'application/json', **CORS_HEADERS}
             )
-            
-        newspaper_data = newspaper_doc.to_dict()
+        missing_paper_ids = generation['missingPaperIds']
         
-        # Update status to processing
-        newspaper_ref.update({
-            'processingStatus': 'processing',
-            'updatedAt': firestore.SERVER_TIMESTAMP
-        })
+        def run_generation(on_section=None):
+            return run_newspaper_generation(db, generation, on_section)
         
-        # Get papers
-        paper_ids = newspaper_data.get('selectedPapers', [])
-        if len(paper_ids) < 3:
+        # Optional Server-Sent Events mode: each section is sent as it is ready
+        if data.get("stream") or 'text/event-stream' in req.headers.get('Accept', ''):
             return https_fn.Response(
-                json.dumps({'error': 'At least 3 papers are required'}), 
-                400, 
-                {'Content-Type': 'application/json', **CORS_HEADERS}
+                stream_events(run_generation, lambda e: mark_newspaper_failed(db, newspaper_id, e, request_id), {"missingPapers": missing_paper_ids}),
+                200,
+                {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', **CORS_HEADERS}
             )
-            
-        # Fetch paper details
-        papers = []
-        for paper_id in paper_ids[:5]:  # Max 5 papers
-            paper_doc = db.collection('papers').document(paper_id).get()
-            if paper_doc.exists:
-                papers.append({
-                    'id': paper_id,
-                    **paper_doc.to_dict()
-                })
-                
-        if len(papers) < 3:
-            return https_fn.Response(
-                json.dumps({'error': 'Could not fetch enough valid papers'}), 
-                400, 
-                {'Content-Type': 'application/json', **CORS_HEADERS}
-            )
-            
-        # Generate content
-        template = newspaper_data.get('template', {})
-        language = newspaper_data.get('language', 'ja')
-        result = generate_newspaper_content(papers, template, newspaper_id, language)
-        
-        # Update newspaper with generated content
-        newspaper_ref.update({
-            'content': result,
-            'processingStatus': 'completed',
-            'updatedAt': firestore.SERVER_TIMESTAMP
-        })
         
-        logging.info(f"Newspaper generation completed for newspaper_id: {newspaper_id}")
+        result = run_generation()
         
         return https_fn.Response(
-            json.dumps({"success": True, "result": result}),
+            json.dumps({"success": True, "result": result, "missingPapers": missing_paper_ids}),
             200,
             {'Content-Type': 'application/json', **CORS_HEADERS}
         )
@@ -235,19 +728,142 @@ def generate_newspaper_http(req: https_fn.Request) -> https_fn.Response:
     except Exception as e:
         logging.error(f"Error in generate_newspaper_http: {str(e)}")
         
-        # Update newspaper status to failed
-        if 'newspaper_id' in locals() and newspaper_id:
-            try:
-                db.collection('newspapers').document(newspaper_id).update({
-                    'processingStatus': 'failed',
-                    'processingError': str(e),
-                    'updatedAt': firestore.SERVER_TIMESTAMP
-                })
-            except Exception as update_error:
-                logging.error(f"Failed to update newspaper status: {str(update_error)}")
+        # Update newspaper status to failed (only if this request holds the lease)
+        if 'request_id' in locals():
+            mark_newspaper_failed(db, newspaper_id, e, request_id)
                 
         return https_fn.Response(
             json.dumps({'error': str(e)}),
             500,
             {'Content-Type': 'application/json', **CORS_HEADERS}
-        )
\ No newline at end of file
+        )
+
+def wait_for_other_run(doc_ref, claim: Dict[str, Any]) -> None:
+    """
+    Job side of single flight: wait for the run holding the lease to
+    finish; if it does not finish in time, fail the attempt so the job is
+    retried after backoff.
+    """
+    leases = runtime.timed_import('src.utils.leases')
+    if claim['state'] == leases.LEASE_IN_PROGRESS and leases.wait_for_release(doc_ref) is None:
+        raise RuntimeError(f"{doc_ref.id} is still being processed by request {claim['lease'].get('requestId')}")
+
+def run_analyze_paper_job(payload: Dict[str, Any]) -> None:
+    """Job handler: analyze one paper and store the result"""
+    from src.jobs.worker import PermanentJobError
+    db = runtime.get_firestore()
+    leases = runtime.timed_import('src.utils.leases')
+    paper_id = payload['paper_id']
+    paper_ref = db.collection('papers').document(paper_id)
+    request_id = leases.new_request_id()
+    try:
+        claim = leases.claim_lease(db, paper_ref, request_id, 'analyze_paper_job')
+    except LookupError as e:
+        raise PermanentJobError(str(e))
+    if claim['state'] != leases.LEASE_ACQUIRED:
+        wait_for_other_run(paper_ref, claim)
+        return
+    
+    try:
+        paper_analysis = runtime.timed_import('src.ai.paper_analysis')
+        result = paper_analysis.analyze_paper(
+            paper_id,
+            payload['file_url'],
+            payload['uploader_id'],
+            payload.get('language', 'ja')
+        )
+    except Exception:
+        # Let the next attempt claim the paper without waiting for expiry
+        leases.release_lease(db, paper_ref, request_id, {'processingStatus': 'processing'})
+        raise
+    save_paper_analysis(db, paper_id, result, request_id)
+
+def run_generate_newspaper_job(payload: Dict[str, Any]) -> None:
+    """Job handler: generate one newspaper and store the result"""
+    from src.jobs.worker import PermanentJobError
+    db = runtime.get_firestore()
+    try:
+        generation = prepare_newspaper_generation(
+            db,
+            payload['newspaper_id'],
+            owner='generate_newspaper_job',
+            regenerate=bool(payload.get('regenerate')),
+            refresh=payload.get('refresh') or []
+        )
+    except NewspaperRequestError as e:
+        raise PermanentJobError(str(e))
+    except NewspaperBusyError as e:
+        wait_for_other_run(db.collection('newspapers').document(payload['newspaper_id']), e.claim)
+        return
+    try:
+        run_newspaper_generation(db, generation)
+    except Exception:
+        # Let the next attempt claim the newspaper without waiting for expiry
+        runtime.timed_import('src.utils.leases').release_lease(db, generation['newspaperRef'], generation['requestId'], {'processingStatus': 'processing'})
+        raise
+
+JOB_HANDLERS = {
+    'analyze_paper': run_analyze_paper_job,
+    'generate_newspaper': run_generate_newspaper_job
+}
+
+JOB_DEAD_HANDLERS = {
+    'analyze_paper': lambda payload, error: mark_paper_failed(runtime.get_firestore(), payload['paper_id'], Exception(error)),
+    'generate_newspaper': lambda payload, error: mark_newspaper_failed(runtime.get_firestore(), payload['newspaper_id'], Exception(error))
+}
+
+def drain_job_queue() -> Dict[str, int]:
+    """Run a worker over the job queue until it is empty or time runs out"""
+    import time
+    from src.jobs.worker import JobWorker
+    runtime.start_request()
+    worker = JobWorker(
+        runtime.get_job_backend(),
+        JOB_HANDLERS,
+        on_dead=JOB_DEAD_HANDLERS,
+        concurrency=JOB_WORKER_CONCURRENCY
+    )
+    started_at = time.time()
+    stats = worker.run(
+        deadline=started_at + JOB_WORKER_DRAIN_SECONDS,
+        lease_deadline=started_at + JOB_WORKER_TIMEOUT_SEC
+    )
+    logging.info(f"Job worker {worker.worker_id} finished: {stats}")
+    logging.info(f"Vertex AI limiter: {runtime.get_rate_limiter().get_stats()}")
+    return stats
+
+@firestore_fn.on_document_created(
+    document="jobs/{jobId}",
+    memory=1024,
+    timeout_sec=JOB_WORKER_TIMEOUT_SEC,
+    max_instances=JOB_WORKER_MAX_INSTANCES,
+    region="us-central1"
+)
+def process_jobs_on_enqueue(event: firestore_fn.Event) -> None:
+    """Start a worker as soon as a job is enqueued"""
+    drain_job_queue()
+
+@scheduler_fn.on_schedule(
+    schedule="every 5 minutes",
+    memory=1024,
+    timeout_sec=JOB_WORKER_TIMEOUT_SEC,
+    region="us-central1"
+)
+def process_jobs_scheduled(event: scheduler_fn.ScheduledEvent) -> None:
+    """Pick up retries whose backoff has elapsed and jobs with expired leases"""
+    drain_job_queue()
+
+@scheduler_fn.on_schedule(
+    schedule="every 24 hours",
+    memory=512,
+    timeout_sec=JOB_WORKER_TIMEOUT_SEC,
+    region="us-central1"
+)
+def invalidate_analysis_cache_scheduled(event: scheduler_fn.ScheduledEvent) -> None:
+    """Drop cached analyses from older prompt versions (the first run after a deploy that bumps it)"""
+    runtime.start_request()
+    paper_analysis = runtime.timed_import('src.ai.paper_analysis')
+    deleted = paper_analysis.invalidate_analysis_cache()
+    logging.info(f"Analysis cache sweep deleted {deleted} entries")
+
+runtime.mark_module_loaded()
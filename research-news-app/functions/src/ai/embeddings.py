@@ -0,0 +1,105 @@
+import logging
+from typing import Dict, Any, List, Optional
+import numpy as np
+from src import runtime
+from src.ai.vertex_client import estimate_tokens
+
+# Multilingual model so Japanese and English papers share one space
+EMBEDDING_MODEL_NAME = "text-multilingual-embedding-002"
+EMBEDDING_TASK_TYPE = "SEMANTIC_SIMILARITY"
+
+# The model reads about 2048 tokens; the analysis fields fit well within
+EMBEDDING_TEXT_CHARS = 6000
+
+# Stored on the paper as little-endian float32 bytes (768 dims = 3KB)
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+def build_embedding_text(result: Dict[str, Any]) -> str:
+    """Text that represents an analyzed paper: title, abstract and AI analysis"""
+    paper_info = result.get('paperInfo', {})
+    metadata = result.get('metadata', {})
+    ai_analysis = result.get('aiAnalysis', {})
+    parts = [
+        paper_info.get('title', ''),
+        metadata.get('abstract', ''),
+        ai_analysis.get('summary', ''),
+        ' '.join(ai_analysis.get('keypoints', [])),
+        ', '.join(metadata.get('keywords', [])),
+        ', '.join(ai_analysis.get('relatedTopics', [])),
+        ai_analysis.get('academicField', '')
+    ]
+    return '\n'.join(part for part in parts if part)[:EMBEDDING_TEXT_CHARS]
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scale each row to unit length (zero rows stay zero)"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Embed texts with Vertex AI; returns unit-length float32 rows"""
+    from vertexai.language_models import TextEmbeddingInput
+    model = runtime.get_embedding_model(EMBEDDING_MODEL_NAME)
+    inputs = [TextEmbeddingInput(text[:EMBEDDING_TEXT_CHARS], EMBEDDING_TASK_TYPE) for text in texts]
+    embeddings = runtime.get_rate_limiter('embeddings').call(
+        lambda: model.get_embeddings(inputs),
+        sum(estimate_tokens(text) for text in texts)
+    )
+    return normalize_rows(np.array([embedding.values for embedding in embeddings], dtype=np.float32))
+
+def encode_embedding(vector: np.ndarray) -> bytes:
+    """Compact byte form stored on the paper document"""
+    return np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes()
+
+def decode_embedding(data: Optional[bytes]) -> Optional[np.ndarray]:
+    """Inverse of encode_embedding; None for missing or empty data"""
+    if not data:
+        return None
+    return np.frombuffer(bytes(data), dtype=EMBEDDING_DTYPE)
+
+def embed_analysis(result: Dict[str, Any]) -> Optional[bytes]:
+    """Encoded embedding of an analyze_paper result, or None if embedding fails"""
+    try:
+        return encode_embedding(embed_texts([build_embedding_text(result)])[0])
+    except Exception as e:
+        logging.error(f"Paper embedding failed: {str(e)}")
+        return None
+
+def stack_embeddings(papers: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+    """(n, d) matrix of the papers' embeddings, or None unless all have one of the same size"""
+    vectors = [decode_embedding(paper.get('embedding')) for paper in papers]
+    if not vectors or any(vector is None for vector in vectors):
+        return None
+    if len({len(vector) for vector in vectors}) != 1:
+        return None
+    return np.vstack(vectors)
+
+def cosine_similarity_matrix(vectors: np.ndarray) -> np.ndarray:
+    """Pairwise cosine similarity of the rows"""
+    normalized = normalize_rows(np.asarray(vectors, dtype=np.float32))
+    return normalized @ normalized.T
+
+def rank_papers(vectors: np.ndarray) -> Dict[str, Any]:
+    """
+    Newspaper structure from embeddings: the most central paper (highest
+    mean similarity to the others) is the main article and the rest follow
+    in order of similarity to it. Ties go to the lower index, so the
+    result is deterministic.
+    """
+    similarity = cosine_similarity_matrix(vectors)
+    count = len(similarity)
+    centrality = (similarity.sum(axis=1) - np.diag(similarity)) / max(1, count - 1)
+    main_paper_idx = int(np.argmax(centrality))
+    sub_article_order = sorted(
+        (i for i in range(count) if i != main_paper_idx),
+        key=lambda i: (-similarity[main_paper_idx, i], i)
+    )
+    return {
+        "mainPaperIndex": main_paper_idx,
+        "subArticleOrder": sub_article_order,
+        "connectionMap": {
+            f"{i}-{j}": round(float(similarity[i, j]), 3)
+            for i in range(count) for j in range(i + 1, count)
+        },
+        "centrality": [round(float(value), 3) for value in centrality]
+    }
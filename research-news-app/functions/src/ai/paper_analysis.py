@@ -1,212 +1,801 @@
 import logging
-import tempfile
+import io
 import os
-from typing import Dict, Any, List
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Tuple, Union, BinaryIO, Iterator, Optional
 import PyPDF2
-from google.cloud import storage, aiplatform
-from google.cloud import secretmanager
-import vertexai
-from vertexai.generative_models import GenerativeModel, Part
+from vertexai.generative_models import Part
 from langdetect import detect
 import json
 import urllib.parse
+from src import runtime
+from src.ai import pdf_workers
+from src.ai.vertex_client import estimate_tokens, CHARS_PER_TOKEN, DEFAULT_OUTPUT_TOKENS
+from src.ai.embeddings import embed_analysis, EMBEDDING_MODEL_NAME
+from src.utils.analysis_cache import analysis_cache, compute_pdf_hash
 
-# Initialize clients
-storage_client = storage.Client()
-secret_client = secretmanager.SecretManagerServiceClient()
+# Bump ANALYSIS_PROMPT_VERSION whenever the analysis prompt or output schema
+# changes so cached results from the old prompt are no longer served
+ANALYSIS_MODEL_NAME = runtime.DEFAULT_MODEL_NAME
+ANALYSIS_PROMPT_VERSION = "4"
+ANALYSIS_CACHE_VERSION = f"{ANALYSIS_MODEL_NAME}:{ANALYSIS_PROMPT_VERSION}"
+
+# Upper bound on extracted characters; section selection needs the whole
+# paper (results and conclusions sit near the end), so this only guards
+# against very large documents
+ANALYSIS_TEXT_CHARS = 300000
+
+# Input tokens of paper text sent with the analysis prompt
+ANALYSIS_TOKEN_BUDGET = 3500
+
+# Section selection: text before the first heading (title, authors,
+# venue) is capped, no section may take more than its share of the
+# budget on the first pass, and slivers smaller than the minimum are
+# not worth including
+PREAMBLE_MAX_TOKENS = 500
+SECTION_MAX_SHARE = 0.35
+MIN_SECTION_TOKENS = 120
+
+# Heading keywords per canonical section, in matching order (more
+# specific names first, e.g. 実験結果 before 実験)
+SECTION_HEADINGS = [
+    ('conclusion', r'conclusions?|concluding\s+remarks|summary\s+and\s+conclusions?|結論|まとめ|おわりに|むすび|結言'),
+    ('results', r'results?(?:\s+and\s+discussion)?|evaluation|experimental\s+results|findings|実験結果|結果|評価'),
+    ('discussion', r'discussion|考察|議論'),
+    ('abstract', r'abstract|要旨|概要|要約|アブストラクト'),
+    ('introduction', r'introduction|はじめに|序論|緒言|まえがき'),
+    ('related', r'related\s+work|background|prior\s+work|literature\s+review|関連研究|研究背景|背景'),
+    ('methods', r'materials\s+and\s+methods|methods?|methodology|proposed\s+method|approach|experiments?|experimental\s+setup|提案手法|手法|方法|実験'),
+    ('references', r'references|bibliography|works\s+cited|参考文献|引用文献'),
+    ('acknowledgments', r'acknowledge?ments?|謝辞'),
+    ('appendix', r'appendix|appendices|supplementary\s+material|付録'),
+]
+
+# Optional numbering before a heading: "3", "3.2", "IV.", "第3章", "３．"
+HEADING_NUMBER = r'(?:(?:[0-9０-９]+(?:[.．][0-9０-９]+)*|[IVX]+)[.．)]?\s*|第\s*[0-9０-９]+\s*[章節]\s*)?'
+HEADING_PATTERNS = [
+    (name, re.compile(rf'^{HEADING_NUMBER}(?:{keywords})(?![A-Za-z])(?P<rest>.*)$', re.IGNORECASE))
+    for name, keywords in SECTION_HEADINGS
+]
+HEADING_MAX_CHARS = 60
+
+# Most informative first; anything else ranks after discussion
+SECTION_PRIORITY = {
+    'preamble': 0,
+    'abstract': 1,
+    'conclusion': 2,
+    'results': 3,
+    'introduction': 4,
+    'discussion': 5,
+    'methods': 6,
+    'related': 8,
+}
+OTHER_SECTION_PRIORITY = 7
+DROPPED_SECTIONS = {'references', 'acknowledgments', 'appendix'}
+
+# Analysis modes: "native" sends the PDF itself to Gemini, "select" packs
+# key sections of the extracted text into one prompt, "map_reduce"
+# summarizes every chunk of the text in parallel and analyzes the notes;
+# "auto" picks native only when the text layer is unusable (scanned or
+# garbled), otherwise map_reduce for long papers and select for the rest
+ANALYSIS_MODES = ("auto", "native", "select", "map_reduce")
+MAP_REDUCE_MIN_TOKENS = 4 * ANALYSIS_TOKEN_BUDGET
+
+# Map step: chunk size grows so long papers stay within MAP_MAX_CHUNKS
+# calls; each chunk yields at most MAP_NOTE_TOKENS of notes
+MAP_CHUNK_TOKENS = 6000
+MAP_MAX_CHUNKS = 12
+MAP_NOTE_TOKENS = 700
+MAP_MAX_WORKERS = 6
+
+# Native ingestion limits (Gemini accepts up to 1000 pages / 50MB per
+# PDF). Files up to NATIVE_INLINE_MAX_BYTES are sent inline, larger ones
+# by their gs:// URI. Every page costs NATIVE_TOKENS_PER_PAGE however
+# little of it the analysis needs, so auto mode prefers the text paths
+NATIVE_MAX_PAGES = 1000
+NATIVE_MAX_BYTES = 50 * 1024 * 1024
+NATIVE_INLINE_MAX_BYTES = 7 * 1024 * 1024
+NATIVE_TOKENS_PER_PAGE = 258
+
+# Characters still extracted locally on the native path
+# (stored excerpt: 5000, language detection: 1000)
+NATIVE_EXCERPT_CHARS = 5000
+
+# Less extracted text than this (in total, or per page on average) means
+# there is no usable text layer; more unreadable characters (control,
+# private-use, U+FFFD) than this share means the fonts were not decoded
+SCANNED_TEXT_MIN_CHARS = 200
+LOW_TEXT_CHARS_PER_PAGE = 300
+GARBLED_TEXT_MAX_RATIO = 0.05
+
+# Heading for the paper text in the analysis prompt, per mode
+ANALYSIS_TEXT_LABELS = {
+    'native': {
+        'en': 'The paper is the attached PDF document.',
+        'ja': '論文は添付のPDFファイルです。'
+    },
+    'select': {
+        'en': 'Paper text (key sections):',
+        'ja': '論文テキスト（主要セクションの抜粋）:'
+    },
+    'map_reduce': {
+        'en': 'Notes on each part of the paper, in document order:',
+        'ja': '論文の各部分の要点（文書の順番通り）:'
+    }
+}
+
+# Lines that carry no content (page numbers, arXiv stamps, licences)
+BOILERPLATE_PATTERN = re.compile(
+    r'^(?:\d{1,4}|page\s*\d+(?:\s*(?:of|/)\s*\d+)?|-\s*\d+\s*-)$'
+    r'|arxiv:\s*\d{4}\.\d{4,5}'
+    r'|©|\bcopyright\b|all rights reserved|creative commons|licensed under'
+    r'|^downloaded from\b|^preprint\b',
+    re.IGNORECASE
+)
+# Short lines repeated this often are running headers/footers
+RUNNING_HEADER_MIN_REPEATS = 3
+
+# Parallel extraction limits: a worker is only worth its process start-up
+# for a reasonable number of pages, and each worker re-parses the PDF
+PARALLEL_MIN_PAGES_PER_WORKER = 20
+PARALLEL_WORKER_BASE_MEMORY = 64 * 1024 * 1024
+PARALLEL_WORKER_MEMORY_FACTOR = 4
+
+# Anything open_pdf_reader accepts
+PdfSource = Union[str, bytes, BinaryIO, PyPDF2.PdfReader]
 
 def get_secret(secret_name: str) -> str:
     """Get secret from Secret Manager"""
-    project_id = "ronshin-72b20"
-    name = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
-    response = secret_client.access_secret_version(request={"name": name})
-    return response.payload.data.decode("UTF-8")
-
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extract text content from PDF file"""
-    text = []
+    return runtime.get_secret(secret_name)
+
+def resolve_storage_location(file_url: str, paper_id: str, uploader_id: str) -> Tuple[str, str]:
+    """Return (bucket_name, blob_name) for a gs:// or Firebase Storage URL"""
+    if file_url.startswith('gs://'):
+        parts = file_url[5:].split('/', 1)
+        bucket_name = parts[0]
+        blob_name = parts[1] if len(parts) > 1 else ''
+    elif 'firebasestorage.googleapis.com' in file_url:
+        # Handle Firebase Storage URLs
+        # URL format: https://firebasestorage.googleapis.com/v0/b/bucket-name/o/encoded-path?alt=media
+        import urllib.parse
+        parsed = urllib.parse.urlparse(file_url)
+        path_parts = parsed.path.split('/')
+        if len(path_parts) >= 5 and path_parts[3] == 'b' and path_parts[5] == 'o':
+            bucket_name = path_parts[4]
+            blob_name = urllib.parse.unquote(path_parts[6])
+        else:
+            # Fallback
+            bucket_name = "ronshin-72b20.appspot.com"
+            blob_name = f"papers/{uploader_id}/{paper_id}.pdf"
+    else:
+        # Default bucket
+        bucket_name = "ronshin-72b20.appspot.com"
+        blob_name = f"papers/{uploader_id}/{paper_id}.pdf"
+    
+    return bucket_name, blob_name
+
+def open_pdf_reader(source: PdfSource) -> PyPDF2.PdfReader:
+    """Return a PdfReader for a file path, raw PDF bytes, a binary stream or an existing reader"""
+    if isinstance(source, PyPDF2.PdfReader):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return PyPDF2.PdfReader(io.BytesIO(source))
+    return PyPDF2.PdfReader(source)
+
+def iter_pdf_text(source: PdfSource, max_chars: Optional[int] = None) -> Iterator[str]:
+    """
+    Lazily yield the text of each page.
+    With max_chars set, stops once the joined text (including the newline
+    separators used by extract_text_from_pdf) reaches max_chars, so the
+    remaining pages are never parsed.
+    """
+    pdf_reader = open_pdf_reader(source)
+    total_chars = 0
+    
+    for page in pdf_reader.pages:
+        if max_chars is not None and total_chars >= max_chars:
+            return
+        page_text = page.extract_text()
+        if page_text:
+            yield page_text
+            total_chars += len(page_text) + 1
+
+def get_available_memory() -> int:
+    """Return available memory in bytes, honouring the cgroup limit on Cloud Functions"""
+    try:
+        with open('/sys/fs/cgroup/memory.max') as f:
+            limit = f.read().strip()
+        with open('/sys/fs/cgroup/memory.current') as f:
+            current = int(f.read().strip())
+        if limit != 'max':
+            return max(0, int(limit) - current)
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+def get_extraction_workers(pdf_size: int, page_count: int, max_workers: Optional[int] = None) -> int:
+    """Number of extraction processes allowed by CPUs, memory and page count"""
     try:
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            num_pages = len(pdf_reader.pages)
-            
-            for page_num in range(num_pages):
-                page = pdf_reader.pages[page_num]
-                page_text = page.extract_text()
-                if page_text:
-                    text.append(page_text)
-                    
-        return '\n'.join(text)
+        cpu_count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpu_count = os.cpu_count() or 1
+    
+    # Each worker holds its own copy of the PDF plus the parsed object tree
+    per_worker_memory = PARALLEL_WORKER_BASE_MEMORY + pdf_size * PARALLEL_WORKER_MEMORY_FACTOR
+    memory_workers = get_available_memory() // per_worker_memory
+    
+    workers = min(cpu_count, memory_workers, page_count // PARALLEL_MIN_PAGES_PER_WORKER)
+    if max_workers is not None:
+        workers = min(workers, max_workers)
+    return max(1, workers)
+
+def extract_text_parallel(pdf_bytes: bytes, max_workers: Optional[int] = None) -> str:
+    """
+    Extract the full text of a PDF using a process pool (see pdf_workers).
+    Page ranges are split across workers and reassembled in page order.
+    Falls back to serial extraction for small documents or when the pool
+    cannot be used.
+    """
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    page_count = len(pdf_reader.pages)
+    workers = get_extraction_workers(len(pdf_bytes), page_count, max_workers)
+    if workers <= 1:
+        return extract_text_from_pdf(pdf_reader)
+    
+    # Two ranges per worker keeps the pool busy when page costs are uneven
+    chunk_count = min(page_count, workers * 2)
+    bounds = [page_count * i // chunk_count for i in range(chunk_count + 1)]
+    page_ranges = list(zip(bounds[:-1], bounds[1:]))
+    
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=pdf_workers.pool_context(),
+            initializer=pdf_workers.init_extraction_worker,
+            initargs=(pdf_bytes,)
+        ) as executor:
+            texts = []
+            for range_texts in executor.map(pdf_workers.extract_page_range, page_ranges):
+                texts.extend(range_texts)
+        return '\n'.join(texts)
+    except (BrokenProcessPool, OSError) as e:
+        logging.warning(f"Parallel PDF extraction failed, falling back to serial: {str(e)}")
+        return extract_text_from_pdf(pdf_reader)
+
+def extract_text_from_pdf(source: PdfSource, max_chars: Optional[int] = None, parallel: bool = False, max_workers: Optional[int] = None) -> str:
+    """
+    Extract text content from PDF (path, bytes, stream or PdfReader).
+    Without max_chars the whole document is extracted; with it, the result
+    contains at least the first max_chars characters of the full text.
+    parallel=True uses extract_text_parallel for full extractions of raw bytes.
+    """
+    try:
+        if parallel and max_chars is None and isinstance(source, (bytes, bytearray)):
+            return extract_text_parallel(bytes(source), max_workers=max_workers)
+        return '\n'.join(iter_pdf_text(source, max_chars=max_chars))
     except Exception as e:
         logging.error(f"Error extracting text from PDF: {str(e)}")
         raise
 
-def analyze_paper(paper_id: str, file_url: str, uploader_id: str, target_language: str = "ja") -> Dict[str, Any]:
+def strip_boilerplate(text: str) -> str:
+    """Remove page numbers, running headers and licence/arXiv stamps"""
+    lines = [line.strip() for line in text.split('\n')]
+    repeats = Counter(line for line in lines if line and len(line) <= HEADING_MAX_CHARS * 2)
+    kept = [
+        line for line in lines
+        if not BOILERPLATE_PATTERN.search(line)
+        and repeats.get(line, 0) < RUNNING_HEADER_MIN_REPEATS
+    ]
+    return '\n'.join(kept)
+
+def match_heading(line: str) -> Optional[Tuple[str, str]]:
+    """
+    Return (section name, inline body) if line is a section heading.
+    Inline bodies cover headings like "Abstract—We propose ...".
+    """
+    if not line:
+        return None
+    for name, pattern in HEADING_PATTERNS:
+        match = pattern.match(line)
+        if not match:
+            continue
+        rest = match.group('rest').strip()
+        if not rest:
+            return name, ''
+        if rest[0] in ':：.—–-' and len(line) > HEADING_MAX_CHARS:
+            return name, rest.lstrip(':：.—–- ')
+        if len(line) <= HEADING_MAX_CHARS and not rest.endswith(('.', '。', ',', '、')):
+            return name, ''
+        return None
+    return None
+
+def split_sections(text: str) -> List[Dict[str, str]]:
+    """Split text into [{name, heading, body}] in document order"""
+    sections = [{'name': 'preamble', 'heading': '', 'lines': []}]
+    for line in text.split('\n'):
+        heading = match_heading(line.strip())
+        if heading is None:
+            sections[-1]['lines'].append(line)
+            continue
+        name, inline_body = heading
+        sections.append({
+            'name': name,
+            'heading': line.strip() if not inline_body else line.strip()[:len(line.strip()) - len(inline_body)].strip(),
+            'lines': [inline_body] if inline_body else []
+        })
+    return [
+        {'name': section['name'], 'heading': section['heading'], 'body': '\n'.join(section['lines']).strip()}
+        for section in sections
+    ]
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to about max_tokens, preferring a sentence or word boundary"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = max(cut.rfind('. '), cut.rfind('。'), cut.rfind('\n'))
+    if boundary < max_chars * 0.8:
+        boundary = cut.rfind(' ')
+    if boundary >= max_chars * 0.8:
+        cut = cut[:boundary + 1]
+    return cut.rstrip()
+
+def select_sections(text: str, token_budget: int = ANALYSIS_TOKEN_BUDGET) -> Dict[str, Any]:
+    """
+    Pack the most informative sections of a paper into token_budget.
+
+    References, acknowledgments and appendices are dropped; the rest is
+    ranked by SECTION_PRIORITY and emitted in document order. Papers
+    without recognizable headings fall back to the leading text.
+    """
+    source_tokens = estimate_tokens(text)
+    cleaned = strip_boilerplate(text)
+    sections = [
+        section for section in split_sections(cleaned)
+        if section['name'] not in DROPPED_SECTIONS and section['body']
+    ]
+
+    if not any(section['name'] != 'preamble' for section in sections):
+        selected_text = truncate_to_tokens(cleaned, token_budget)
+        chosen_names = ['preamble'] if selected_text else []
+        truncated = ['preamble'] if len(selected_text) < len(cleaned) else []
+    else:
+        blocks = [
+            f"{section['heading']}\n{section['body']}" if section['heading'] else section['body']
+            for section in sections
+        ]
+        block_tokens = [estimate_tokens(block) for block in blocks]
+        order = sorted(
+            range(len(sections)),
+            key=lambda i: (SECTION_PRIORITY.get(sections[i]['name'], OTHER_SECTION_PRIORITY), i)
+        )
+
+        # First pass: every section gets at most its share of the budget
+        allotted = {}
+        remaining = token_budget
+        for i in order:
+            cap = PREAMBLE_MAX_TOKENS if sections[i]['name'] == 'preamble' else int(token_budget * SECTION_MAX_SHARE)
+            grant = min(block_tokens[i], cap, remaining)
+            if grant < min(block_tokens[i], MIN_SECTION_TOKENS):
+                continue
+            allotted[i] = grant
+            remaining -= grant
+
+        # Second pass: leftover budget extends sections in priority order
+        for i in order:
+            if remaining <= 0:
+                break
+            if i in allotted and sections[i]['name'] != 'preamble':
+                extra = min(block_tokens[i] - allotted[i], remaining)
+                allotted[i] += extra
+                remaining -= extra
+
+        chosen = sorted(allotted)
+        selected_text = '\n\n'.join(truncate_to_tokens(blocks[i], allotted[i]) for i in chosen)
+        chosen_names = [sections[i]['name'] for i in chosen]
+        truncated = [sections[i]['name'] for i in chosen if allotted[i] < block_tokens[i]]
+
+    selected_tokens = estimate_tokens(selected_text)
+    return {
+        'text': selected_text,
+        'sections': chosen_names,
+        'truncatedSections': truncated,
+        'sourceTokens': source_tokens,
+        'selectedTokens': selected_tokens,
+        'savedTokens': max(0, source_tokens - selected_tokens)
+    }
+
+def build_analysis_prompt(paper_text: str, target_language: str = "ja", mode: str = "select") -> str:
+    """Build the analysis prompt; paper_text is selected sections or map notes"""
+    if target_language == "en":
+        text_label = ANALYSIS_TEXT_LABELS[mode]['en']
+        return f"""
+        Analyze the following academic paper and provide a detailed analysis in JSON format:
+
+        {{
+            "title": "Paper title",
+            "authors": ["Author1", "Author2"],
+            "journal": "Journal name",
+            "publicationDate": "Publication date",
+            "doi": "DOI number",
+            "abstract": "Abstract (within 400 characters)",
+            "keywords": ["Keyword1", "Keyword2"],
+            "summary": "Summary for newspaper article (within 200 characters)",
+            "keypoints": ["Key point 1", "Key point 2", "Key point 3", "Key point 4", "Key point 5"],
+            "significance": "Research significance (within 100 characters)",
+            "relatedTopics": ["Related topic 1", "Related topic 2", "Related topic 3", "Related topic 4", "Related topic 5"],
+            "academicField": "Academic field",
+            "technicalLevel": "beginner/intermediate/advanced",
+            "aiConfidenceScore": 0-100,
+            "figuresReferences": ["List of figure references mentioned in the paper (e.g., Fig.1, Figure 2, Table 1)"]
+        }}
+
+        {text_label}
+        {paper_text}
+        """
+    else:  # Japanese
+        text_label = ANALYSIS_TEXT_LABELS[mode]['ja']
+        return f"""
+        以下は学術論文のテキストです。この論文を詳細に分析し、新聞記事として掲載するための情報を以下の形式でJSON形式で回答してください：
+
+        {{
+            "title": "論文のタイトル",
+            "authors": ["著者1", "著者2"],
+            "journal": "掲載ジャーナル名",
+            "publicationDate": "出版日",
+            "doi": "DOI番号",
+            "abstract": "要約（400文字以内）",
+            "keywords": ["キーワード1", "キーワード2"],
+            "summary": "新聞記事用の要約（200文字以内、一般読者向けにわかりやすく）",
+            "keypoints": ["重要ポイント1", "重要ポイント2", "重要ポイント3", "重要ポイント4", "重要ポイント5"],
+            "significance": "研究の社会的意義（100文字以内）",
+            "relatedTopics": ["関連トピック1", "関連トピック2", "関連トピック3", "関連トピック4", "関連トピック5"],
+            "academicField": "学術分野",
+            "technicalLevel": "beginner/intermediate/advanced のいずれか",
+            "aiConfidenceScore": 0-100の数値,
+            "figuresReferences": ["論文中で参照されている図表のリスト（例：Fig.1, Figure 2, 表1など）"]
+        }}
+
+        {text_label}
+        {paper_text}
+        """
+
+def split_chunks(text: str, chunk_tokens: int) -> List[str]:
+    """Split text into chunks of about chunk_tokens at line boundaries"""
+    max_chars = chunk_tokens * CHARS_PER_TOKEN
+    chunks = []
+    current = []
+    current_chars = 0
+    for line in text.split('\n'):
+        # Hard-split lines longer than a chunk (text without line breaks)
+        pieces = [line[i:i + max_chars] for i in range(0, len(line), max_chars)] or ['']
+        for piece in pieces:
+            if current and current_chars + len(piece) > max_chars:
+                chunks.append('\n'.join(current))
+                current = []
+                current_chars = 0
+            current.append(piece)
+            current_chars += len(piece) + 1
+    if current:
+        chunks.append('\n'.join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def build_map_prompt(chunk: str, index: int, total: int, target_language: str = "ja") -> str:
+    """Prompt asking for notes on one chunk of the paper"""
+    if target_language == "en":
+        return f"""
+        Below is part {index} of {total} of an academic paper. Write concise notes (at most {MAP_NOTE_TOKENS} tokens) on the
+        research question, methods, key results (keep the numbers) and conclusions that appear in this part.
+        If this part contains the title, authors, journal, publication date, DOI or figure/table references, copy them exactly.
+        Reply with the notes only.
+
+        Part {index}/{total}:
+        {chunk}
+        """
+    return f"""
+        以下は学術論文の第{index}部（全{total}部）です。この部分に含まれる研究課題、手法、主な結果（数値は残す）、結論を
+        簡潔なメモ（{MAP_NOTE_TOKENS}トークン以内）にまとめてください。
+        タイトル、著者、掲載誌、出版日、DOI、図表の参照が含まれている場合はそのまま書き写してください。
+        メモのみを回答してください。
+
+        第{index}部/全{total}部:
+        {chunk}
+        """
+
+def paper_body_text(text: str) -> str:
+    """Paper text without boilerplate, references, acknowledgments or appendices"""
+    sections = split_sections(strip_boilerplate(text))
+    return '\n\n'.join(
+        f"{section['heading']}\n{section['body']}" if section['heading'] else section['body']
+        for section in sections
+        if section['name'] not in DROPPED_SECTIONS and section['body']
+    )
+
+def resolve_analysis_mode(analysis_mode: str, text: str) -> str:
+    """Turn "auto" into "select" or "map_reduce" by the paper's length"""
+    if analysis_mode not in ANALYSIS_MODES:
+        raise ValueError(f"Unknown analysis mode: {analysis_mode}")
+    if analysis_mode != "auto":
+        return analysis_mode
+    return "map_reduce" if estimate_tokens(paper_body_text(text)) > MAP_REDUCE_MIN_TOKENS else "select"
+
+def map_reduce_paper_text(model: Any, text: str, target_language: str = "ja", max_workers: int = MAP_MAX_WORKERS) -> Dict[str, Any]:
+    """
+    Map step of map-reduce analysis: summarize every chunk of the paper in
+    parallel (the shared rate limiter bounds the real concurrency) and
+    return the notes in document order for the reduce prompt.
+    """
+    body = paper_body_text(text)
+    body_tokens = estimate_tokens(body)
+    # Slack for chunks that end early at a line boundary
+    chunk_tokens = max(MAP_CHUNK_TOKENS, int(body_tokens / MAP_MAX_CHUNKS * 1.05) + 1)
+    chunks = split_chunks(body, chunk_tokens)
+    total = len(chunks)
+
+    def summarize(indexed_chunk):
+        index, chunk = indexed_chunk
+        try:
+            response = model.generate_content(
+                build_map_prompt(chunk, index, total, target_language),
+                generation_config={'max_output_tokens': MAP_NOTE_TOKENS}
+            )
+            return response.text.strip()
+        except Exception as e:
+            logging.error(f"Map step failed for chunk {index}/{total}: {str(e)}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, total))) as executor:
+        notes = list(executor.map(summarize, enumerate(chunks, start=1)))
+
+    failed = [index for index, note in enumerate(notes, start=1) if not note]
+    if total and len(failed) == total:
+        raise RuntimeError(f"Map step failed for all {total} chunks")
+
+    notes_text = '\n\n'.join(
+        f"[{index}/{total}]\n{note}" for index, note in enumerate(notes, start=1) if note
+    )
+    return {
+        'text': notes_text,
+        'chunks': total,
+        'failedChunks': failed,
+        'sourceTokens': estimate_tokens(text),
+        'mapInputTokens': body_tokens,
+        'selectedTokens': estimate_tokens(notes_text)
+    }
+
+def can_ingest_natively(page_count: int, pdf_size: int) -> bool:
+    """True if the PDF is within Gemini's document limits"""
+    return page_count <= NATIVE_MAX_PAGES and pdf_size <= NATIVE_MAX_BYTES
+
+def text_layer_usable(text: str, page_count: int) -> bool:
+    """False for scanned (little or no text) and garbled (undecoded fonts) extractions"""
+    stripped = text.strip()
+    if len(stripped) < SCANNED_TEXT_MIN_CHARS or len(stripped) < LOW_TEXT_CHARS_PER_PAGE * page_count:
+        return False
+    unreadable = sum(1 for char in stripped if char == '\ufffd' or not (char.isprintable() or char.isspace()))
+    return unreadable <= GARBLED_TEXT_MAX_RATIO * len(stripped)
+
+def choose_native_ingestion(analysis_mode: str, page_count: int, pdf_size: int, text: str = "") -> bool:
+    """
+    Decide whether the PDF goes to the model as is: always in native mode,
+    and in auto mode only when the extracted text is unusable (native
+    input costs NATIVE_TOKENS_PER_PAGE per page, while the text paths
+    stay within the token budget)
+    """
+    if analysis_mode == "native":
+        if not can_ingest_natively(page_count, pdf_size):
+            raise ValueError(f"PDF too large for native ingestion ({page_count} pages, {pdf_size} bytes)")
+        return True
+    return (analysis_mode == "auto"
+            and can_ingest_natively(page_count, pdf_size)
+            and not text_layer_usable(text, page_count))
+
+def build_pdf_part(pdf_bytes: bytes, bucket_name: str, blob_name: str) -> Tuple[Part, str]:
+    """Return (Part, "inline" or "uri"); small files are inlined, others read from Storage"""
+    if len(pdf_bytes) <= NATIVE_INLINE_MAX_BYTES:
+        return Part.from_data(data=pdf_bytes, mime_type="application/pdf"), "inline"
+    return Part.from_uri(uri=f"gs://{bucket_name}/{blob_name}", mime_type="application/pdf"), "uri"
+
+def invalidate_analysis_cache() -> int:
+    """Remove cached analyses produced by older prompt/model versions (any budget or mode)"""
+    return analysis_cache.invalidate(ANALYSIS_CACHE_VERSION)
+
+def analyze_paper(paper_id: str, file_url: str, uploader_id: str, target_language: str = "ja", use_cache: bool = True, token_budget: int = ANALYSIS_TOKEN_BUDGET, analysis_mode: str = "auto") -> Dict[str, Any]:
     """
     Analyze paper using Vertex AI Gemini 2.0 Flash
+    
+    Results are cached by PDF content hash, target language and prompt
+    version, so the same PDF is only sent to Vertex AI once. Papers are
+    analyzed from the sections chosen by select_sections within
+    token_budget, or from notes on every chunk (map_reduce_paper_text)
+    when they are long; scanned or garbled PDFs, whose text cannot be
+    used, are sent to the model as documents. analysis_mode forces one path.
     """
     try:
-        # Initialize Vertex AI
-        project_id = "ronshin-72b20"  # Use project ID directly
-        vertexai.init(project=project_id, location="us-central1")
-        model = GenerativeModel("gemini-2.0-flash-001")
-        
-        # Download PDF to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_file:
-            # Extract bucket and path from URL
-            if file_url.startswith('gs://'):
-                parts = file_url[5:].split('/', 1)
-                bucket_name = parts[0]
-                blob_name = parts[1] if len(parts) > 1 else ''
-            elif 'firebasestorage.googleapis.com' in file_url:
-                # Handle Firebase Storage URLs
-                # URL format: https://firebasestorage.googleapis.com/v0/b/bucket-name/o/encoded-path?alt=media
-                import urllib.parse
-                parsed = urllib.parse.urlparse(file_url)
-                path_parts = parsed.path.split('/')
-                if len(path_parts) >= 5 and path_parts[3] == 'b' and path_parts[5] == 'o':
-                    bucket_name = path_parts[4]
-                    blob_name = urllib.parse.unquote(path_parts[6])
-                else:
-                    # Fallback
-                    bucket_name = "ronshin-72b20.appspot.com"
-                    blob_name = f"papers/{uploader_id}/{paper_id}.pdf"
-            else:
-                # Default bucket
-                bucket_name = "ronshin-72b20.appspot.com"
-                blob_name = f"papers/{uploader_id}/{paper_id}.pdf"
-            
-            bucket = storage_client.bucket(bucket_name)
-            blob = bucket.blob(blob_name)
-            blob.download_to_filename(tmp_file.name)
-            
-            # Extract text from PDF
-            extracted_text = extract_text_from_pdf(tmp_file.name)
-            
-            # Detect language
-            try:
-                language = detect(extracted_text[:1000])
-            except:
-                language = 'unknown'
-            
-            # Prepare prompt based on target language
-            if target_language == "en":
-                analysis_prompt = f"""
-                Analyze the following academic paper and provide a detailed analysis in JSON format:
-
-                {{
-                    "title": "Paper title",
-                    "authors": ["Author1", "Author2"],
-                    "journal": "Journal name",
-                    "publicationDate": "Publication date",
-                    "doi": "DOI number",
-                    "abstract": "Abstract (within 400 characters)",
-                    "keywords": ["Keyword1", "Keyword2"],
-                    "summary": "Summary for newspaper article (within 200 characters)",
-                    "keypoints": ["Key point 1", "Key point 2", "Key point 3", "Key point 4", "Key point 5"],
-                    "significance": "Research significance (within 100 characters)",
-                    "relatedTopics": ["Related topic 1", "Related topic 2", "Related topic 3", "Related topic 4", "Related topic 5"],
-                    "academicField": "Academic field",
-                    "technicalLevel": "beginner/intermediate/advanced",
-                    "aiConfidenceScore": 0-100,
-                    "figuresReferences": ["List of figure references mentioned in the paper (e.g., Fig.1, Figure 2, Table 1)"]
-                }}
-
-                Paper text (first 10000 characters):
-                {extracted_text[:10000]}
-                """
-            else:  # Japanese
-                analysis_prompt = f"""
-                以下は学術論文のテキストです。この論文を詳細に分析し、新聞記事として掲載するための情報を以下の形式でJSON形式で回答してください：
-
-                {{
-                    "title": "論文のタイトル",
-                    "authors": ["著者1", "著者2"],
-                    "journal": "掲載ジャーナル名",
-                    "publicationDate": "出版日",
-                    "doi": "DOI番号",
-                    "abstract": "要約（400文字以内）",
-                    "keywords": ["キーワード1", "キーワード2"],
-                    "summary": "新聞記事用の要約（200文字以内、一般読者向けにわかりやすく）",
-                    "keypoints": ["重要ポイント1", "重要ポイント2", "重要ポイント3", "重要ポイント4", "重要ポイント5"],
-                    "significance": "研究の社会的意義（100文字以内）",
-                    "relatedTopics": ["関連トピック1", "関連トピック2", "関連トピック3", "関連トピック4", "関連トピック5"],
-                    "academicField": "学術分野",
-                    "technicalLevel": "beginner/intermediate/advanced のいずれか",
-                    "aiConfidenceScore": 0-100の数値,
-                    "figuresReferences": ["論文中で参照されている図表のリスト（例：Fig.1, Figure 2, 表1など）"]
-                }}
-
-                論文テキスト（最初の10000文字）:
-                {extracted_text[:10000]}
-                """
-            
-            # Call Vertex AI
-            response = model.generate_content(analysis_prompt)
-            
-            # Parse response
-            try:
-                # Extract JSON from response
-                response_text = response.text
-                # Find JSON content
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}') + 1
-                if start_idx != -1 and end_idx > start_idx:
-                    json_str = response_text[start_idx:end_idx]
-                    analysis_data = json.loads(json_str)
-                else:
-                    raise ValueError("No JSON found in response")
-            except Exception as e:
-                logging.error(f"Failed to parse AI response: {str(e)}")
-                # Fallback to basic analysis
-                analysis_data = {
-                    "summary": "解析中にエラーが発生しました",
-                    "keypoints": ["エラーにより解析できませんでした"],
-                    "significance": "不明",
-                    "relatedTopics": [],
-                    "academicField": "不明",
-                    "technicalLevel": "intermediate",
-                    "aiConfidenceScore": 0
-                }
-            
-            # Construct metadata
-            metadata = {
-                "abstract": analysis_data.get("abstract", ""),
-                "keywords": analysis_data.get("keywords", []),
-                "extractedText": extracted_text[:5000],  # Store first 5000 chars
-                "language": language,
-                "pageCount": len(PyPDF2.PdfReader(open(tmp_file.name, 'rb')).pages)
+        cache_version = ANALYSIS_CACHE_VERSION
+        if token_budget != ANALYSIS_TOKEN_BUDGET:
+            cache_version = f"{cache_version}:budget{token_budget}"
+        if analysis_mode != "auto":
+            cache_version = f"{cache_version}:{analysis_mode}"
+        
+        # Shared Vertex AI model (initialized once per instance)
+        model = runtime.get_generative_model(ANALYSIS_MODEL_NAME)
+        
+        # Download PDF into memory (/tmp is RAM-backed on Cloud Functions anyway)
+        bucket_name, blob_name = resolve_storage_location(file_url, paper_id, uploader_id)
+        blob = runtime.get_storage_client().bucket(bucket_name).blob(blob_name)
+        pdf_bytes = blob.download_as_bytes()
+        
+        # Return the cached analysis if this PDF was already analyzed
+        if use_cache:
+            pdf_hash = compute_pdf_hash(pdf_bytes)
+            cached_result = analysis_cache.get(pdf_hash, target_language, cache_version)
+            if cached_result is not None:
+                logging.info(f"Analysis cache hit for paper_id: {paper_id} ({analysis_cache.get_stats()})")
+                # Entries cached before embeddings existed get one now
+                if cached_result.get('embeddingModel') != EMBEDDING_MODEL_NAME:
+                    embedding = embed_analysis(cached_result)
+                    if embedding:
+                        cached_result = {**cached_result, 'embedding': embedding, 'embeddingModel': EMBEDDING_MODEL_NAME}
+                        analysis_cache.set(pdf_hash, target_language, cache_version, cached_result, prompt_version=ANALYSIS_CACHE_VERSION)
+                return cached_result
+        
+        # Opening the reader only parses the cross-reference table; page
+        # text is extracted below, only as far as the chosen path needs
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+        page_count = len(pdf_reader.pages)
+        if analysis_mode == "native":
+            extracted_text = extract_text_from_pdf(pdf_reader, max_chars=NATIVE_EXCERPT_CHARS)
+        elif analysis_mode == "select":
+            extracted_text = extract_text_from_pdf(pdf_reader, max_chars=ANALYSIS_TEXT_CHARS)
+        else:
+            # Map-reduce reads the whole text, and auto mode needs it to
+            # judge the text layer and the paper's length, so the full
+            # text is extracted across processes
+            extracted_text = extract_text_from_pdf(pdf_bytes, parallel=True)
+        # Scanned or garbled PDFs have no usable text; only the model can read them
+        native = choose_native_ingestion(analysis_mode, page_count, len(pdf_bytes), extracted_text)
+        
+        # Native papers go to the model as documents; long papers are
+        # summarized chunk by chunk; others get the informative sections
+        # instead of the leading characters
+        mode = "native" if native else resolve_analysis_mode(analysis_mode, extracted_text)
+        if mode == "native":
+            pdf_part, ingestion = build_pdf_part(pdf_bytes, bucket_name, blob_name)
+            logging.info(f"Native PDF ingestion for paper_id {paper_id}: {page_count} pages, {len(pdf_bytes)} bytes ({ingestion})")
+            text_selection = {
+                "ingestion": ingestion,
+                "pages": page_count
             }
-            
-            # Update paper info if extracted
-            paper_info = {
-                "title": analysis_data.get("title", ""),
-                "authors": analysis_data.get("authors", []),
-                "journal": analysis_data.get("journal", ""),
-                "publicationDate": analysis_data.get("publicationDate", ""),
-                "doi": analysis_data.get("doi", "")
+            paper_text = ""
+        elif mode == "map_reduce":
+            selection = map_reduce_paper_text(model, extracted_text, target_language)
+            logging.info(
+                f"Map step for paper_id {paper_id}: {selection['chunks']} chunks "
+                f"({selection['mapInputTokens']} tokens -> {selection['selectedTokens']} tokens of notes)"
+            )
+            text_selection = {
+                "chunks": selection['chunks'],
+                "failedChunks": selection['failedChunks'],
+                "selectedTokens": selection['selectedTokens'],
+                "sourceTokens": selection['sourceTokens']
             }
-            
-            # Construct AI analysis
-            ai_analysis = {
-                "summary": analysis_data.get("summary", ""),
-                "keypoints": analysis_data.get("keypoints", []),
-                "significance": analysis_data.get("significance", ""),
-                "relatedTopics": analysis_data.get("relatedTopics", []),
-                "academicField": analysis_data.get("academicField", ""),
-                "technicalLevel": analysis_data.get("technicalLevel", "intermediate"),
-                "aiConfidenceScore": analysis_data.get("aiConfidenceScore", 50)
+            paper_text = selection['text']
+        else:
+            selection = select_sections(extracted_text, token_budget)
+            logging.info(
+                f"Section selection for paper_id {paper_id}: {selection['sections']} "
+                f"({selection['selectedTokens']}/{selection['sourceTokens']} tokens, saved {selection['savedTokens']})"
+            )
+            text_selection = {
+                "sections": selection['sections'],
+                "selectedTokens": selection['selectedTokens'],
+                "sourceTokens": selection['sourceTokens'],
+                "savedTokens": selection['savedTokens']
             }
-            
-            # Clean up temporary file
-            os.unlink(tmp_file.name)
-            
-            return {
-                "metadata": metadata,
-                "aiAnalysis": ai_analysis,
-                "paperInfo": paper_info
+            paper_text = selection['text']
+        
+        # Detect language
+        try:
+            language = detect(extracted_text[:1000])
+        except:
+            language = 'unknown'
+        
+        analysis_prompt = build_analysis_prompt(paper_text, target_language, mode)
+        
+        # Call Vertex AI
+        if native:
+            response = model.generate_content(
+                [pdf_part, analysis_prompt],
+                estimated_tokens=page_count * NATIVE_TOKENS_PER_PAGE + estimate_tokens(analysis_prompt) + DEFAULT_OUTPUT_TOKENS
+            )
+        else:
+            response = model.generate_content(analysis_prompt)
+        
+        # Parse response
+        analysis_failed = False
+        try:
+            # Extract JSON from response
+            response_text = response.text
+            # Find JSON content
+            start_idx = response_text.find('{')
+            end_idx = response_text.rfind('}') + 1
+            if start_idx != -1 and end_idx > start_idx:
+                json_str = response_text[start_idx:end_idx]
+                analysis_data = json.loads(json_str)
+            else:
+                raise ValueError("No JSON found in response")
+        except Exception as e:
+            logging.error(f"Failed to parse AI response: {str(e)}")
+            analysis_failed = True
+            # Fallback to basic analysis
+            analysis_data = {
+                "summary": "解析中にエラーが発生しました",
+                "keypoints": ["エラーにより解析できませんでした"],
+                "significance": "不明",
+                "relatedTopics": [],
+                "academicField": "不明",
+                "technicalLevel": "intermediate",
+                "aiConfidenceScore": 0
             }
-            
+        
+        # Construct metadata
+        metadata = {
+            "abstract": analysis_data.get("abstract", ""),
+            "keywords": analysis_data.get("keywords", []),
+            "extractedText": extracted_text[:5000],  # Store first 5000 chars
+            "language": language,
+            "pageCount": page_count,
+            "analysisMode": mode,
+            "textSelection": text_selection
+        }
+        
+        # Update paper info if extracted
+        paper_info = {
+            "title": analysis_data.get("title", ""),
+            "authors": analysis_data.get("authors", []),
+            "journal": analysis_data.get("journal", ""),
+            "publicationDate": analysis_data.get("publicationDate", ""),
+            "doi": analysis_data.get("doi", "")
+        }
+        
+        # Construct AI analysis
+        ai_analysis = {
+            "summary": analysis_data.get("summary", ""),
+            "keypoints": analysis_data.get("keypoints", []),
+            "significance": analysis_data.get("significance", ""),
+            "relatedTopics": analysis_data.get("relatedTopics", []),
+            "academicField": analysis_data.get("academicField", ""),
+            "technicalLevel": analysis_data.get("technicalLevel", "intermediate"),
+            "aiConfidenceScore": analysis_data.get("aiConfidenceScore", 50)
+        }
+        
+        result = {
+            "metadata": metadata,
+            "aiAnalysis": ai_analysis,
+            "paperInfo": paper_info
+        }
+        
+        # Embedding for relationship scoring and similar-paper search
+        if not analysis_failed:
+            embedding = embed_analysis(result)
+            if embedding:
+                result["embedding"] = embedding
+                result["embeddingModel"] = EMBEDDING_MODEL_NAME
+        
+        # Only cache successful analyses so failures are retried
+        if use_cache and not analysis_failed:
+            analysis_cache.set(pdf_hash, target_language, cache_version, result, prompt_version=ANALYSIS_CACHE_VERSION)
+        
+        return result
+        
     except Exception as e:
         logging.error(f"Error in paper analysis: {str(e)}")
         raise
\ No newline at end of file
@@ -0,0 +1,35 @@
+import io
+import multiprocessing
+from typing import List, Tuple
+import PyPDF2
+
+# Extraction pools use forkserver (spawn where it is unavailable): the
+# functions process holds gRPC clients and runs requests on threads, which
+# fork would copy into the workers mid-flight. Workers only import this
+# module, not the analysis pipeline
+WORKER_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Reader opened by init_extraction_worker in each pool process
+_worker_pdf_reader = None
+
+def pool_context():
+    """Multiprocessing context for extraction pools"""
+    context = multiprocessing.get_context(WORKER_START_METHOD)
+    if WORKER_START_METHOD == 'forkserver':
+        context.set_forkserver_preload([__name__])
+    return context
+
+def init_extraction_worker(pdf_bytes: bytes) -> None:
+    """Process pool initializer: open a worker-local reader on the shared buffer"""
+    global _worker_pdf_reader
+    _worker_pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+
+def extract_page_range(page_range: Tuple[int, int]) -> List[str]:
+    """Extract the text of pages [start, end) with the worker-local reader"""
+    start, end = page_range
+    texts = []
+    for page_num in range(start, end):
+        page_text = _worker_pdf_reader.pages[page_num].extract_text()
+        if page_text:
+            texts.append(page_text)
+    return texts
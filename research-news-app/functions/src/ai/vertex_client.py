@@ -0,0 +1,268 @@
+import logging
+import random
+import threading
+import time
+from typing import Dict, Any, Callable, Optional
+
+# Per-instance quota; kept below the project limits because several
+# instances share them (429 feedback shrinks concurrency when they collide)
+REQUESTS_PER_MINUTE = 200
+TOKENS_PER_MINUTE = 1000000
+
+# Adaptive concurrency bounds (AIMD)
+INITIAL_CONCURRENCY = 4
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 16
+# Halve the limit at most once per window so a burst of 429s counts once
+DECREASE_COOLDOWN_SECONDS = 2.0
+
+# Retries: full-jitter exponential backoff bounded by a per-call deadline
+RETRY_DEADLINE_SECONDS = 120.0
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 30.0
+
+# Token estimates used before the response reports real usage
+CHARS_PER_TOKEN = 3  # conservative for mixed Japanese/English text
+NON_TEXT_PART_TOKENS = 1000
+DEFAULT_OUTPUT_TOKENS = 2048
+
+class RateLimitTimeout(Exception):
+    """Raised when a call cannot get capacity before its deadline"""
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for quota / resource-exhausted (HTTP 429) errors"""
+    try:
+        from google.api_core import exceptions as api_exceptions
+        if isinstance(error, (api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests)):
+            return True
+    except ImportError:
+        pass
+    text = str(error)
+    return '429' in text or 'RESOURCE_EXHAUSTED' in text or 'Quota exceeded' in text
+
+def is_retryable_error(error: Exception) -> bool:
+    """True for errors that may succeed when retried"""
+    if is_rate_limit_error(error):
+        return True
+    try:
+        from google.api_core import exceptions as api_exceptions
+        if isinstance(error, (
+            api_exceptions.ServiceUnavailable,
+            api_exceptions.InternalServerError,
+            api_exceptions.DeadlineExceeded,
+        )):
+            return True
+    except ImportError:
+        pass
+    text = str(error)
+    return '503' in text or 'UNAVAILABLE' in text
+
+def estimate_tokens(contents: Any) -> int:
+    """Rough input token count for generate_content contents"""
+    if isinstance(contents, str):
+        return len(contents) // CHARS_PER_TOKEN + 1
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(part) for part in contents)
+    return NON_TEXT_PART_TOKENS
+
+class TokenBucket:
+    """
+    Token bucket refilled at per_minute / 60 tokens per second.
+    reserve() always takes the tokens and returns how long the caller must
+    wait for them, so waiters are served in arrival order without polling.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take amount tokens; returns the seconds to wait before using them"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill_locked()
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def adjust(self, amount: float) -> None:
+        """Give back (positive) or take (negative) tokens after the fact"""
+        with self._lock:
+            self._refill_locked()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit with additive increase / multiplicative decrease:
+    +1/limit per success, halved on a rate-limit error.
+    """
+
+    def __init__(self, initial: int = INITIAL_CONCURRENCY, minimum: int = MIN_CONCURRENCY, maximum: int = MAX_CONCURRENCY):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        """Wait for a slot; returns False if none freed up within timeout"""
+        end = time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self, throttled: bool = False) -> None:
+        """Free a slot and adapt the limit to the outcome of the call"""
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                now = time.monotonic()
+                if now - self._last_decrease >= DECREASE_COOLDOWN_SECONDS:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+class VertexRateLimiter:
+    """
+    Shared gate for Vertex AI calls: request and token buckets, adaptive
+    concurrency, and jittered retries of quota/transient errors until the
+    call's deadline.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = TOKENS_PER_MINUTE,
+        concurrency: Optional[AdaptiveConcurrency] = None,
+        retry_deadline: float = RETRY_DEADLINE_SECONDS,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.retry_deadline = retry_deadline
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self.stats = {
+            'calls': 0,
+            'attempts': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'retries': 0,
+            'rateLimited': 0,
+            'timeouts': 0,
+            'queueSecondsTotal': 0.0,
+            'queueSecondsMax': 0.0
+        }
+
+    def _record(self, **increments: float) -> None:
+        with self._lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def _record_queue_delay(self, seconds: float) -> None:
+        with self._lock:
+            self.stats['queueSecondsTotal'] += seconds
+            self.stats['queueSecondsMax'] = max(self.stats['queueSecondsMax'], seconds)
+
+    def _wait_for_capacity(self, estimated_tokens: int, deadline_at: float) -> None:
+        """Block until both buckets and a concurrency slot allow one call"""
+        queued_at = time.monotonic()
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        if queued_at + wait > deadline_at:
+            self.requests.adjust(1)
+            self.tokens.adjust(estimated_tokens)
+            raise RateLimitTimeout(f"Vertex AI quota wait of {wait:.1f}s exceeds the call deadline")
+        if wait > 0:
+            self.sleep(wait)
+        if not self.concurrency.acquire(deadline_at - time.monotonic()):
+            self.requests.adjust(1)
+            self.tokens.adjust(estimated_tokens)
+            raise RateLimitTimeout("No Vertex AI concurrency slot before the call deadline")
+        self._record_queue_delay(time.monotonic() - queued_at)
+
+    def call(self, fn: Callable[[], Any], estimated_tokens: int, deadline: Optional[float] = None) -> Any:
+        """Run fn under the limits, retrying retryable errors until the deadline"""
+        deadline_at = time.monotonic() + (deadline or self.retry_deadline)
+        self._record(calls=1)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self._wait_for_capacity(estimated_tokens, deadline_at)
+            except RateLimitTimeout:
+                self._record(timeouts=1, failed=1)
+                raise
+
+            self._record(attempts=1)
+            try:
+                response = fn()
+            except Exception as e:
+                throttled = is_rate_limit_error(e)
+                self.concurrency.release(throttled=throttled)
+                if throttled:
+                    self._record(rateLimited=1)
+                delay = random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** (attempt - 1))))
+                if not is_retryable_error(e) or time.monotonic() + delay >= deadline_at:
+                    self._record(failed=1)
+                    raise
+                logging.warning(f"Vertex AI call failed (attempt {attempt}), retrying in {delay:.1f}s: {str(e)}")
+                self._record(retries=1)
+                self.sleep(delay)
+                continue
+
+            self.concurrency.release()
+            self._record(succeeded=1)
+            # Correct the token bucket with the usage the response reports
+            usage = getattr(response, 'usage_metadata', None)
+            actual_tokens = getattr(usage, 'total_token_count', None) if usage is not None else None
+            if isinstance(actual_tokens, int) and actual_tokens > 0:
+                self.tokens.adjust(estimated_tokens - actual_tokens)
+            return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the call counters and current limits"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['queueSecondsAvg'] = stats['queueSecondsTotal'] / stats['attempts'] if stats['attempts'] else 0.0
+        stats['concurrencyLimit'] = int(self.concurrency.limit)
+        stats['inFlight'] = self.concurrency.in_flight
+        return stats
+
+class RateLimitedModel:
+    """GenerativeModel wrapper whose generate_content goes through a VertexRateLimiter"""
+
+    def __init__(self, model: Any, limiter: VertexRateLimiter):
+        self.model = model
+        self.limiter = limiter
+
+    def generate_content(self, contents: Any, *args, estimated_tokens: Optional[int] = None, deadline: Optional[float] = None, **kwargs) -> Any:
+        if estimated_tokens is None:
+            generation_config = kwargs.get('generation_config')
+            max_output = None
+            if isinstance(generation_config, dict):
+                max_output = generation_config.get('max_output_tokens')
+            estimated_tokens = estimate_tokens(contents) + (max_output or DEFAULT_OUTPUT_TOKENS)
+        return self.limiter.call(
+            lambda: self.model.generate_content(contents, *args, **kwargs),
+            estimated_tokens,
+            deadline
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.model, name)
@@ -0,0 +1,249 @@
+import copy
+import threading
+import time
+import uuid
+from typing import Dict, Any, List, Optional
+
+# Firestore collection holding the job queue
+JOBS_COLLECTION = 'jobs'
+
+# Job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_DEAD = 'dead'
+
+# Attempts before a job is given up on
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Reject new jobs once this many are waiting (backpressure)
+DEFAULT_MAX_PENDING = 1000
+
+class QueueFullError(Exception):
+    """Raised by enqueue when the queue is over its pending limit"""
+
+def new_job(job_type: str, payload: Dict[str, Any], max_attempts: int, run_after: float, job_id: Optional[str] = None) -> Dict[str, Any]:
+    """Build the initial state of a job document"""
+    now = time.time()
+    return {
+        'id': job_id or uuid.uuid4().hex,
+        'type': job_type,
+        'payload': payload,
+        'status': JOB_QUEUED,
+        'attempts': 0,
+        'maxAttempts': max_attempts,
+        'runAfter': run_after or now,
+        'leaseOwner': None,
+        'leaseExpiresAt': None,
+        'enqueuedAt': now,
+        'startedAt': None,
+        'finishedAt': None,
+        'lastError': None,
+        'attemptHistory': []
+    }
+
+def is_claimable(job: Dict[str, Any], now: float) -> bool:
+    """Queued jobs that are due, or running jobs whose lease has expired"""
+    if job['status'] == JOB_QUEUED:
+        return job['runAfter'] <= now
+    if job['status'] == JOB_RUNNING:
+        return (job.get('leaseExpiresAt') or 0) <= now
+    return False
+
+def claimed_fields(job: Dict[str, Any], worker_id: str, lease_seconds: float, now: float) -> Dict[str, Any]:
+    """Fields written when a worker takes a lease on a job"""
+    return {
+        'status': JOB_RUNNING,
+        'attempts': job['attempts'] + 1,
+        'leaseOwner': worker_id,
+        'leaseExpiresAt': now + lease_seconds,
+        'startedAt': job.get('startedAt') or now
+    }
+
+def finished_fields(job: Dict[str, Any], worker_id: str, started_at: float, error: Optional[str], status: str, run_after: Optional[float] = None) -> Dict[str, Any]:
+    """Fields written when an attempt ends (successfully or not)"""
+    now = time.time()
+    fields = {
+        'status': status,
+        'leaseOwner': None,
+        'leaseExpiresAt': None,
+        'lastError': error,
+        'attemptHistory': job.get('attemptHistory', []) + [{
+            'attempt': job['attempts'],
+            'workerId': worker_id,
+            'startedAt': started_at,
+            'durationSeconds': now - started_at,
+            'error': error
+        }]
+    }
+    if status == JOB_QUEUED:
+        fields['runAfter'] = run_after
+    else:
+        fields['finishedAt'] = now
+    return fields
+
+class InMemoryJobBackend:
+    """Process-local job queue (tests and local runs)"""
+
+    def __init__(self, max_pending: int = DEFAULT_MAX_PENDING):
+        self.max_pending = max_pending
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def enqueue(self, job_type: str, payload: Dict[str, Any], max_attempts: int = DEFAULT_MAX_ATTEMPTS, run_after: float = 0, job_id: Optional[str] = None, batch=None) -> str:
+        """
+        With batch (a persistence.WriteGroup), the job is added when the
+        batch commits. Enqueueing an existing job_id keeps the existing job.
+        """
+        with self._lock:
+            if job_id is not None and job_id in self.jobs:
+                return job_id
+            if self._count_pending_locked() >= self.max_pending:
+                raise QueueFullError(f"Job queue is full ({self.max_pending} pending)")
+            job = new_job(job_type, payload, max_attempts, run_after, job_id)
+            if batch is None:
+                self.jobs[job['id']] = job
+        if batch is not None:
+            batch.after_commit(lambda: self._add(job))
+        return job['id']
+
+    def _add(self, job: Dict[str, Any]) -> None:
+        with self._lock:
+            self.jobs.setdefault(job['id'], job)
+
+    def claim(self, worker_id: str, lease_seconds: float, limit: int) -> List[Dict[str, Any]]:
+        now = time.time()
+        claimed = []
+        with self._lock:
+            candidates = sorted(
+                (job for job in self.jobs.values() if is_claimable(job, now)),
+                key=lambda job: job['runAfter']
+            )
+            for job in candidates[:limit]:
+                job.update(claimed_fields(job, worker_id, lease_seconds, now))
+                claimed.append(copy.deepcopy(job))
+        return claimed
+
+    def finish(self, job: Dict[str, Any], worker_id: str, started_at: float, error: Optional[str], status: str, run_after: Optional[float] = None) -> bool:
+        with self._lock:
+            stored = self.jobs.get(job['id'])
+            # A stale worker must not overwrite a job that was reclaimed
+            if stored is None or stored['leaseOwner'] != worker_id:
+                return False
+            stored.update(finished_fields(stored, worker_id, started_at, error, status, run_after))
+            return True
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return copy.deepcopy(job) if job else None
+
+    def count_pending(self) -> int:
+        with self._lock:
+            return self._count_pending_locked()
+
+    def _count_pending_locked(self) -> int:
+        return sum(1 for job in self.jobs.values() if job['status'] in (JOB_QUEUED, JOB_RUNNING))
+
+class FirestoreJobBackend:
+    """Job queue stored as documents in the jobs collection"""
+
+    def __init__(self, db, collection: str = JOBS_COLLECTION, max_pending: int = DEFAULT_MAX_PENDING):
+        self.db = db
+        self.collection = collection
+        self.max_pending = max_pending
+
+    def _collection(self):
+        return self.db.collection(self.collection)
+
+    def enqueue(self, job_type: str, payload: Dict[str, Any], max_attempts: int = DEFAULT_MAX_ATTEMPTS, run_after: float = 0, job_id: Optional[str] = None, batch=None) -> str:
+        """
+        With batch (a persistence.WriteGroup), the job document is written
+        in its commit. Enqueueing an existing job_id keeps the existing job.
+        """
+        from firebase_admin import firestore
+        from google.api_core.exceptions import AlreadyExists
+        if job_id is not None and self._collection().document(job_id).get().exists:
+            return job_id
+        if self.count_pending() >= self.max_pending:
+            raise QueueFullError(f"Job queue is full ({self.max_pending} pending)")
+        job = new_job(job_type, payload, max_attempts, run_after, job_id)
+        job_ref = self._collection().document(job['id'])
+        job_data = {
+            **job,
+            'createdAt': firestore.SERVER_TIMESTAMP
+        }
+        if batch is not None:
+            batch.create(job_ref, job_data)
+        else:
+            try:
+                job_ref.create(job_data)
+            except AlreadyExists:
+                # Enqueued concurrently under the same job_id
+                pass
+        return job['id']
+
+    def claim(self, worker_id: str, lease_seconds: float, limit: int) -> List[Dict[str, Any]]:
+        from firebase_admin import firestore
+        now = time.time()
+        candidates = list(
+            self._collection()
+            .where('status', '==', JOB_QUEUED)
+            .where('runAfter', '<=', now)
+            .order_by('runAfter')
+            .limit(limit)
+            .stream()
+        )
+        if len(candidates) < limit:
+            # Reclaim jobs whose worker died without finishing
+            candidates += list(
+                self._collection()
+                .where('status', '==', JOB_RUNNING)
+                .where('leaseExpiresAt', '<=', now)
+                .limit(limit - len(candidates))
+                .stream()
+            )
+
+        @firestore.transactional
+        def claim_one(transaction, doc_ref):
+            snapshot = doc_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            job = snapshot.to_dict()
+            if not is_claimable(job, time.time()):
+                return None
+            fields = claimed_fields(job, worker_id, lease_seconds, time.time())
+            transaction.update(doc_ref, fields)
+            job.update(fields)
+            return job
+
+        claimed = []
+        for snapshot in candidates:
+            job = claim_one(self.db.transaction(), snapshot.reference)
+            if job is not None:
+                claimed.append(job)
+        return claimed
+
+    def finish(self, job: Dict[str, Any], worker_id: str, started_at: float, error: Optional[str], status: str, run_after: Optional[float] = None) -> bool:
+        from firebase_admin import firestore
+        doc_ref = self._collection().document(job['id'])
+
+        @firestore.transactional
+        def finish_one(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            stored = snapshot.to_dict() if snapshot.exists else None
+            # A stale worker must not overwrite a job that was reclaimed
+            if stored is None or stored.get('leaseOwner') != worker_id:
+                return False
+            transaction.update(doc_ref, finished_fields(stored, worker_id, started_at, error, status, run_after))
+            return True
+
+        return finish_one(self.db.transaction())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        snapshot = self._collection().document(job_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def count_pending(self) -> int:
+        query = self._collection().where('status', 'in', [JOB_QUEUED, JOB_RUNNING])
+        return query.count().get()[0][0].value
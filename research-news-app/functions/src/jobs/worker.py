@@ -0,0 +1,131 @@
+import logging
+import random
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Callable, Optional
+
+from src.jobs.backends import JOB_QUEUED, JOB_SUCCEEDED, JOB_DEAD
+
+# Worker defaults: the lease must outlive the longest job but not the
+# function running it (540s timeout), so jobs of a timed-out worker are
+# reclaimed promptly; run() also caps leases at lease_deadline
+DEFAULT_CONCURRENCY = 2
+DEFAULT_LEASE_SECONDS = 500
+BASE_BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 30 * 60
+
+class PermanentJobError(Exception):
+    """Raised by a handler for failures that retrying cannot fix"""
+
+def retry_delay(attempt: int, base: float = BASE_BACKOFF_SECONDS, maximum: float = MAX_BACKOFF_SECONDS) -> float:
+    """Exponential backoff with full jitter for the given (1-based) attempt"""
+    return random.uniform(0, min(maximum, base * (2 ** (attempt - 1))))
+
+class JobWorker:
+    """
+    Claims jobs from a backend with leases and runs them on a bounded pool.
+    Failed attempts are retried with backoff until maxAttempts; on_dead
+    handlers are called when a job is given up on.
+    """
+
+    def __init__(
+        self,
+        backend,
+        handlers: Dict[str, Callable[[Dict[str, Any]], Any]],
+        on_dead: Optional[Dict[str, Callable[[Dict[str, Any], str], None]]] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        worker_id: Optional[str] = None
+    ):
+        self.backend = backend
+        self.handlers = handlers
+        self.on_dead = on_dead or {}
+        self.concurrency = max(1, concurrency)
+        self.lease_seconds = lease_seconds
+        self.worker_id = worker_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.stats = {'claimed': 0, 'succeeded': 0, 'retried': 0, 'dead': 0, 'lost': 0}
+
+    def run_job(self, job: Dict[str, Any]) -> str:
+        """Run one claimed job and record the outcome; returns the new status"""
+        started_at = time.time()
+        queue_delay = started_at - job.get('enqueuedAt', started_at)
+        logging.info(f"Job {job['id']} ({job['type']}) attempt {job['attempts']} started after {queue_delay:.1f}s in queue")
+
+        error = None
+        permanent = False
+        handler = self.handlers.get(job['type'])
+        try:
+            if handler is None:
+                raise PermanentJobError(f"No handler for job type {job['type']}")
+            handler(job['payload'])
+        except PermanentJobError as e:
+            error = str(e)
+            permanent = True
+        except Exception as e:
+            error = str(e)
+
+        if error is None:
+            status, run_after = JOB_SUCCEEDED, None
+        elif not permanent and job['attempts'] < job['maxAttempts']:
+            status, run_after = JOB_QUEUED, time.time() + retry_delay(job['attempts'])
+        else:
+            status, run_after = JOB_DEAD, None
+
+        if not self.backend.finish(job, self.worker_id, started_at, error, status, run_after):
+            # The lease expired and another worker took the job over
+            logging.warning(f"Job {job['id']} lease lost; result discarded")
+            self.stats['lost'] += 1
+            return 'lost'
+
+        duration = time.time() - started_at
+        if status == JOB_SUCCEEDED:
+            self.stats['succeeded'] += 1
+            logging.info(f"Job {job['id']} succeeded in {duration:.1f}s")
+        elif status == JOB_QUEUED:
+            self.stats['retried'] += 1
+            logging.warning(f"Job {job['id']} failed (attempt {job['attempts']}), retrying: {error}")
+        else:
+            self.stats['dead'] += 1
+            logging.error(f"Job {job['id']} failed permanently after {job['attempts']} attempts: {error}")
+            dead_handler = self.on_dead.get(job['type'])
+            if dead_handler:
+                try:
+                    dead_handler(job['payload'], error)
+                except Exception as e:
+                    logging.error(f"on_dead handler failed for job {job['id']}: {str(e)}")
+        return status
+
+    def lease_seconds_until(self, lease_deadline: Optional[float] = None) -> float:
+        """Lease length for a claim now, ending no later than lease_deadline"""
+        if lease_deadline is None:
+            return self.lease_seconds
+        return max(0.0, min(self.lease_seconds, lease_deadline - time.time()))
+
+    def run(self, deadline: Optional[float] = None, max_jobs: Optional[int] = None, lease_deadline: Optional[float] = None) -> Dict[str, int]:
+        """
+        Process jobs until the queue is empty, max_jobs have been claimed or
+        the deadline (epoch seconds) passes. At most `concurrency` jobs run
+        at once, and new jobs are only claimed when a slot is free. Leases
+        expire by lease_deadline (when the function running the worker is
+        stopped), so other workers can reclaim jobs this one cannot finish.
+        """
+        claimed_total = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            running = set()
+            while True:
+                free_slots = self.concurrency - len(running)
+                can_claim = (deadline is None or time.time() < deadline) and (max_jobs is None or claimed_total < max_jobs)
+                if free_slots > 0 and can_claim:
+                    limit = free_slots if max_jobs is None else min(free_slots, max_jobs - claimed_total)
+                    jobs = self.backend.claim(self.worker_id, self.lease_seconds_until(lease_deadline), limit)
+                    claimed_total += len(jobs)
+                    self.stats['claimed'] += len(jobs)
+                    running.update(executor.submit(self.run_job, job) for job in jobs)
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+        return dict(self.stats)
@@ -0,0 +1,172 @@
+import logging
+import importlib
+import threading
+import time
+from typing import Dict, Any, Callable
+
+# Project settings shared by every function
+PROJECT_ID = "ronshin-72b20"
+LOCATION = "us-central1"
+DEFAULT_MODEL_NAME = "gemini-2.0-flash-001"
+
+# Measured from the first import of this module, which main.py does first
+PROCESS_START = time.perf_counter()
+
+# Lazily created clients, keyed by name
+_clients: Dict[str, Any] = {}
+_lock = threading.RLock()
+
+# Cold-start measurements (seconds)
+_import_timings: Dict[str, float] = {}
+_init_timings: Dict[str, float] = {}
+_cold_start = {
+    'moduleLoadedAt': None,
+    'firstRequestAt': None
+}
+
+def _get_or_create(name: str, factory: Callable[[], Any]) -> Any:
+    """Return the cached client for name, creating it on first use"""
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(name)
+        if client is None:
+            started = time.perf_counter()
+            client = factory()
+            _init_timings[name] = time.perf_counter() - started
+            _clients[name] = client
+    return client
+
+def set_client(name: str, client: Any) -> None:
+    """Use client for name instead of creating one (benchmarks run against fakes)"""
+    with _lock:
+        _clients[name] = client
+
+def timed_import(module_name: str) -> Any:
+    """Import a module and record how long the first import took"""
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if module_name not in _import_timings:
+        _import_timings[module_name] = time.perf_counter() - started
+    return module
+
+def setup_logging() -> None:
+    """Attach Cloud Logging to the root logger (once per instance)"""
+    def create():
+        import google.cloud.logging
+        client = google.cloud.logging.Client()
+        client.setup_logging()
+        logging.basicConfig(level=logging.INFO)
+        return client
+    _get_or_create('logging', create)
+
+def init_firebase() -> Any:
+    """Initialize the default Firebase Admin app (once per instance)"""
+    def create():
+        import firebase_admin
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            return firebase_admin.initialize_app()
+    return _get_or_create('firebase', create)
+
+def get_firestore() -> Any:
+    """Shared Firestore client"""
+    def create():
+        init_firebase()
+        from firebase_admin import firestore
+        return firestore.client()
+    return _get_or_create('firestore', create)
+
+def get_storage_client() -> Any:
+    """Shared Cloud Storage client"""
+    def create():
+        from google.cloud import storage
+        return storage.Client()
+    return _get_or_create('storage', create)
+
+def get_secret_client() -> Any:
+    """Shared Secret Manager client"""
+    def create():
+        from google.cloud import secretmanager
+        return secretmanager.SecretManagerServiceClient()
+    return _get_or_create('secretmanager', create)
+
+def get_secret(secret_name: str) -> str:
+    """Get secret from Secret Manager"""
+    name = f"projects/{PROJECT_ID}/secrets/{secret_name}/versions/latest"
+    response = get_secret_client().access_secret_version(request={"name": name})
+    return response.payload.data.decode("UTF-8")
+
+def init_vertexai() -> None:
+    """Call vertexai.init (once per instance)"""
+    def create():
+        import vertexai
+        vertexai.init(project=PROJECT_ID, location=LOCATION)
+        return True
+    _get_or_create('vertexai', create)
+
+def get_rate_limiter(name: str = 'generation') -> Any:
+    """Vertex AI rate limiter for one quota (generation or embeddings) on this instance"""
+    def create():
+        from src.ai.vertex_client import VertexRateLimiter
+        return VertexRateLimiter()
+    return _get_or_create(f'ratelimiter:{name}', create)
+
+def get_generative_model(model_name: str = DEFAULT_MODEL_NAME) -> Any:
+    """Shared rate-limited GenerativeModel instance for model_name"""
+    def create():
+        init_vertexai()
+        from vertexai.generative_models import GenerativeModel
+        from src.ai.vertex_client import RateLimitedModel
+        return RateLimitedModel(GenerativeModel(model_name), get_rate_limiter())
+    return _get_or_create(f'model:{model_name}', create)
+
+def get_embedding_model(model_name: str) -> Any:
+    """Shared TextEmbeddingModel instance for model_name"""
+    def create():
+        init_vertexai()
+        from vertexai.language_models import TextEmbeddingModel
+        return TextEmbeddingModel.from_pretrained(model_name)
+    return _get_or_create(f'embedding:{model_name}', create)
+
+def get_job_backend() -> Any:
+    """Shared Firestore-backed job queue"""
+    def create():
+        from src.jobs.backends import FirestoreJobBackend
+        return FirestoreJobBackend(get_firestore())
+    return _get_or_create('jobs', create)
+
+def enqueue_job(job_type: str, payload: Dict[str, Any], **kwargs) -> str:
+    """Enqueue a background job; raises QueueFullError under backpressure"""
+    return get_job_backend().enqueue(job_type, payload, **kwargs)
+
+def mark_module_loaded() -> None:
+    """Record the end of module import for the cold-start report"""
+    if _cold_start['moduleLoadedAt'] is None:
+        _cold_start['moduleLoadedAt'] = time.perf_counter() - PROCESS_START
+
+def start_request() -> None:
+    """
+    Per-request hook: sets up logging and logs the cold-start report the
+    first time a request reaches this instance
+    """
+    setup_logging()
+    if _cold_start['firstRequestAt'] is not None:
+        return
+    with _lock:
+        if _cold_start['firstRequestAt'] is not None:
+            return
+        _cold_start['firstRequestAt'] = time.perf_counter() - PROCESS_START
+    logging.info(f"Cold start: {get_cold_start_stats()}")
+
+def get_cold_start_stats() -> Dict[str, Any]:
+    """Import/initialization timings of this instance, in seconds"""
+    return {
+        'moduleLoadSeconds': _cold_start['moduleLoadedAt'],
+        'firstRequestSeconds': _cold_start['firstRequestAt'],
+        'uptimeSeconds': time.perf_counter() - PROCESS_START,
+        'imports': dict(_import_timings),
+        'clients': dict(_init_timings)
+    }
@@ -0,0 +1,176 @@
+import logging
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from src import runtime
+
+# Firestore collection shared by every function instance
+ANALYSIS_CACHE_COLLECTION = 'analysisCache'
+
+# Entries kept in the in-process LRU in front of Firestore
+LOCAL_CACHE_SIZE = 128
+
+# Records the prompt version whose stale entries were last swept, so the
+# full scan for entries written before promptVersion existed runs once
+ANALYSIS_CACHE_STATE_COLLECTION = 'maintenance'
+ANALYSIS_CACHE_STATE_DOC = 'analysisCache'
+
+def compute_pdf_hash(pdf_bytes: bytes) -> str:
+    """Return the SHA-256 hex digest of the PDF bytes"""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+def make_cache_key(pdf_hash: str, target_language: str, version: str) -> str:
+    """Build the cache key (also used as the Firestore document ID)"""
+    return hashlib.sha256(f"{pdf_hash}|{target_language}|{version}".encode('utf-8')).hexdigest()
+
+class AnalysisCache:
+    """
+    Content-addressed cache for analyze_paper results.
+    Lookups go to a local LRU first, then to the Firestore collection.
+    """
+
+    def __init__(self, collection: str = ANALYSIS_CACHE_COLLECTION, max_entries: int = LOCAL_CACHE_SIZE):
+        self.collection = collection
+        self.max_entries = max_entries
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.stats = {
+            'hits': 0,
+            'localHits': 0,
+            'remoteHits': 0,
+            'misses': 0,
+            'writes': 0,
+            'errors': 0,
+            'invalidated': 0
+        }
+
+    def _collection(self):
+        if self._db is None:
+            self._db = runtime.get_firestore()
+        return self._db.collection(self.collection)
+
+    def _remember(self, key: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self._local[key] = result
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def _count(self, *names: str) -> None:
+        with self._lock:
+            for name in names:
+                self.stats[name] += 1
+
+    def get(self, pdf_hash: str, target_language: str, version: str) -> Optional[Dict[str, Any]]:
+        """Return the cached analysis result, or None on a miss"""
+        key = make_cache_key(pdf_hash, target_language, version)
+
+        with self._lock:
+            result = self._local.get(key)
+            if result is not None:
+                self._local.move_to_end(key)
+        if result is not None:
+            self._count('hits', 'localHits')
+            return result
+
+        try:
+            doc = self._collection().document(key).get()
+        except Exception as e:
+            logging.error(f"Analysis cache lookup failed: {str(e)}")
+            self._count('errors', 'misses')
+            return None
+
+        if not doc.exists:
+            self._count('misses')
+            return None
+
+        data = doc.to_dict()
+        result = {
+            'metadata': data.get('metadata', {}),
+            'aiAnalysis': data.get('aiAnalysis', {}),
+            'paperInfo': data.get('paperInfo', {})
+        }
+        if data.get('embedding'):
+            result['embedding'] = data['embedding']
+            result['embeddingModel'] = data.get('embeddingModel')
+        self._remember(key, result)
+        self._count('hits', 'remoteHits')
+        return result
+
+    def set(self, pdf_hash: str, target_language: str, version: str, result: Dict[str, Any], prompt_version: Optional[str] = None) -> None:
+        """
+        Store an analysis result; failures are logged and ignored.
+        version may carry option suffixes; prompt_version (default: version)
+        is what invalidate() compares.
+        """
+        key = make_cache_key(pdf_hash, target_language, version)
+        self._remember(key, result)
+
+        try:
+            from firebase_admin import firestore
+            self._collection().document(key).set({
+                'pdfHash': pdf_hash,
+                'language': target_language,
+                'version': version,
+                'promptVersion': prompt_version or version,
+                'metadata': result.get('metadata', {}),
+                'aiAnalysis': result.get('aiAnalysis', {}),
+                'paperInfo': result.get('paperInfo', {}),
+                'embedding': result.get('embedding'),
+                'embeddingModel': result.get('embeddingModel'),
+                'createdAt': firestore.SERVER_TIMESTAMP
+            })
+            self._count('writes')
+        except Exception as e:
+            logging.error(f"Analysis cache write failed: {str(e)}")
+            self._count('errors')
+
+    def invalidate(self, current_prompt_version: str) -> int:
+        """
+        Delete every entry whose promptVersion differs from
+        current_prompt_version, whatever options its version carries.
+        Entries from before promptVersion was stored are found by a full
+        scan, once per prompt version. Returns the number deleted.
+        """
+        with self._lock:
+            self._local.clear()
+
+        from firebase_admin import firestore
+        db_collection = self._collection()
+        stale = [doc.reference for doc in db_collection.where('promptVersion', '!=', current_prompt_version).select([]).stream()]
+
+        state_ref = self._db.collection(ANALYSIS_CACHE_STATE_COLLECTION).document(ANALYSIS_CACHE_STATE_DOC)
+        state = state_ref.get()
+        if not state.exists or (state.to_dict() or {}).get('promptVersion') != current_prompt_version:
+            for doc in db_collection.select(['version', 'promptVersion']).stream():
+                data = doc.to_dict() or {}
+                version = data.get('version') or ''
+                if 'promptVersion' not in data and version != current_prompt_version and not version.startswith(f"{current_prompt_version}:"):
+                    stale.append(doc.reference)
+
+        persistence = runtime.timed_import('src.utils.persistence')
+        writes = persistence.WriteGroup(self._db)
+        for ref in stale:
+            writes.delete(ref)
+        writes.set(state_ref, {'promptVersion': current_prompt_version, 'sweptAt': firestore.SERVER_TIMESTAMP})
+        writes.commit()
+
+        deleted = len(stale)
+        with self._lock:
+            self.stats['invalidated'] += deleted
+        logging.info(f"Analysis cache invalidated {deleted} entries older than prompt version {current_prompt_version}")
+        return deleted
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the hit/miss counters"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['localEntries'] = len(self._local)
+        lookups = stats['hits'] + stats['misses']
+        stats['hitRate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+# Shared instance used by analyze_paper
+analysis_cache = AnalysisCache()
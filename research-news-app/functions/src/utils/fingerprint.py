@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import re
+from typing import Dict, Any, List, Optional, Iterable
+import numpy as np
+
+# One small document per paper: exact hash, LSH band keys and signature
+FINGERPRINTS_COLLECTION = 'paperFingerprints'
+
+# Text used for the near-duplicate signature; enough pages that an added
+# cover page or a revised section only moves a small share of shingles
+FINGERPRINT_TEXT_CHARS = 100000
+
+# Shingles are runs of SHINGLE_SIZE tokens (words, or single CJK characters)
+SHINGLE_SIZE = 5
+MIN_SHINGLES = 20
+
+# MinHash with 20 bands x 6 rows: pairs above ~0.7 Jaccard almost always
+# share a band (P=0.92 at 0.7, 0.998 at 0.8); candidates are then checked
+# against DUPLICATE_THRESHOLD with the full signature
+LSH_BANDS = 20
+LSH_ROWS = 6
+NUM_PERM = LSH_BANDS * LSH_ROWS
+DUPLICATE_THRESHOLD = 0.7
+
+# Firestore array-contains-any accepts at most this many values per query
+ARRAY_QUERY_LIMIT = 10
+
+# Universal hashing (a * x + b) mod prime over 32-bit shingle hashes; the
+# coefficients are fixed so signatures from every instance are comparable
+_PRIME = 4294967291  # largest prime below 2**32
+_rng = np.random.default_rng(20240131)
+_PERM_A = _rng.integers(1, 2 ** 31, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 2 ** 31, size=NUM_PERM, dtype=np.uint64)
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+|[぀-ヿ㐀-鿿]')
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words and CJK characters; punctuation and layout are ignored"""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """Unique 32-bit hashes of the text's token shingles"""
+    tokens = tokenize(text)
+    hashes = {
+        int.from_bytes(hashlib.blake2b(' '.join(tokens[i:i + SHINGLE_SIZE]).encode('utf-8'), digest_size=4).digest(), 'little')
+        for i in range(max(0, len(tokens) - SHINGLE_SIZE + 1))
+    }
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+def minhash_signature(text: str) -> Optional[np.ndarray]:
+    """NUM_PERM-value MinHash signature, or None if the text is too short"""
+    hashes = shingle_hashes(text)
+    if len(hashes) < MIN_SHINGLES:
+        return None
+    # (NUM_PERM, shingles) matrix of permuted hashes, minimum per row
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+def lsh_band_keys(signature: np.ndarray) -> List[str]:
+    """One key per band; papers sharing a key are duplicate candidates"""
+    return [
+        f"{band}:{hashlib.blake2b(signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes(), digest_size=8).hexdigest()}"
+        for band in range(LSH_BANDS)
+    ]
+
+def estimate_similarity(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the two shingle sets"""
+    return float(np.mean(signature_a == signature_b))
+
+def encode_signature(signature: np.ndarray) -> bytes:
+    return np.asarray(signature, dtype='<u4').tobytes()
+
+def decode_signature(data: Optional[bytes]) -> Optional[np.ndarray]:
+    if not data:
+        return None
+    signature = np.frombuffer(bytes(data), dtype='<u4')
+    return signature if len(signature) == NUM_PERM else None
+
+def _chunks(values: List[str], size: int) -> Iterable[List[str]]:
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def find_exact_duplicate(db, sha256: Optional[str], uploader_id: Optional[str] = None, md5: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Existing paper with the same bytes, preferring one uploaded by
+    uploader_id. Matched by MD5 (known for every upload path), then by
+    SHA-256 (fingerprints saved before MD5 was recorded).
+    """
+    collection = db.collection(FINGERPRINTS_COLLECTION)
+    exact = []
+    for field, value in (('md5', md5), ('sha256', sha256)):
+        if value:
+            exact = [doc.to_dict() | {'paperId': doc.id} for doc in collection.where(field, '==', value).limit(10).stream()]
+        if exact:
+            break
+    if not exact:
+        return None
+    exact.sort(key=lambda fingerprint: fingerprint.get('uploaderId') != uploader_id)
+    best = exact[0]
+    return {
+        'paperId': best['paperId'],
+        'uploaderId': best.get('uploaderId'),
+        'language': best.get('language'),
+        'match': 'exact',
+        'similarity': 1.0
+    }
+
+def find_near_duplicate(db, signature: Optional[np.ndarray], uploader_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Most similar paper above DUPLICATE_THRESHOLD among the LSH candidates"""
+    if signature is None:
+        return None
+    collection = db.collection(FINGERPRINTS_COLLECTION)
+    best = None
+    seen = set()
+    for keys in _chunks(lsh_band_keys(signature), ARRAY_QUERY_LIMIT):
+        for doc in collection.where('lshBands', 'array_contains_any', keys).stream():
+            if doc.id in seen:
+                continue
+            seen.add(doc.id)
+            fingerprint = doc.to_dict()
+            candidate = decode_signature(fingerprint.get('minhash'))
+            if candidate is None:
+                continue
+            similarity = estimate_similarity(signature, candidate)
+            if similarity < DUPLICATE_THRESHOLD:
+                continue
+            rank = (similarity, fingerprint.get('uploaderId') == uploader_id)
+            if best is None or rank > best[0]:
+                best = (rank, {
+                    'paperId': doc.id,
+                    'uploaderId': fingerprint.get('uploaderId'),
+                    'language': fingerprint.get('language'),
+                    'match': 'near',
+                    'similarity': round(similarity, 3)
+                })
+    return best[1] if best else None
+
+def find_duplicate(db, sha256: Optional[str], signature: Optional[np.ndarray], uploader_id: Optional[str] = None, md5: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Look up an existing paper with the same bytes, or failing that the most
+    similar near-duplicate above DUPLICATE_THRESHOLD. Matches uploaded by
+    uploader_id are preferred. Returns {paperId, uploaderId, language,
+    match: "exact"|"near", similarity} or None.
+    """
+    return find_exact_duplicate(db, sha256, uploader_id, md5) or find_near_duplicate(db, signature, uploader_id)
+
+def save_fingerprint(db, paper_id: str, uploader_id: str, sha256: Optional[str], signature: Optional[np.ndarray], language: str, batch=None, md5: Optional[str] = None) -> None:
+    """
+    Record a paper's fingerprint so later uploads can match it; with batch
+    (a persistence.WriteGroup) it is written in the batch's commit
+    """
+    from firebase_admin import firestore
+    fingerprint_ref = db.collection(FINGERPRINTS_COLLECTION).document(paper_id)
+    fingerprint_data = {
+        'uploaderId': uploader_id,
+        'sha256': sha256,
+        'md5': md5,
+        'minhash': encode_signature(signature) if signature is not None else None,
+        'lshBands': lsh_band_keys(signature) if signature is not None else [],
+        'language': language,
+        'createdAt': firestore.SERVER_TIMESTAMP
+    }
+    if batch is not None:
+        batch.set(fingerprint_ref, fingerprint_data)
+    else:
+        fingerprint_ref.set(fingerprint_data)
+
+def text_signature(source) -> Optional[np.ndarray]:
+    """
+    MinHash signature of a PDF's text (bytes or a seekable stream such as
+    a Storage blob reader); None for scanned or unreadable PDFs
+    """
+    try:
+        from src.ai.paper_analysis import extract_text_from_pdf
+        return minhash_signature(extract_text_from_pdf(source, max_chars=FINGERPRINT_TEXT_CHARS))
+    except Exception as e:
+        logging.warning(f"Text fingerprint failed: {str(e)}")
+        return None
+
+# Analysis fields a duplicate inherits from the paper it matches (the
+# embedding is only inline on papers stored before details/embedding)
+ANALYSIS_FIELDS = ['processingStatus', 'metadata', 'aiAnalysis', 'title', 'authors', 'journal', 'publicationDate', 'doi', 'embedding', 'embeddingModel']
+
+def reusable_analysis(db, paper_id: str) -> Optional[Dict[str, Any]]:
+    """Analysis fields of a completed paper, or None if it is not analyzed (yet)"""
+    snapshot = db.collection('papers').document(paper_id).get(field_paths=ANALYSIS_FIELDS)
+    if not snapshot.exists:
+        return None
+    paper = snapshot.to_dict() or {}
+    if paper.get('processingStatus') != 'completed' or not paper.get('aiAnalysis'):
+        return None
+    return {field: paper[field] for field in ANALYSIS_FIELDS if field in paper}
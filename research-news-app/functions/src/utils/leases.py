@@ -0,0 +1,163 @@
+import logging
+import time
+import uuid
+from typing import Dict, Any, List, Optional, Tuple
+from src.utils import persistence
+
+# Lease on a paper or newspaper document while its pipeline runs; other
+# callers for the same document wait for the result or get a 202
+LEASE_FIELD = 'processingLease'
+
+# Request ID of the last run that completed, so retries with the same
+# idempotency key get the stored result instead of a new run
+LAST_REQUEST_FIELD = 'processingRequestId'
+
+# Longer than the 540s function timeout, so a lease only outlives its run
+# when the instance died; expired leases are reclaimed by the next caller
+LEASE_SECONDS = 600
+
+# How long a duplicate caller that asked to wait polls for the result
+LEASE_WAIT_SECONDS = 120
+LEASE_POLL_SECONDS = 2.0
+
+# Claim outcomes
+LEASE_ACQUIRED = 'acquired'
+LEASE_IN_PROGRESS = 'in_progress'
+LEASE_COMPLETED = 'completed'
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+def request_id_from(req, data: Optional[Dict[str, Any]] = None) -> str:
+    """Caller-supplied idempotency key (header or body), or a fresh ID"""
+    return (
+        req.headers.get('Idempotency-Key')
+        or (data or {}).get('request_id')
+        or new_request_id()
+    )
+
+def active_lease(document: Dict[str, Any], now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """The document's lease if it has one that has not expired"""
+    lease = document.get(LEASE_FIELD)
+    if not lease or (lease.get('expiresAt') or 0) <= (now or time.time()):
+        return None
+    return lease
+
+def claim_lease(db, doc_ref, request_id: str, owner: str, lease_seconds: float = LEASE_SECONDS, status_field: str = 'processingStatus') -> Dict[str, Any]:
+    """
+    Atomically take the processing lease on doc_ref and mark the document
+    processing. Returns {"state": acquired | in_progress | completed,
+    "lease": current lease, "document": document data}. A live lease
+    held by another request means in_progress; a completed run with the
+    same request_id means completed. Raises LookupError if the document
+    does not exist.
+    """
+    from firebase_admin import firestore
+
+    @firestore.transactional
+    def claim(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            raise LookupError(f"Document {doc_ref.id} not found")
+        document = snapshot.to_dict() or {}
+        now = time.time()
+
+        if document.get(LAST_REQUEST_FIELD) == request_id and document.get(status_field) == 'completed':
+            return {'state': LEASE_COMPLETED, 'lease': None, 'document': document}
+
+        lease = active_lease(document, now)
+        if lease is not None:
+            return {'state': LEASE_IN_PROGRESS, 'lease': lease, 'document': document}
+
+        stale = document.get(LEASE_FIELD)
+        if stale:
+            logging.warning(f"Reclaiming expired lease {stale.get('requestId')} on {doc_ref.id}")
+        lease = {'requestId': request_id, 'owner': owner, 'acquiredAt': now, 'expiresAt': now + lease_seconds}
+        transaction.update(doc_ref, {
+            LEASE_FIELD: lease,
+            status_field: 'processing',
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
+        return {'state': LEASE_ACQUIRED, 'lease': lease, 'document': {**document, LEASE_FIELD: lease, status_field: 'processing'}}
+
+    # Not recorded as a paced write: progress right after the claim is
+    # written at once instead of waiting out the claim's window
+    return claim(db.transaction())
+
+def release_lease(db, doc_ref, request_id: str, fields: Dict[str, Any], extra_sets: Optional[List[Tuple[Any, Dict[str, Any]]]] = None) -> bool:
+    """
+    Write a run's final fields and drop its lease, only if the lease is
+    still held by request_id. Returns False (writing nothing) when the
+    lease expired and was reclaimed, so a stale run cannot overwrite the
+    result of the run that replaced it. extra_sets are (ref, data) pairs
+    set in the same transaction (e.g. a details document).
+    """
+    from firebase_admin import firestore
+
+    @firestore.transactional
+    def release(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        document = snapshot.to_dict() if snapshot.exists else None
+        lease = (document or {}).get(LEASE_FIELD) or {}
+        if lease.get('requestId') != request_id:
+            return False
+        transaction.update(doc_ref, {
+            **fields,
+            LEASE_FIELD: firestore.DELETE_FIELD,
+            LAST_REQUEST_FIELD: request_id
+        })
+        for ref, data in extra_sets or []:
+            transaction.set(ref, data)
+        return True
+
+    released = release(db.transaction())
+    if released:
+        persistence.record_write(doc_ref)
+    else:
+        logging.warning(f"Lease {request_id} on {doc_ref.id} was lost; result not written")
+    return released
+
+def update_if_leased(db, doc_ref, request_id: str, fields: Dict[str, Any]) -> bool:
+    """
+    Update fields on doc_ref (keeping the lease) only while request_id
+    holds its lease. Returns False, writing nothing, once the lease was
+    lost, so a stale run cannot write into a newer run's document.
+    """
+    from firebase_admin import firestore
+
+    @firestore.transactional
+    def update(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        lease = ((snapshot.to_dict() or {}) if snapshot.exists else {}).get(LEASE_FIELD) or {}
+        if lease.get('requestId') != request_id:
+            return False
+        transaction.update(doc_ref, fields)
+        return True
+
+    return update(db.transaction())
+
+def wait_for_release(doc_ref, timeout: float = LEASE_WAIT_SECONDS, poll_interval: float = LEASE_POLL_SECONDS) -> Optional[Dict[str, Any]]:
+    """
+    Poll until the document has no live lease and return its data, or
+    None if the lease is still held after timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        snapshot = doc_ref.get()
+        document = snapshot.to_dict() if snapshot.exists else {}
+        if active_lease(document) is None:
+            return document
+        if time.monotonic() + poll_interval > deadline:
+            return None
+        time.sleep(poll_interval)
+
+def in_progress_body(claim: Dict[str, Any]) -> Dict[str, Any]:
+    """Response body for a duplicate caller told to come back later (202)"""
+    lease = claim.get('lease') or {}
+    return {
+        'success': False,
+        'status': 'processing',
+        'inFlightRequestId': lease.get('requestId'),
+        'leaseExpiresAt': lease.get('expiresAt'),
+        'retryAfter': int(LEASE_POLL_SECONDS * 5)
+    }
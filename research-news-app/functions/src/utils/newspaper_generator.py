@@ -1,129 +1,50 @@
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple, Callable, Iterable
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
 import json
-from google.cloud import secretmanager
-import vertexai
-from vertexai.generative_models import GenerativeModel
 import random
+from collections import Counter
+from src import runtime
 
-# Initialize clients
-secret_client = secretmanager.SecretManagerServiceClient()
+# Paper fields read by generate_newspaper_content (Firestore field mask)
+PAPER_FIELDS = [
+    'title',
+    'authors',
+    'aiAnalysis.summary',
+    'aiAnalysis.keypoints',
+    'aiAnalysis.academicField',
+    'aiAnalysis.significance',
+    'embedding'
+]
 
-def get_secret(secret_name: str) -> str:
-    """Get secret from Secret Manager"""
-    project_id = "ronshin-72b20"
-    name = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
-    response = secret_client.access_secret_version(request={"name": name})
-    return response.payload.data.decode("UTF-8")
+# Generation strategies: "standard" makes one call per section, "compact"
+# produces the whole newspaper in a single structured call
+GENERATION_STRATEGIES = ("standard", "compact")
 
-def generate_newspaper_content(papers: List[Dict[str, Any]], template: Dict[str, Any], newspaper_id: str, language: str = "ja") -> Dict[str, Any]:
-    """
-    Generate newspaper content from papers using Vertex AI
-    """
-    try:
-        # Initialize Vertex AI
-        project_id = "ronshin-72b20"  # Use project ID directly
-        vertexai.init(project=project_id, location="us-central1")
-        model = GenerativeModel("gemini-2.0-flash-001")
-        
-        # Prepare paper summaries for AI
-        paper_summaries = []
-        for i, paper in enumerate(papers):
-            ai_analysis = paper.get('aiAnalysis', {})
-            if language == "en":
-                paper_summaries.append(f"""
-Paper {i+1}:
-Title: {paper.get('title', 'Unknown')}
-Authors: {', '.join(paper.get('authors', ['Unknown']))}
-Summary: {ai_analysis.get('summary', '')}
-Key Points: {', '.join(ai_analysis.get('keypoints', []))}
-Research Field: {ai_analysis.get('academicField', '')}
-Significance: {ai_analysis.get('significance', '')}
-                """)
-            else:
-                paper_summaries.append(f"""
-論文{i+1}:
-タイトル: {paper.get('title', '不明')}
-著者: {', '.join(paper.get('authors', ['不明']))}
-要約: {ai_analysis.get('summary', '')}
-重要ポイント: {', '.join(ai_analysis.get('keypoints', []))}
-研究分野: {ai_analysis.get('academicField', '')}
-意義: {ai_analysis.get('significance', '')}
-                """)
-        
-        # Step 1: Analyze relationships and determine importance
-        if language == "en":
-            relationship_prompt = f"""
-Below are summaries of {len(papers)} academic papers. Analyze these papers and structure them for newspaper articles.
+# on_section(section, payload) callback for progressive generation
+SectionCallback = Callable[[str, Any], None]
 
-{chr(10).join(paper_summaries)}
+# Main article + up to 4 sub articles + sidebar + title/theme
+MAX_CONCURRENT_GENERATIONS = 7
 
-Respond in JSON format:
-{{
-    "mainPaperIndex": Index of the paper to be the main article (0-{len(papers)-1}),
-    "overallTheme": "Overall theme or research area",
-    "newspaperTitle": "Creative newspaper title that captures the essence of all papers",
-    "connectionMap": {{
-        "0-1": "Relationship between paper 0 and paper 1",
-        "0-2": "Relationship between paper 0 and paper 2",
-        ...(all combinations)
-    }},
-    "subArticleOrder": [Array of paper indices for sub-articles]
-}}
-"""
-        else:
-            relationship_prompt = f"""
-以下は{len(papers)}つの学術論文の要約です。これらの論文を分析し、新聞記事として構成するための分析を行ってください。
+# Part of every section fingerprint; bump when prompts or parsing change
+# so stored sections are regenerated instead of reused
+GENERATION_PROMPT_VERSION = "1"
 
-{chr(10).join(paper_summaries)}
+# Sections that can be forced to regenerate ("subArticle:<paperId>" for one
+# sub article); "relationship" re-runs the structure step as well
+REFRESHABLE_SECTIONS = ("relationship", "header", "mainArticle", "subArticles", "sidebarContent")
 
-以下の形式でJSON形式で回答してください：
-{{
-    "mainPaperIndex": メイン記事にすべき論文のインデックス（0-{len(papers)-1}）,
-    "overallTheme": "全体を通したテーマや研究領域",
-    "newspaperTitle": "すべての論文のエッセンスを捉えた創造的な新聞名",
-    "connectionMap": {{
-        "0-1": "論文0と論文1の関連性",
-        "0-2": "論文0と論文2の関連性",
-        ...（すべての組み合わせ）
-    }},
-    "subArticleOrder": [サブ記事の論文インデックスの順序配列]
-}}
-"""
-        
-        relationship_response = model.generate_content(relationship_prompt)
-        
-        # Parse relationship analysis
-        try:
-            rel_text = relationship_response.text
-            start_idx = rel_text.find('{')
-            end_idx = rel_text.rfind('}') + 1
-            if start_idx != -1 and end_idx > start_idx:
-                relationship_data = json.loads(rel_text[start_idx:end_idx])
-            else:
-                # Fallback
-                relationship_data = {
-                    "mainPaperIndex": 0,
-                    "overallTheme": "Academic Research Updates" if language == "en" else "学術研究の最新動向",
-                    "newspaperTitle": "Research Frontier Times" if language == "en" else "研究最前線タイムズ",
-                    "subArticleOrder": list(range(1, len(papers)))
-                }
-        except:
-            relationship_data = {
-                "mainPaperIndex": 0,
-                "overallTheme": "Academic Research Updates" if language == "en" else "学術研究の最新動向",
-                "newspaperTitle": "Research Frontier Times" if language == "en" else "研究最前線タイムズ",
-                "subArticleOrder": list(range(1, len(papers)))
-            }
-        
-        main_paper_idx = relationship_data.get('mainPaperIndex', 0)
-        main_paper = papers[main_paper_idx]
-        sub_paper_indices = relationship_data.get('subArticleOrder', [i for i in range(len(papers)) if i != main_paper_idx])
-        
-        # Step 2: Generate main article
-        if language == "en":
-            main_article_prompt = f"""
+def get_secret(secret_name: str) -> str:
+    """Get secret from Secret Manager"""
+    return runtime.get_secret(secret_name)
+
+def build_main_article_prompt(main_paper: Dict[str, Any], relationship_data: Dict[str, Any], language: str = "ja") -> str:
+    """Build the prompt for the main article"""
+    if language == "en":
+        return f"""
 You are an excellent science journalist. Convert the following academic paper into a newspaper main article for general readers.
 
 Paper Information:
@@ -148,8 +69,7 @@ As a newspaper article:
 - Mention the social significance and future applications of the research
 - Structure paragraphs for easy reading
 """
-        else:
-            main_article_prompt = f"""
+    return f"""
 あなたは優れた科学ジャーナリストです。以下の学術論文を一般読者向けの新聞記事（メイン記事）に変換してください。
 
 論文情報:
@@ -174,39 +94,55 @@ As a newspaper article:
 - 研究の社会的意義や将来の応用について言及
 - 縦書きの新聞記事として読みやすい段落構成
 """
-        
-        main_response = model.generate_content(main_article_prompt)
-        
-        # Parse main article
-        try:
-            main_text = main_response.text
-            start_idx = main_text.find('{')
-            end_idx = main_text.rfind('}') + 1
-            if start_idx != -1 and end_idx > start_idx:
-                main_article_data = json.loads(main_text[start_idx:end_idx])
-            else:
-                raise ValueError("No JSON found")
-        except:
-            if language == "en":
-                main_article_data = {
-                    "headline": "Latest Research Reveals the Future",
-                    "subheadline": "Innovative Discoveries Show New Possibilities",
-                    "content": "Research results announced today reveal the potential for significant changes in our future..."
-                }
-            else:
-                main_article_data = {
-                    "headline": "最新研究が明らかにする未来",
-                    "subheadline": "革新的発見が示す新たな可能性",
-                    "content": "本日発表された研究成果により、私たちの未来に大きな変革がもたらされる可能性が明らかになった..."
-                }
-        
-        # Step 3: Generate sub articles
-        sub_articles = []
-        for idx in sub_paper_indices[:4]:  # Take first 4 sub papers
-            if idx < len(papers):
-                sub_paper = papers[idx]
-                if language == "en":
-                    sub_prompt = f"""
+
+def default_relationship_data(papers: List[Dict[str, Any]], language: str = "ja") -> Dict[str, Any]:
+    """Relationship analysis used when the model response cannot be parsed"""
+    return {
+        "mainPaperIndex": 0,
+        "overallTheme": "Academic Research Updates" if language == "en" else "学術研究の最新動向",
+        "newspaperTitle": "Research Frontier Times" if language == "en" else "研究最前線タイムズ",
+        "subArticleOrder": list(range(1, len(papers)))
+    }
+
+def default_main_article(language: str = "ja") -> Dict[str, Any]:
+    """Main article used when the model response cannot be parsed"""
+    if language == "en":
+        return {
+            "headline": "Latest Research Reveals the Future",
+            "subheadline": "Innovative Discoveries Show New Possibilities",
+            "content": "Research results announced today reveal the potential for significant changes in our future..."
+        }
+    return {
+        "headline": "最新研究が明らかにする未来",
+        "subheadline": "革新的発見が示す新たな可能性",
+        "content": "本日発表された研究成果により、私たちの未来に大きな変革がもたらされる可能性が明らかになった..."
+    }
+
+def default_sub_article(sub_paper: Dict[str, Any], position: int, language: str = "ja") -> Dict[str, Any]:
+    """Numbered sub article used when the model response cannot be parsed"""
+    return {
+        "headline": f"Research Result {position}" if language == "en" else f"研究成果{position}",
+        "content": "New discoveries deepen our understanding of this field." if language == "en" else "新たな発見により、この分野の理解が深まりました。",
+        "paperId": sub_paper.get('id', '')
+    }
+
+def parse_main_article(main_response: Any, language: str = "ja") -> Dict[str, Any]:
+    """Parse the main article response, falling back to a generic article"""
+    try:
+        main_text = main_response.text
+        start_idx = main_text.find('{')
+        end_idx = main_text.rfind('}') + 1
+        if start_idx != -1 and end_idx > start_idx:
+            return json.loads(main_text[start_idx:end_idx])
+        else:
+            raise ValueError("No JSON found")
+    except:
+        return default_main_article(language)
+
+def build_sub_article_prompt(sub_paper: Dict[str, Any], language: str = "ja") -> str:
+    """Build the prompt for a sub article"""
+    if language == "en":
+        return f"""
 Convert the following academic paper into a concise newspaper sub-article.
 
 Paper Information:
@@ -220,8 +156,7 @@ Create an article in JSON format:
     "content": "Content (about 200 words)"
 }}
 """
-                else:
-                    sub_prompt = f"""
+    return f"""
 以下の学術論文を簡潔な新聞記事（サブ記事）に変換してください。
 
 論文情報:
@@ -235,30 +170,32 @@ Create an article in JSON format:
     "content": "本文（200字程度）"
 }}
 """
-                
-                sub_response = model.generate_content(sub_prompt)
-                
-                try:
-                    sub_text = sub_response.text
-                    start_idx = sub_text.find('{')
-                    end_idx = sub_text.rfind('}') + 1
-                    if start_idx != -1 and end_idx > start_idx:
-                        sub_data = json.loads(sub_text[start_idx:end_idx])
-                        sub_articles.append({
-                            "headline": sub_data.get("headline", "Research Results" if language == "en" else "研究成果"),
-                            "content": sub_data.get("content", "See the main text for details." if language == "en" else "詳細は本文をご覧ください。"),
-                            "paperId": papers[idx].get('id', '')
-                        })
-                except:
-                    sub_articles.append({
-                        "headline": f"Research Result {len(sub_articles)+1}" if language == "en" else f"研究成果{len(sub_articles)+1}",
-                        "content": "New discoveries deepen our understanding of this field." if language == "en" else "新たな発見により、この分野の理解が深まりました。",
-                        "paperId": papers[idx].get('id', '')
-                    })
-        
-        # Step 4: Generate sidebar and other content
-        if language == "en":
-            sidebar_prompt = f"""
+
+def parse_sub_article(sub_response: Any, sub_paper: Dict[str, Any], position: int, language: str = "ja") -> Optional[Dict[str, Any]]:
+    """
+    Parse a sub article response.
+    Returns None when the response contains no JSON, and a numbered fallback
+    article (using position) when parsing fails.
+    """
+    try:
+        sub_text = sub_response.text
+        start_idx = sub_text.find('{')
+        end_idx = sub_text.rfind('}') + 1
+        if start_idx != -1 and end_idx > start_idx:
+            sub_data = json.loads(sub_text[start_idx:end_idx])
+            return {
+                "headline": sub_data.get("headline", "Research Results" if language == "en" else "研究成果"),
+                "content": sub_data.get("content", "See the main text for details." if language == "en" else "詳細は本文をご覧ください。"),
+                "paperId": sub_paper.get('id', '')
+            }
+        return None
+    except:
+        return default_sub_article(sub_paper, position, language)
+
+def build_sidebar_prompt(relationship_data: Dict[str, Any], language: str = "ja") -> str:
+    """Build the prompt for the sidebar content"""
+    if language == "en":
+        return f"""
 Based on the following research papers, create sidebar content for the newspaper.
 
 Overall Theme: {relationship_data.get('overallTheme', '')}
@@ -270,8 +207,7 @@ Include the following in the sidebar (about 200 words):
 
 Make it concise and engaging for readers.
 """
-        else:
-            sidebar_prompt = f"""
+    return f"""
 以下の研究論文群の情報を基に、新聞のサイドバーコンテンツを作成してください。
 
 全体テーマ: {relationship_data.get('overallTheme', '')}
@@ -283,72 +219,640 @@ Make it concise and engaging for readers.
 
 簡潔で読者の興味を引く内容にしてください。
 """
+
+def generate_content_batch(model: Any, prompts: List[str], concurrent: bool = True, max_workers: int = MAX_CONCURRENT_GENERATIONS, on_response: Optional[Callable[[int, Any], None]] = None) -> List[Any]:
+    """
+    Call model.generate_content for each prompt.
+    In concurrent mode the requests run on a bounded thread pool; responses
+    are always returned in the same order as prompts. on_response(index,
+    response) is called in the calling thread as soon as each one arrives.
+    """
+    if not concurrent or len(prompts) <= 1:
+        responses = []
+        for i, prompt in enumerate(prompts):
+            responses.append(model.generate_content(prompt))
+            if on_response:
+                on_response(i, responses[i])
+        return responses
+    
+    responses = [None] * len(prompts)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prompts)))) as executor:
+        futures = {executor.submit(model.generate_content, prompt): i for i, prompt in enumerate(prompts)}
+        for future in as_completed(futures):
+            i = futures[future]
+            responses[i] = future.result()
+            if on_response:
+                on_response(i, responses[i])
+    return responses
+
+def emit_section(on_section: Optional[SectionCallback], section: str, payload: Any) -> None:
+    """Report a finished section; callback errors never abort generation"""
+    if not on_section:
+        return
+    try:
+        on_section(section, payload)
+    except Exception as e:
+        logging.error(f"Section callback failed for {section}: {str(e)}")
+
+def build_paper_summaries(papers: List[Dict[str, Any]], language: str = "ja") -> List[str]:
+    """Summaries of each paper shared by the relationship and compact prompts"""
+    paper_summaries = []
+    for i, paper in enumerate(papers):
+        ai_analysis = paper.get('aiAnalysis', {})
+        if language == "en":
+            paper_summaries.append(f"""
+Paper {i+1}:
+Title: {paper.get('title', 'Unknown')}
+Authors: {', '.join(paper.get('authors', ['Unknown']))}
+Summary: {ai_analysis.get('summary', '')}
+Key Points: {', '.join(ai_analysis.get('keypoints', []))}
+Research Field: {ai_analysis.get('academicField', '')}
+Significance: {ai_analysis.get('significance', '')}
+                """)
+        else:
+            paper_summaries.append(f"""
+論文{i+1}:
+タイトル: {paper.get('title', '不明')}
+著者: {', '.join(paper.get('authors', ['不明']))}
+要約: {ai_analysis.get('summary', '')}
+重要ポイント: {', '.join(ai_analysis.get('keypoints', []))}
+研究分野: {ai_analysis.get('academicField', '')}
+意義: {ai_analysis.get('significance', '')}
+                """)
+    return paper_summaries
+
+def build_relationship_prompt(papers: List[Dict[str, Any]], paper_summaries: List[str], language: str = "ja") -> str:
+    """Build the prompt for the relationship analysis (step 1)"""
+    if language == "en":
+        return f"""
+Below are summaries of {len(papers)} academic papers. Analyze these papers and structure them for newspaper articles.
+
+{chr(10).join(paper_summaries)}
+
+Respond in JSON format:
+{{
+    "mainPaperIndex": Index of the paper to be the main article (0-{len(papers)-1}),
+    "overallTheme": "Overall theme or research area",
+    "newspaperTitle": "Creative newspaper title that captures the essence of all papers",
+    "connectionMap": {{
+        "0-1": "Relationship between paper 0 and paper 1",
+        "0-2": "Relationship between paper 0 and paper 2",
+        ...(all combinations)
+    }},
+    "subArticleOrder": [Array of paper indices for sub-articles]
+}}
+"""
+    return f"""
+以下は{len(papers)}つの学術論文の要約です。これらの論文を分析し、新聞記事として構成するための分析を行ってください。
+
+{chr(10).join(paper_summaries)}
+
+以下の形式でJSON形式で回答してください：
+{{
+    "mainPaperIndex": メイン記事にすべき論文のインデックス（0-{len(papers)-1}）,
+    "overallTheme": "全体を通したテーマや研究領域",
+    "newspaperTitle": "すべての論文のエッセンスを捉えた創造的な新聞名",
+    "connectionMap": {{
+        "0-1": "論文0と論文1の関連性",
+        "0-2": "論文0と論文2の関連性",
+        ...（すべての組み合わせ）
+    }},
+    "subArticleOrder": [サブ記事の論文インデックスの順序配列]
+}}
+"""
+
+def build_embedding_relationship(papers: List[Dict[str, Any]], vectors: Any, language: str = "ja") -> Dict[str, Any]:
+    """
+    Relationship analysis from paper embeddings (no model call): structure
+    from rank_papers, and the most common research field as a provisional
+    theme until the model names one.
+    """
+    from src.ai.embeddings import rank_papers
+    relationship_data = default_relationship_data(papers, language)
+    relationship_data.update(rank_papers(vectors))
+    fields = Counter(
+        paper.get('aiAnalysis', {}).get('academicField', '')
+        for paper in papers
+        if paper.get('aiAnalysis', {}).get('academicField')
+    )
+    if fields:
+        relationship_data['overallTheme'] = fields.most_common(1)[0][0]
+    relationship_data['newspaperTitle'] = ''
+    return relationship_data
+
+def build_theme_prompt(papers: List[Dict[str, Any]], paper_summaries: List[str], relationship_data: Dict[str, Any], language: str = "ja") -> str:
+    """Build the prompt that only asks for the newspaper title and theme"""
+    main_number = relationship_data.get('mainPaperIndex', 0) + 1
+    if language == "en":
+        return f"""
+Below are summaries of {len(papers)} academic papers that appear together in one newspaper issue. Paper {main_number} is the main article.
+
+{chr(10).join(paper_summaries)}
+
+Respond in JSON format:
+{{
+    "overallTheme": "Overall theme or research area",
+    "newspaperTitle": "Creative newspaper title that captures the essence of all papers"
+}}
+"""
+    return f"""
+以下は1つの新聞に掲載される{len(papers)}つの学術論文の要約です。論文{main_number}がメイン記事です。
+
+{chr(10).join(paper_summaries)}
+
+以下の形式でJSON形式で回答してください：
+{{
+    "overallTheme": "全体を通したテーマや研究領域",
+    "newspaperTitle": "すべての論文のエッセンスを捉えた創造的な新聞名"
+}}
+"""
+
+def parse_theme(theme_response: Any, relationship_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge the title and theme from the model into relationship_data"""
+    merged = dict(relationship_data)
+    try:
+        theme_text = theme_response.text
+        start_idx = theme_text.find('{')
+        end_idx = theme_text.rfind('}') + 1
+        if start_idx != -1 and end_idx > start_idx:
+            data = json.loads(theme_text[start_idx:end_idx])
+            for key in ("overallTheme", "newspaperTitle"):
+                if isinstance(data.get(key), str) and data[key]:
+                    merged[key] = data[key]
+    except Exception as e:
+        logging.error(f"Failed to parse theme response: {str(e)}")
+    return merged
+
+def parse_relationship(relationship_response: Any, papers: List[Dict[str, Any]], language: str = "ja") -> Dict[str, Any]:
+    """Parse the relationship analysis, falling back to paper order"""
+    try:
+        rel_text = relationship_response.text
+        start_idx = rel_text.find('{')
+        end_idx = rel_text.rfind('}') + 1
+        if start_idx != -1 and end_idx > start_idx:
+            return json.loads(rel_text[start_idx:end_idx])
+        else:
+            # Fallback
+            return default_relationship_data(papers, language)
+    except:
+        return default_relationship_data(papers, language)
+
+def build_compact_prompt(papers: List[Dict[str, Any]], paper_summaries: List[str], language: str = "ja") -> str:
+    """Build the single prompt used by the compact strategy"""
+    if language == "en":
+        return f"""
+You are an excellent science journalist. Below are summaries of {len(papers)} academic papers. Turn them into the front page of a newspaper for general readers.
+
+{chr(10).join(paper_summaries)}
+
+Respond with a single JSON object:
+{{
+    "mainPaperIndex": Index of the paper to be the main article (0-{len(papers)-1}),
+    "overallTheme": "Overall theme or research area",
+    "newspaperTitle": "Creative newspaper title that captures the essence of all papers",
+    "subArticleOrder": [Array of paper indices for sub-articles, excluding the main paper],
+    "mainArticle": {{
+        "headline": "Headline (within 50 characters, impactful expression)",
+        "subheadline": "Subheadline (within 80 characters)",
+        "content": "Main content (about 500 words, explaining the importance of the research in an accessible way)"
+    }},
+    "subArticles": [
+        {{"paperIndex": Index of the paper, "headline": "Headline (within 40 characters)", "content": "Content (about 200 words)"}}
+    ],
+    "sidebar": "Sidebar (about 200 words): related keywords (5-7), a brief explanation of the research field and future prospects"
+}}
+
+Write one sub article for every paper in subArticleOrder. Avoid technical jargon and explain briefly when necessary.
+"""
+    return f"""
+あなたは優れた科学ジャーナリストです。以下は{len(papers)}つの学術論文の要約です。これらを一般読者向けの新聞一面に構成してください。
+
+{chr(10).join(paper_summaries)}
+
+以下の形式の1つのJSONオブジェクトで回答してください：
+{{
+    "mainPaperIndex": メイン記事にすべき論文のインデックス（0-{len(papers)-1}）,
+    "overallTheme": "全体を通したテーマや研究領域",
+    "newspaperTitle": "すべての論文のエッセンスを捉えた創造的な新聞名",
+    "subArticleOrder": [メイン記事以外のサブ記事の論文インデックスの順序配列],
+    "mainArticle": {{
+        "headline": "見出し（20文字以内、インパクトのある表現）",
+        "subheadline": "小見出し（30文字以内）",
+        "content": "本文（500字程度、一般読者にもわかりやすく研究の重要性を伝える内容）"
+    }},
+    "subArticles": [
+        {{"paperIndex": 論文のインデックス, "headline": "見出し（15文字以内）", "content": "本文（200字程度）"}}
+    ],
+    "sidebar": "サイドバー（200字程度）：関連キーワード（5-7個）、研究分野の簡単な解説、今後の研究展望"
+}}
+
+subArticleOrderのすべての論文についてサブ記事を作成してください。専門用語は避け、必要な場合は簡潔に説明してください。
+"""
+
+def parse_compact_newspaper(compact_response: Any, papers: List[Dict[str, Any]], language: str = "ja") -> Tuple[Dict[str, Any], Dict[str, Any], List[Dict[str, Any]], str]:
+    """
+    Parse the compact response into (relationship_data, main_article_data,
+    sub_articles, sidebar_content). Missing or malformed sections get the
+    same fallbacks as the standard strategy.
+    """
+    try:
+        compact_text = compact_response.text
+        start_idx = compact_text.find('{')
+        end_idx = compact_text.rfind('}') + 1
+        if start_idx != -1 and end_idx > start_idx:
+            data = json.loads(compact_text[start_idx:end_idx])
+        else:
+            raise ValueError("No JSON found")
+    except Exception as e:
+        logging.error(f"Failed to parse compact newspaper response: {str(e)}")
+        data = {}
+    
+    relationship_data = default_relationship_data(papers, language)
+    for key in ("overallTheme", "newspaperTitle"):
+        if isinstance(data.get(key), str) and data[key]:
+            relationship_data[key] = data[key]
+    main_paper_idx = data.get("mainPaperIndex")
+    if isinstance(main_paper_idx, int) and 0 <= main_paper_idx < len(papers):
+        relationship_data["mainPaperIndex"] = main_paper_idx
+    main_paper_idx = relationship_data["mainPaperIndex"]
+    sub_order = data.get("subArticleOrder")
+    if isinstance(sub_order, list):
+        relationship_data["subArticleOrder"] = [idx for idx in sub_order if isinstance(idx, int) and 0 <= idx < len(papers) and idx != main_paper_idx]
+    else:
+        relationship_data["subArticleOrder"] = [i for i in range(len(papers)) if i != main_paper_idx]
+    
+    main_article_data = data.get("mainArticle")
+    if not isinstance(main_article_data, dict) or not main_article_data.get("headline"):
+        main_article_data = default_main_article(language)
+    
+    generated_subs = {}
+    for sub_data in data.get("subArticles") or []:
+        if isinstance(sub_data, dict) and isinstance(sub_data.get("paperIndex"), int):
+            generated_subs.setdefault(sub_data["paperIndex"], sub_data)
+    
+    sub_articles = []
+    for idx in relationship_data["subArticleOrder"][:4]:  # Take first 4 sub papers
+        sub_data = generated_subs.get(idx)
+        if sub_data:
+            sub_articles.append({
+                "headline": sub_data.get("headline", "Research Results" if language == "en" else "研究成果"),
+                "content": sub_data.get("content", "See the main text for details." if language == "en" else "詳細は本文をご覧ください。"),
+                "paperId": papers[idx].get('id', '')
+            })
+        else:
+            sub_articles.append(default_sub_article(papers[idx], len(sub_articles) + 1, language))
+    
+    sidebar_content = str(data.get("sidebar") or "")[:300]
+    
+    return relationship_data, main_article_data, sub_articles, sidebar_content
+
+def build_header(relationship_data: Dict[str, Any], language: str = "ja") -> Dict[str, Any]:
+    """Build the newspaper header (name, date and issue number)"""
+    # Use the AI-generated newspaper title or fall back to defaults
+    newspaper_title = relationship_data.get('newspaperTitle', '')
+    if not newspaper_title:
+        if language == "en":
+            newspaper_names = [
+                "Research Frontier Times",
+                "Science Tribune",
+                "Academic Topics News",
+                "Research News",
+                "Scholar's Eye"
+            ]
+        else:
+            newspaper_names = [
+                "研究最前線タイムズ",
+                "サイエンス新報",
+                "学術トピックス新聞",
+                "リサーチニュース",
+                "研究者の眼"
+            ]
+        newspaper_title = random.choice(newspaper_names)
+    
+    now = datetime.now()
+    if language == "en":
+        return {
+            "newspaperName": newspaper_title,
+            "date": now.strftime('%B %d, %Y'),
+            "issueNumber": f"Issue #{random.randint(100, 999)}"
+        }
+    return {
+        "newspaperName": newspaper_title,
+        "date": now.strftime('%Y年%m月%d日'),
+        "issueNumber": f"第{random.randint(100, 999)}号"
+    }
+
+def build_main_article(main_paper: Dict[str, Any], main_article_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the mainArticle section from the parsed model output"""
+    return {
+        "headline": main_article_data.get("headline", ""),
+        "subheadline": main_article_data.get("subheadline", ""),
+        "content": main_article_data.get("content", ""),
+        "paperIds": [main_paper.get('id', '')]
+    }
+
+def assemble_newspaper_content(papers: List[Dict[str, Any]], relationship_data: Dict[str, Any], main_paper: Dict[str, Any], main_article_data: Dict[str, Any], sub_articles: List[Dict[str, Any]], sidebar_content: str, language: str = "ja", header: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Build the final newspaper_content document from the generated sections"""
+    if header is None:
+        header = build_header(relationship_data, language)
+    
+    # Construct final newspaper content
+    now = datetime.now()
+    if language == "en":
+        return {
+            "header": header,
+            "mainArticle": build_main_article(main_paper, main_article_data),
+            "subArticles": sub_articles,
+            "sidebarContent": sidebar_content,
+            "columnContent": f"Today's feature presents {len(papers)} important research studies on {relationship_data.get('overallTheme', 'the latest research findings')}. These studies hold the potential to significantly impact our future.",
+            "footer": f"© {now.year} Research News Network. This newspaper is generated based on academic papers."
+        }
+    return {
+        "header": header,
+        "mainArticle": build_main_article(main_paper, main_article_data),
+        "subArticles": sub_articles,
+        "sidebarContent": sidebar_content,
+        "columnContent": f"本日の特集では、{relationship_data.get('overallTheme', '最新の研究成果')}に関する{len(papers)}つの重要な研究をお届けしました。これらの研究は、私たちの未来に大きな影響を与える可能性を秘めています。",
+        "footer": f"© {now.year} Research News Network. 本紙は学術論文を基に生成されたものです。"
+    }
+
+def fingerprint(value: Any) -> str:
+    """Short stable hash of a JSON-serializable value"""
+    data = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
+
+def paper_fingerprint(paper: Dict[str, Any]) -> str:
+    """Hash of the analysis fields a paper contributes to generation"""
+    return fingerprint({
+        'title': paper.get('title'),
+        'authors': paper.get('authors'),
+        'aiAnalysis': paper.get('aiAnalysis', {}),
+        'hasEmbedding': bool(paper.get('embedding'))
+    })
+
+def paper_set_fingerprint(papers: List[Dict[str, Any]], language: str) -> str:
+    """Hash of the ordered paper set; the relationship step depends on it"""
+    return fingerprint({
+        'version': GENERATION_PROMPT_VERSION,
+        'language': language,
+        'papers': [[paper.get('id', ''), paper_fingerprint(paper)] for paper in papers]
+    })
+
+def prompt_fingerprint(prompt: str) -> str:
+    """Section input hash: the prompt carries the paper analysis and language"""
+    return fingerprint([GENERATION_PROMPT_VERSION, prompt])
+
+def usable_previous_state(previous_state: Optional[Dict[str, Any]], language: str, strategy: str) -> Dict[str, Any]:
+    """Stored generation state if it was produced compatibly, otherwise {}"""
+    if not isinstance(previous_state, dict):
+        return {}
+    if (
+        previous_state.get('version') != GENERATION_PROMPT_VERSION
+        or previous_state.get('language') != language
+        or previous_state.get('strategy') != strategy
+    ):
+        return {}
+    return previous_state
+
+def generate_newspaper_content(papers: List[Dict[str, Any]], template: Dict[str, Any], newspaper_id: str, language: str = "ja", concurrent: bool = True, max_workers: int = MAX_CONCURRENT_GENERATIONS, strategy: str = "standard", on_section: Optional[SectionCallback] = None) -> Dict[str, Any]:
+    """
+    Generate newspaper content from papers using Vertex AI
+    
+    See generate_newspaper_sections; this returns only the content.
+    """
+    content, _ = generate_newspaper_sections(papers, template, newspaper_id, language, concurrent=concurrent, max_workers=max_workers, strategy=strategy, on_section=on_section)
+    return content
+
+def generate_newspaper_sections(papers: List[Dict[str, Any]], template: Dict[str, Any], newspaper_id: str, language: str = "ja", concurrent: bool = True, max_workers: int = MAX_CONCURRENT_GENERATIONS, strategy: str = "standard", on_section: Optional[SectionCallback] = None, previous_content: Optional[Dict[str, Any]] = None, previous_state: Optional[Dict[str, Any]] = None, refresh: Iterable[str] = ()) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Generate newspaper content from papers using Vertex AI
+    
+    strategy="standard" analyzes relationships first and then generates each
+    section with its own call (in parallel when concurrent is True). When
+    every paper has an embedding, the relationships come from a similarity
+    matrix instead, and the title/theme call runs alongside the sections.
+    strategy="compact" generates the whole newspaper in a single call; it is
+    the cheapest, lowest-latency path at slightly lower quality.
+    
+    on_section(section, payload) is called as soon as each section is ready:
+    "header", "mainArticle", "subArticle" ({"index", "total", "article"})
+    and "sidebarContent".
+    
+    Returns (content, state). state records the inputs and fingerprints of
+    every section; passing it back as previous_state (with
+    previous_content) regenerates only sections whose prompt changed or
+    that are named in refresh, and reuses the relationship step while the
+    paper set is unchanged. The compact strategy always regenerates (it is
+    a single call).
+    """
+    try:
+        if strategy not in GENERATION_STRATEGIES:
+            raise ValueError(f"Unknown generation strategy: {strategy}")
         
-        sidebar_response = model.generate_content(sidebar_prompt)
-        sidebar_content = sidebar_response.text[:300]
+        # Shared Vertex AI model (initialized once per instance)
+        model = runtime.get_generative_model()
         
-        # Use the AI-generated newspaper title or fall back to defaults
-        newspaper_title = relationship_data.get('newspaperTitle', '')
-        if not newspaper_title:
-            if language == "en":
-                newspaper_names = [
-                    "Research Frontier Times",
-                    "Science Tribune",
-                    "Academic Topics News",
-                    "Research News",
-                    "Scholar's Eye"
-                ]
-            else:
-                newspaper_names = [
-                    "研究最前線タイムズ",
-                    "サイエンス新報",
-                    "学術トピックス新聞",
-                    "リサーチニュース",
-                    "研究者の眼"
-                ]
-            newspaper_title = random.choice(newspaper_names)
+        # Prepare paper summaries for AI
+        paper_summaries = build_paper_summaries(papers, language)
         
-        # Construct final newspaper content
-        now = datetime.now()
-        if language == "en":
-            newspaper_content = {
-                "header": {
-                    "newspaperName": newspaper_title,
-                    "date": now.strftime('%B %d, %Y'),
-                    "issueNumber": f"Issue #{random.randint(100, 999)}"
-                },
-                "mainArticle": {
-                    "headline": main_article_data.get("headline", ""),
-                    "subheadline": main_article_data.get("subheadline", ""),
-                    "content": main_article_data.get("content", ""),
-                    "paperIds": [main_paper.get('id', '')]
-                },
-                "subArticles": sub_articles,
-                "sidebarContent": sidebar_content,
-                "columnContent": f"Today's feature presents {len(papers)} important research studies on {relationship_data.get('overallTheme', 'the latest research findings')}. These studies hold the potential to significantly impact our future.",
-                "footer": f"© {now.year} Research News Network. This newspaper is generated based on academic papers."
+        if strategy == "compact":
+            compact_response = model.generate_content(build_compact_prompt(papers, paper_summaries, language))
+            relationship_data, main_article_data, sub_articles, sidebar_content = parse_compact_newspaper(compact_response, papers, language)
+            main_paper = papers[relationship_data['mainPaperIndex']]
+            header = build_header(relationship_data, language)
+            emit_section(on_section, "header", header)
+            emit_section(on_section, "mainArticle", build_main_article(main_paper, main_article_data))
+            for i, sub_article in enumerate(sub_articles):
+                emit_section(on_section, "subArticle", {"index": i, "total": len(sub_articles), "article": sub_article})
+            emit_section(on_section, "sidebarContent", sidebar_content)
+            content = assemble_newspaper_content(papers, relationship_data, main_paper, main_article_data, sub_articles, sidebar_content, language, header=header)
+            state = {
+                'version': GENERATION_PROMPT_VERSION,
+                'language': language,
+                'strategy': strategy,
+                'paperSet': paper_set_fingerprint(papers, language),
+                'llmCalls': 1
             }
+            return content, state
+        
+        previous = usable_previous_state(previous_state, language, strategy)
+        previous_sections = previous.get('sections', {})
+        previous_content = previous_content if previous else None
+        refresh = set(refresh)
+        paper_set = paper_set_fingerprint(papers, language)
+        llm_calls = 0
+        
+        def reusable(section: Dict[str, Any], input_hash: str, name: str) -> bool:
+            return bool(section) and section.get('inputHash') == input_hash and name not in refresh
+        
+        # Step 1: Analyze relationships and determine importance. Reused as
+        # long as the paper set is unchanged. With embeddings this is local
+        # and the model is only asked for the title and theme, off the
+        # critical path
+        from src.ai.embeddings import stack_embeddings
+        vectors = stack_embeddings(papers)
+        reuse_relationship = (
+            previous.get('paperSet') == paper_set
+            and previous.get('relationship')
+            and "relationship" not in refresh
+        )
+        if reuse_relationship:
+            relationship_data = previous['relationship']
+        elif vectors is not None:
+            relationship_data = build_embedding_relationship(papers, vectors, language)
         else:
-            newspaper_content = {
-                "header": {
-                    "newspaperName": newspaper_title,
-                    "date": now.strftime('%Y年%m月%d日'),
-                    "issueNumber": f"第{random.randint(100, 999)}号"
-                },
-                "mainArticle": {
-                    "headline": main_article_data.get("headline", ""),
-                    "subheadline": main_article_data.get("subheadline", ""),
-                    "content": main_article_data.get("content", ""),
-                    "paperIds": [main_paper.get('id', '')]
-                },
-                "subArticles": sub_articles,
-                "sidebarContent": sidebar_content,
-                "columnContent": f"本日の特集では、{relationship_data.get('overallTheme', '最新の研究成果')}に関する{len(papers)}つの重要な研究をお届けしました。これらの研究は、私たちの未来に大きな影響を与える可能性を秘めています。",
-                "footer": f"© {now.year} Research News Network. 本紙は学術論文を基に生成されたものです。"
-            }
+            relationship_response = model.generate_content(build_relationship_prompt(papers, paper_summaries, language))
+            llm_calls += 1
+            relationship_data = parse_relationship(relationship_response, papers, language)
+        
+        # Title and theme: a separate call on the embedding path, part of
+        # the relationship step otherwise
+        theme_prompt = build_theme_prompt(papers, paper_summaries, relationship_data, language) if vectors is not None else None
+        theme_hash = prompt_fingerprint(theme_prompt) if theme_prompt else fingerprint(relationship_data)
+        previous_theme = previous_sections.get('theme', {})
+        header = None
+        theme_data = None
+        if reusable(previous_theme, theme_hash, "header"):
+            theme_data = previous_theme.get('data') or {}
+            header = (previous_content or {}).get('header') or build_header({**relationship_data, **theme_data}, language)
+            emit_section(on_section, "header", header)
+            theme_prompt = None
+        elif theme_prompt is None:
+            header = build_header(relationship_data, language)
+            emit_section(on_section, "header", header)
+        
+        main_paper_idx = relationship_data.get('mainPaperIndex', 0)
+        main_paper = papers[main_paper_idx]
+        sub_paper_indices = relationship_data.get('subArticleOrder', [i for i in range(len(papers)) if i != main_paper_idx])
+        sub_papers = [papers[idx] for idx in sub_paper_indices[:4] if idx < len(papers)]  # Take first 4 sub papers
+        
+        # Steps 2-4 only depend on relationship_data, so the main article,
+        # sub articles and sidebar can be requested in parallel. Sections
+        # whose prompt is unchanged since the last run are reused.
+        sections = {
+            'theme': {'inputHash': theme_hash, 'data': theme_data},
+            'subArticles': {}
+        }
+        pending = []  # (section key, prompt)
+        
+        main_prompt = build_main_article_prompt(main_paper, relationship_data, language)
+        main_hash = prompt_fingerprint(main_prompt)
+        main_article_data = None
+        if reusable(previous_sections.get('mainArticle'), main_hash, "mainArticle"):
+            main_article_data = previous_sections['mainArticle']['data']
+            emit_section(on_section, "mainArticle", build_main_article(main_paper, main_article_data))
+        else:
+            pending.append(('mainArticle', main_prompt))
+        sections['mainArticle'] = {'inputHash': main_hash, 'data': main_article_data}
+        
+        sub_results: List[Optional[Dict[str, Any]]] = [None] * len(sub_papers)
+        for position, sub_paper in enumerate(sub_papers):
+            sub_prompt = build_sub_article_prompt(sub_paper, language)
+            sub_hash = prompt_fingerprint(sub_prompt)
+            paper_id = sub_paper.get('id', '')
+            previous_sub = previous_sections.get('subArticles', {}).get(paper_id)
+            if (
+                reusable(previous_sub, sub_hash, f"subArticle:{paper_id}")
+                and "subArticles" not in refresh
+                and previous_sub.get('article')
+            ):
+                sub_results[position] = previous_sub['article']
+                emit_section(on_section, "subArticle", {"index": position, "total": len(sub_papers), "article": sub_results[position]})
+            else:
+                pending.append((f"subArticle:{position}", sub_prompt))
+            sections['subArticles'][paper_id] = {'inputHash': sub_hash, 'article': sub_results[position]}
+        
+        sidebar_prompt = build_sidebar_prompt(relationship_data, language)
+        sidebar_hash = prompt_fingerprint(sidebar_prompt)
+        sidebar_content = None
+        if reusable(previous_sections.get('sidebarContent'), sidebar_hash, "sidebarContent"):
+            sidebar_content = previous_sections['sidebarContent']['content']
+            emit_section(on_section, "sidebarContent", sidebar_content)
+        else:
+            pending.append(('sidebarContent', sidebar_prompt))
+        sections['sidebarContent'] = {'inputHash': sidebar_hash, 'content': sidebar_content}
+        
+        if theme_prompt:
+            pending.append(('theme', theme_prompt))
+        
+        # Fallback sub articles are numbered after the articles kept before
+        # them; while streaming, only the ones known so far are counted
+        streamed_sub_articles: Dict[int, Dict[str, Any]] = {}
+        
+        def fallback_number(position: int) -> int:
+            return 1 + sum(1 for earlier in range(position) if sub_results[earlier] or earlier in streamed_sub_articles)
+        
+        def handle_response(i: int, response: Any) -> None:
+            # Report each section as soon as its response arrives
+            nonlocal header
+            key = pending[i][0]
+            if key == 'mainArticle':
+                emit_section(on_section, "mainArticle", build_main_article(main_paper, parse_main_article(response, language)))
+            elif key == 'sidebarContent':
+                emit_section(on_section, "sidebarContent", response.text[:300])
+            elif key == 'theme':
+                header = build_header(parse_theme(response, relationship_data), language)
+                emit_section(on_section, "header", header)
+            else:
+                position = int(key.split(':', 1)[1])
+                sub_article = parse_sub_article(response, sub_papers[position], fallback_number(position), language)
+                if sub_article:
+                    streamed_sub_articles[position] = sub_article
+                    emit_section(on_section, "subArticle", {"index": position, "total": len(sub_papers), "article": sub_article})
+        
+        responses = generate_content_batch(model, [prompt for _, prompt in pending], concurrent=concurrent, max_workers=max_workers, on_response=handle_response if on_section else None) if pending else []
+        llm_calls += len(pending)
+        
+        sub_responses: Dict[int, Any] = {}
+        for (key, _), response in zip(pending, responses):
+            if key == 'mainArticle':
+                # Step 2: Main article
+                main_article_data = parse_main_article(response, language)
+                sections['mainArticle']['data'] = main_article_data
+            elif key == 'sidebarContent':
+                # Step 4: Sidebar
+                sidebar_content = response.text[:300]
+                sections['sidebarContent']['content'] = sidebar_content
+            elif key == 'theme':
+                theme = parse_theme(response, relationship_data)
+                theme_data = {field: theme.get(field) for field in ("overallTheme", "newspaperTitle")}
+                sections['theme']['data'] = theme_data
+            else:
+                # Step 3: Sub articles (parsed below, in order)
+                sub_responses[int(key.split(':', 1)[1])] = response
+        
+        # Sub articles stay in subArticleOrder; responses without JSON are
+        # dropped and fallbacks are numbered by the articles before them
+        sub_articles = []
+        for position, sub_paper in enumerate(sub_papers):
+            if position in sub_responses:
+                sub_results[position] = parse_sub_article(sub_responses[position], sub_paper, len(sub_articles) + 1, language)
+                sections['subArticles'][sub_paper.get('id', '')]['article'] = sub_results[position]
+            if sub_results[position]:
+                sub_articles.append(sub_results[position])
+        
+        # Prompts were built from the relationship before the theme merge;
+        # that version is stored so unchanged sections fingerprint the same
+        base_relationship = relationship_data
+        if theme_data:
+            relationship_data = {**relationship_data, **{key: value for key, value in theme_data.items() if value}}
+        if header is None:
+            header = build_header(relationship_data, language)
         
-        return newspaper_content
+        content = assemble_newspaper_content(papers, relationship_data, main_paper, main_article_data, sub_articles, sidebar_content, language, header=header)
+        state = {
+            'version': GENERATION_PROMPT_VERSION,
+            'language': language,
+            'strategy': strategy,
+            'paperSet': paper_set,
+            'paperFingerprints': {paper.get('id', ''): paper_fingerprint(paper) for paper in papers},
+            'relationship': base_relationship,
+            'sections': sections,
+            'llmCalls': llm_calls
+        }
+        logging.info(f"Generated newspaper {newspaper_id} with {llm_calls} model calls ({len(pending)} sections regenerated, relationship {'reused' if reuse_relationship else 'computed'})")
+        return content, state
         
     except Exception as e:
         logging.error(f"Error generating newspaper content: {str(e)}")
-        raise
\ No newline at end of file
+        raise
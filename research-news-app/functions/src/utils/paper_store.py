@@ -0,0 +1,124 @@
+import logging
+from typing import Dict, Any, List, Optional
+
+# The full analysis of a paper (including the extracted text) lives in
+# papers/{paperId}/details/analysis; the paper document keeps a lean
+# summary, so listings and generation reads do not pay for it
+DETAILS_COLLECTION = 'details'
+ANALYSIS_DETAILS_DOC = 'analysis'
+
+# The embedding (about 3KB, more than the summary) is kept in
+# papers/{paperId}/details/embedding too; generation and the similarity
+# index read it from there, listings never download it
+EMBEDDING_DETAILS_DOC = 'embedding'
+EMBEDDING_FIELDS = ['embedding', 'embeddingModel']
+
+# metadata fields kept on the paper document; the rest (extractedText,
+# abstract, textSelection) are only on the details document
+SUMMARY_METADATA_FIELDS = ['keywords', 'language', 'pageCount', 'analysisMode']
+
+# Fields a paper listing needs (e.g. for select() in list queries)
+LISTING_FIELDS = [
+    'uploaderId', 'title', 'authors', 'journal', 'publicationDate', 'doi',
+    'fileUrl', 'fileSize', 'processingStatus', 'metadata', 'aiAnalysis',
+    'isPublic', 'groupIds', 'createdAt', 'updatedAt'
+]
+
+# Paper document fields copied into the result shape of analyze_paper
+PAPER_INFO_FIELDS = ['title', 'authors', 'journal', 'publicationDate', 'doi']
+
+def analysis_details_ref(db, paper_id: str):
+    return db.collection('papers').document(paper_id).collection(DETAILS_COLLECTION).document(ANALYSIS_DETAILS_DOC)
+
+def embedding_ref(db, paper_id: str):
+    return db.collection('papers').document(paper_id).collection(DETAILS_COLLECTION).document(EMBEDDING_DETAILS_DOC)
+
+def summary_fields(result: Dict[str, Any]) -> Dict[str, Any]:
+    """metadata and aiAnalysis as stored on the paper document"""
+    metadata = result.get('metadata') or {}
+    return {
+        'metadata': {field: metadata[field] for field in SUMMARY_METADATA_FIELDS if field in metadata},
+        'aiAnalysis': result.get('aiAnalysis') or {},
+        'hasAnalysisDetails': True
+    }
+
+def details_document(result: Dict[str, Any]) -> Dict[str, Any]:
+    """The details document for an analyze_paper result (without the embedding)"""
+    return {
+        'metadata': result.get('metadata') or {},
+        'aiAnalysis': result.get('aiAnalysis') or {},
+        'paperInfo': result.get('paperInfo') or {}
+    }
+
+def embedding_document(result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The embedding document for an analyze_paper result (None without an embedding)"""
+    if not result.get('embedding'):
+        return None
+    return {field: result.get(field) for field in EMBEDDING_FIELDS}
+
+def get_embeddings(db, paper_ids: List[str], papers: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    {paper_id: {embedding, embeddingModel}} for the papers that have one,
+    in one batched read. Papers stored before the split have it inline;
+    pass already loaded paper documents (by ID) to use those.
+    """
+    embeddings = {}
+    for paper_id, paper in (papers or {}).items():
+        if (paper or {}).get('embedding'):
+            embeddings[paper_id] = {field: paper.get(field) for field in EMBEDDING_FIELDS}
+    refs = {embedding_ref(db, paper_id).path: paper_id for paper_id in paper_ids if paper_id not in embeddings}
+    if refs:
+        for snapshot in db.get_all([embedding_ref(db, paper_id) for paper_id in refs.values()]):
+            data = snapshot.to_dict() if snapshot.exists else None
+            if data and data.get('embedding'):
+                embeddings[refs[snapshot.reference.path]] = {field: data.get(field) for field in EMBEDDING_FIELDS}
+    return embeddings
+
+def get_paper_summary(db, paper_id: str, field_paths: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """The lean paper document (optionally projected), or None if missing"""
+    snapshot = db.collection('papers').document(paper_id).get(field_paths=field_paths)
+    if not snapshot.exists:
+        return None
+    return {'id': paper_id, **(snapshot.to_dict() or {})}
+
+def get_analysis_details(db, paper_id: str, paper: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    The full analysis {metadata, aiAnalysis, paperInfo} of a paper. Papers
+    analyzed before the split have it inline; pass the paper document if
+    it is already loaded to avoid reading it again.
+    """
+    snapshot = analysis_details_ref(db, paper_id).get()
+    if snapshot.exists:
+        return snapshot.to_dict()
+    if paper is None:
+        paper = get_paper_summary(db, paper_id)
+        if paper is None:
+            return None
+    if not paper.get('aiAnalysis'):
+        return None
+    if paper.get('hasAnalysisDetails'):
+        logging.warning(f"Analysis details of paper {paper_id} are missing, returning the summary")
+    return {
+        'metadata': paper.get('metadata', {}),
+        'aiAnalysis': paper.get('aiAnalysis', {}),
+        'paperInfo': {field: paper.get(field) for field in PAPER_INFO_FIELDS}
+    }
+
+def get_extracted_text(db, paper_id: str) -> str:
+    """The stored excerpt of a paper's text ('' if not analyzed)"""
+    details = get_analysis_details(db, paper_id)
+    return ((details or {}).get('metadata') or {}).get('extractedText', '')
+
+def get_paper(db, paper_id: str, include_details: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    A paper document; with include_details its metadata and aiAnalysis
+    are the full versions from the details document
+    """
+    paper = get_paper_summary(db, paper_id)
+    if paper is None or not include_details:
+        return paper
+    details = get_analysis_details(db, paper_id, paper)
+    if details:
+        paper['metadata'] = details.get('metadata', {})
+        paper['aiAnalysis'] = details.get('aiAnalysis', {})
+    return paper
@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Any, List, Callable, Optional
+
+# Firestore sustains about one write per second per document; progress
+# writes to one document are limited to this rate
+MAX_DOC_WRITES_PER_SECOND = float(os.environ.get('MAX_DOC_WRITES_PER_SECOND', '1'))
+
+# Firestore's limit on writes in one batch commit
+BATCH_WRITE_LIMIT = 500
+
+# Recent write times are kept this long per document (enough to pace
+# any rate down to one write a minute)
+WRITE_HISTORY_SECONDS = 60.0
+
+_last_writes: Dict[str, float] = {}
+_writes_lock = threading.Lock()
+
+def write_interval(max_writes_per_second: Optional[float] = None) -> float:
+    """Minimum seconds between two writes to one document"""
+    rate = max_writes_per_second or MAX_DOC_WRITES_PER_SECOND
+    return 1.0 / rate if rate > 0 else 0.0
+
+def record_write(doc_ref) -> None:
+    """Note a write to doc_ref, so paced writers on this instance wait for it"""
+    now = time.monotonic()
+    with _writes_lock:
+        _last_writes[doc_ref.path] = now
+        if len(_last_writes) > 1000:
+            for path, written_at in list(_last_writes.items()):
+                if now - written_at > WRITE_HISTORY_SECONDS:
+                    del _last_writes[path]
+
+def seconds_until_write(doc_ref, max_writes_per_second: Optional[float] = None) -> float:
+    """How long to wait before doc_ref may be written again (0 if now)"""
+    with _writes_lock:
+        last = _last_writes.get(doc_ref.path)
+    if last is None:
+        return 0.0
+    return max(0.0, last + write_interval(max_writes_per_second) - time.monotonic())
+
+def new_document(db, collection: str):
+    """
+    Reference with a fresh auto ID, so a document's full initial state
+    (including IDs of jobs that point back at it) can be built before its
+    single write, instead of add() followed by update()
+    """
+    return db.collection(collection).document()
+
+class WriteGroup:
+    """
+    Collects writes to several documents and commits them as WriteBatch
+    commits (atomic per batch of up to BATCH_WRITE_LIMIT writes).
+    Callbacks registered with after_commit run once everything is written.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._writes: List[tuple] = []
+        self._after_commit: List[Callable[[], None]] = []
+        self.commits = 0
+
+    def create(self, doc_ref, data: Dict[str, Any]) -> 'WriteGroup':
+        self._writes.append(('create', doc_ref, data))
+        return self
+
+    def set(self, doc_ref, data: Dict[str, Any], merge: bool = False) -> 'WriteGroup':
+        self._writes.append(('set', doc_ref, data, merge))
+        return self
+
+    def update(self, doc_ref, fields: Dict[str, Any]) -> 'WriteGroup':
+        self._writes.append(('update', doc_ref, fields))
+        return self
+
+    def delete(self, doc_ref) -> 'WriteGroup':
+        self._writes.append(('delete', doc_ref))
+        return self
+
+    def after_commit(self, callback: Callable[[], None]) -> 'WriteGroup':
+        self._after_commit.append(callback)
+        return self
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def commit(self) -> None:
+        """Write everything queued so far; a no-op when nothing is queued"""
+        writes, self._writes = self._writes, []
+        for start in range(0, len(writes), BATCH_WRITE_LIMIT):
+            batch = self.db.batch()
+            for write in writes[start:start + BATCH_WRITE_LIMIT]:
+                op, doc_ref = write[0], write[1]
+                if op == 'create':
+                    batch.create(doc_ref, write[2])
+                elif op == 'set':
+                    batch.set(doc_ref, write[2], merge=write[3])
+                elif op == 'update':
+                    batch.update(doc_ref, write[2])
+                else:
+                    batch.delete(doc_ref)
+            batch.commit()
+            self.commits += 1
+            for write in writes[start:start + BATCH_WRITE_LIMIT]:
+                record_write(write[1])
+        if len(writes) > BATCH_WRITE_LIMIT:
+            logging.info(f"Committed {len(writes)} writes in {self.commits} batches")
+
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            callback()
@@ -0,0 +1,112 @@
+import logging
+import threading
+from typing import Dict, Any, Optional, Callable
+from src.utils import persistence
+
+class ThrottledDocumentWriter:
+    """
+    Coalesces field updates for one Firestore document and writes them at
+    most max_writes_per_second times a second, counting other writes to
+    the document on this instance. Pending fields are merged, so the
+    latest value of each field always wins, and are written by a timer
+    once the window ends, so the last update is never left behind.
+    write(fields) replaces doc_ref.update (e.g. a lease-checked update);
+    once it returns False the writer is stopped and drops later updates.
+    """
+
+    def __init__(self, doc_ref, max_writes_per_second: Optional[float] = None, write: Optional[Callable[[Dict[str, Any]], Optional[bool]]] = None):
+        self.doc_ref = doc_ref
+        self.max_writes_per_second = max_writes_per_second
+        self._write = write or doc_ref.update
+        self._pending: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self.writes = 0
+        self.stopped = False
+
+    def update(self, fields: Dict[str, Any]) -> None:
+        """Queue fields; write them now if the document's write budget allows, else when it does"""
+        with self._lock:
+            if self.stopped:
+                return
+            self._pending.update(fields)
+            self._write_or_schedule_locked()
+
+    def flush(self) -> None:
+        """Write any pending fields immediately"""
+        with self._lock:
+            self._cancel_timer_locked()
+            if self._pending:
+                self._write_locked()
+
+    def discard(self) -> None:
+        """Drop pending fields without writing them"""
+        with self._lock:
+            self._cancel_timer_locked()
+            self._pending = {}
+
+    def _trailing_write(self) -> None:
+        with self._lock:
+            self._timer = None
+            if self._pending:
+                self._write_or_schedule_locked()
+
+    def _write_or_schedule_locked(self) -> None:
+        wait = persistence.seconds_until_write(self.doc_ref, self.max_writes_per_second)
+        if wait <= 0:
+            self._cancel_timer_locked()
+            self._write_locked()
+        elif self._timer is None:
+            self._timer = threading.Timer(wait, self._trailing_write)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _cancel_timer_locked(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _write_locked(self) -> None:
+        fields = self._pending
+        self._pending = {}
+        persistence.record_write(self.doc_ref)
+        try:
+            if self._write(fields) is False:
+                logging.warning(f"Progress writes to {self.doc_ref.path} stopped: the write was refused")
+                self.stopped = True
+                self._cancel_timer_locked()
+                return
+            self.writes += 1
+        except Exception as e:
+            # Progress is best effort; the final write carries the full result
+            logging.error(f"Progress update failed: {str(e)}")
+
+class NewspaperProgress:
+    """
+    on_section callback for generate_newspaper_content that writes each
+    finished section to content.* on the newspaper document.
+    """
+
+    def __init__(self, writer: ThrottledDocumentWriter):
+        self.writer = writer
+        self.sub_articles: Dict[int, Dict[str, Any]] = {}
+        self.sub_article_total: Optional[int] = None
+        self.completed_sections = []
+
+    def __call__(self, section: str, payload: Any) -> None:
+        if section == "subArticle":
+            self.sub_articles[payload["index"]] = payload["article"]
+            self.sub_article_total = payload["total"]
+            fields = {
+                'content.subArticles': [self.sub_articles[i] for i in sorted(self.sub_articles)]
+            }
+        else:
+            fields = {f'content.{section}': payload}
+
+        self.completed_sections.append(section)
+        fields['generationProgress'] = {
+            'completedSections': self.completed_sections[:],
+            'subArticlesCompleted': len(self.sub_articles),
+            'subArticlesTotal': self.sub_article_total
+        }
+        self.writer.update(fields)
@@ -0,0 +1,271 @@
+import io
+import json
+import logging
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+from src import runtime
+from src.ai.embeddings import decode_embedding, normalize_rows
+from src.utils import paper_store
+
+# Indexes live in Cloud Storage (a Firestore document would cap a library
+# at ~300 papers); one .npz object per scope, e.g. users/{uid}
+INDEX_BUCKET = 'ronshin-72b20.firebasestorage.app'
+INDEX_PREFIX = 'indexes/papers'
+
+# Weight of keyword/topic overlap (Jaccard) against embedding similarity
+KEYWORD_WEIGHT = 0.2
+
+# Candidates re-ranked with keywords, as a multiple of k
+RERANK_FACTOR = 4
+
+# Loaded indexes are served from memory for this long before a re-read
+INDEX_CACHE_SECONDS = 30
+
+# Optimistic-concurrency retries for read-modify-write updates
+MAX_UPDATE_ATTEMPTS = 5
+
+DEFAULT_TOP_K = 5
+MAX_TOP_K = 20
+
+def user_scope(uid: str) -> str:
+    return f"users/{uid}"
+
+def group_scope(group_id: str) -> str:
+    return f"groups/{group_id}"
+
+def paper_scopes(paper: Dict[str, Any]) -> List[str]:
+    """Scopes whose index should contain the paper"""
+    scopes = [user_scope(paper['uploaderId'])] if paper.get('uploaderId') else []
+    scopes.extend(group_scope(group_id) for group_id in paper.get('groupIds', []) or [])
+    return scopes
+
+def paper_keywords(paper: Dict[str, Any]) -> List[str]:
+    """Normalized keywords and related topics of an analyzed paper"""
+    values = list(paper.get('metadata', {}).get('keywords', []) or [])
+    values += paper.get('aiAnalysis', {}).get('keywords', []) or []
+    values += paper.get('aiAnalysis', {}).get('relatedTopics', []) or []
+    return sorted({str(value).strip().lower() for value in values if str(value).strip()})
+
+class PaperIndex:
+    """Brute-force cosine index: one unit-length float32 row per paper"""
+
+    def __init__(self, paper_ids: Optional[List[str]] = None, vectors: Optional[np.ndarray] = None, keywords: Optional[List[List[str]]] = None):
+        self.paper_ids = list(paper_ids or [])
+        self.vectors = vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+        self.keywords = [set(words) for words in (keywords or [[] for _ in self.paper_ids])]
+        self._positions = {paper_id: i for i, paper_id in enumerate(self.paper_ids)}
+
+    def clear(self) -> None:
+        self.__init__()
+
+    def __len__(self) -> int:
+        return len(self.paper_ids)
+
+    def __contains__(self, paper_id: str) -> bool:
+        return paper_id in self._positions
+
+    def upsert(self, paper_id: str, vector: np.ndarray, keywords: List[str]) -> None:
+        """Add or replace a paper; vectors of another size reset the index"""
+        row = normalize_rows(np.asarray(vector, dtype=np.float32).reshape(1, -1))
+        if len(self) and self.vectors.shape[1] != row.shape[1]:
+            # Embedding model changed; old rows are not comparable
+            self.clear()
+        position = self._positions.get(paper_id)
+        if position is not None:
+            self.vectors[position] = row[0]
+            self.keywords[position] = set(keywords)
+            return
+        self.vectors = row if not len(self) else np.vstack([self.vectors, row])
+        self.paper_ids.append(paper_id)
+        self.keywords.append(set(keywords))
+        self._positions[paper_id] = len(self.paper_ids) - 1
+
+    def remove(self, paper_id: str) -> bool:
+        position = self._positions.get(paper_id)
+        if position is None:
+            return False
+        self.vectors = np.delete(self.vectors, position, axis=0)
+        del self.paper_ids[position]
+        del self.keywords[position]
+        self._positions = {pid: i for i, pid in enumerate(self.paper_ids)}
+        return True
+
+    def query(self, vector: np.ndarray, keywords: List[str], k: int = DEFAULT_TOP_K, exclude: Tuple[str, ...] = ()) -> List[Dict[str, Any]]:
+        """Top-k papers by blended embedding / keyword similarity"""
+        if not len(self):
+            return []
+        query_row = normalize_rows(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        if query_row.shape[0] != self.vectors.shape[1]:
+            return []
+        similarities = self.vectors @ query_row
+        for paper_id in exclude:
+            position = self._positions.get(paper_id)
+            if position is not None:
+                similarities[position] = -np.inf
+
+        # Keyword overlap only re-ranks the best embedding matches
+        candidate_count = min(len(self), max(k * RERANK_FACTOR, k))
+        candidates = np.argpartition(-similarities, candidate_count - 1)[:candidate_count]
+        query_keywords = set(keywords)
+        results = []
+        for position in candidates:
+            similarity = float(similarities[position])
+            if similarity == -np.inf:
+                continue
+            union = query_keywords | self.keywords[position]
+            overlap = len(query_keywords & self.keywords[position]) / len(union) if union else 0.0
+            results.append({
+                'paperId': self.paper_ids[position],
+                'score': round((1 - KEYWORD_WEIGHT) * similarity + KEYWORD_WEIGHT * overlap, 4),
+                'similarity': round(similarity, 4),
+                'keywordOverlap': round(overlap, 4)
+            })
+        results.sort(key=lambda result: (-result['score'], result['paperId']))
+        return results[:k]
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            paper_ids=np.array(self.paper_ids, dtype=str),
+            vectors=self.vectors.astype(np.float32),
+            keywords=np.array(json.dumps([sorted(words) for words in self.keywords], ensure_ascii=False))
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'PaperIndex':
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return cls(
+                [str(paper_id) for paper_id in arrays['paper_ids']],
+                arrays['vectors'].astype(np.float32),
+                json.loads(str(arrays['keywords']))
+            )
+
+class PaperIndexStore:
+    """
+    Loads and updates PaperIndex objects in Cloud Storage. Updates use the
+    object generation as a precondition so concurrent writers retry
+    instead of overwriting each other.
+    """
+
+    def __init__(self, bucket_name: str = INDEX_BUCKET, prefix: str = INDEX_PREFIX):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self._cache: Dict[str, Tuple[float, PaperIndex]] = {}
+        self._lock = threading.Lock()
+
+    def _blob_name(self, scope: str) -> str:
+        return f"{self.prefix}/{scope}.npz"
+
+    def _read(self, scope: str) -> Tuple[int, PaperIndex]:
+        """Return (generation, index); generation 0 means no object yet"""
+        bucket = runtime.get_storage_client().bucket(self.bucket_name)
+        blob = bucket.get_blob(self._blob_name(scope))
+        if blob is None:
+            return 0, PaperIndex()
+        data = blob.download_as_bytes(if_generation_match=blob.generation)
+        return blob.generation, PaperIndex.from_bytes(data)
+
+    def load(self, scope: str) -> PaperIndex:
+        """Index for scope, served from memory for INDEX_CACHE_SECONDS"""
+        with self._lock:
+            cached = self._cache.get(scope)
+        if cached and time.monotonic() - cached[0] < INDEX_CACHE_SECONDS:
+            return cached[1]
+        _, index = self._read(scope)
+        with self._lock:
+            self._cache[scope] = (time.monotonic(), index)
+        return index
+
+    def update(self, scope: str, apply) -> PaperIndex:
+        """Read the index, apply(index) to it and write it back atomically"""
+        from google.api_core import exceptions as api_exceptions
+        bucket = runtime.get_storage_client().bucket(self.bucket_name)
+        for attempt in range(1, MAX_UPDATE_ATTEMPTS + 1):
+            try:
+                generation, index = self._read(scope)
+                apply(index)
+                blob = bucket.blob(self._blob_name(scope))
+                blob.upload_from_string(
+                    index.to_bytes(),
+                    content_type='application/octet-stream',
+                    if_generation_match=generation
+                )
+                with self._lock:
+                    self._cache[scope] = (time.monotonic(), index)
+                return index
+            except (api_exceptions.PreconditionFailed, api_exceptions.NotFound):
+                # Another writer got there first; re-read and try again
+                logging.info(f"Paper index {scope} changed concurrently (attempt {attempt}), retrying")
+                time.sleep(0.05 * attempt)
+        raise RuntimeError(f"Could not update paper index {scope} after {MAX_UPDATE_ATTEMPTS} attempts")
+
+    def invalidate(self, scope: str) -> None:
+        with self._lock:
+            self._cache.pop(scope, None)
+
+# Shared store used by the analysis hooks and the suggest API
+paper_index_store = PaperIndexStore()
+
+def index_paper(paper_id: str, paper: Dict[str, Any]) -> List[str]:
+    """
+    Add an analyzed paper to every index it belongs to. paper needs
+    embedding, uploaderId and optionally groupIds, metadata.keywords and
+    aiAnalysis.relatedTopics. Returns the scopes that were updated.
+    """
+    vector = decode_embedding(paper.get('embedding'))
+    if vector is None:
+        return []
+    keywords = paper_keywords(paper)
+    scopes = paper_scopes(paper)
+    for scope in scopes:
+        paper_index_store.update(scope, lambda index: index.upsert(paper_id, vector, keywords))
+    return scopes
+
+def remove_paper(paper_id: str, paper: Dict[str, Any]) -> None:
+    """Drop a paper from its indexes (e.g. after deletion)"""
+    for scope in paper_scopes(paper):
+        paper_index_store.update(scope, lambda index: index.remove(paper_id))
+
+def rebuild_index(db, scope: str) -> PaperIndex:
+    """Build a scope's index from Firestore (first use or after model changes)"""
+    kind, owner_id = scope.split('/', 1)
+    field = 'uploaderId' if kind == 'users' else 'groupIds'
+    operator = '==' if kind == 'users' else 'array_contains'
+    # 'embedding' only matches papers stored before it moved to details/embedding
+    query = db.collection('papers').where(field, operator, owner_id).select(
+        ['embedding', 'metadata.keywords', 'aiAnalysis.relatedTopics']
+    )
+    papers = {doc.id: doc.to_dict() for doc in query.stream()}
+    embeddings = paper_store.get_embeddings(db, list(papers), papers)
+    rows = []
+    for paper_id, paper in papers.items():
+        vector = decode_embedding(embeddings.get(paper_id, {}).get('embedding'))
+        if vector is not None:
+            rows.append((paper_id, vector, paper_keywords(paper)))
+
+    def apply(index: PaperIndex) -> None:
+        index.clear()
+        for paper_id, vector, keywords in rows:
+            index.upsert(paper_id, vector, keywords)
+
+    index = paper_index_store.update(scope, apply)
+    logging.info(f"Rebuilt paper index {scope} with {len(index)} papers")
+    return index
+
+def suggest_papers(db, scope: str, seed_id: str, seed: Dict[str, Any], k: int = DEFAULT_TOP_K, exclude: Tuple[str, ...] = ()) -> List[Dict[str, Any]]:
+    """
+    Top-k papers in scope related to the seed paper. An empty index, or
+    one missing a seed that belongs to the scope (papers analyzed before
+    indexing existed), is rebuilt from Firestore first.
+    """
+    vector = decode_embedding(seed.get('embedding'))
+    if vector is None:
+        return []
+    index = paper_index_store.load(scope)
+    if not len(index) or (seed_id not in index and scope in paper_scopes(seed)):
+        index = rebuild_index(db, scope)
+    return index.query(vector, paper_keywords(seed), k, exclude=(seed_id, *exclude))
@@ -0,0 +1,416 @@
+import base64
+import hashlib
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import quote
+from src import runtime
+
+# Bucket that holds uploaded papers
+UPLOAD_BUCKET = 'ronshin-72b20.firebasestorage.app'
+
+# Largest accepted PDF; MAX_UPLOAD_MB in the environment overrides it
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+
+# Cloud Functions (2nd gen) rejects request bodies over 32MB, so larger
+# files can only be uploaded directly to Storage (create_upload_url_api)
+HTTP_REQUEST_MAX_BYTES = 32 * 1024 * 1024
+
+# Multipart boundaries and form fields on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Resumable upload chunk (must be a multiple of 256KB); at most one chunk
+# per upload is held in memory
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Bytes inspected to decide whether the file is a PDF; like PDF readers,
+# the %PDF- header is accepted anywhere in them (after leading junk)
+SNIFF_BYTES = 1024
+PDF_MAGIC = b'%PDF-'
+
+# Range size when reading a stored PDF back for its text signature;
+# only the cross-reference table and the first pages' objects are fetched
+SIGNATURE_READ_CHUNK_BYTES = 256 * 1024
+
+# Direct-to-Storage uploads: one session document per issued upload URL
+UPLOAD_SESSIONS_COLLECTION = 'uploadSessions'
+
+# A signed URL must be used (the resumable session started) within this
+# time; sessions not finalized within the grace period are rejected
+UPLOAD_URL_SECONDS = 15 * 60
+UPLOAD_FINALIZE_GRACE_SECONDS = 24 * 60 * 60
+
+class UploadRejected(Exception):
+    """The upload is invalid (maps to an HTTP error status)"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def max_upload_bytes() -> int:
+    """Configured maximum upload size in bytes"""
+    override = os.environ.get('MAX_UPLOAD_MB')
+    return int(float(override) * 1024 * 1024) if override else MAX_UPLOAD_BYTES
+
+def max_streamed_upload_bytes() -> int:
+    """Maximum size of a file uploaded through the function (multipart)"""
+    return min(max_upload_bytes(), HTTP_REQUEST_MAX_BYTES - MULTIPART_OVERHEAD_BYTES)
+
+def too_large_message(max_bytes: int) -> str:
+    if max_bytes >= 1024 * 1024:
+        return f'File is larger than {max_bytes / (1024 * 1024):.0f}MB'
+    return f'File is larger than {max_bytes // 1024}KB'
+
+def is_pdf(head: bytes) -> bool:
+    """
+    Sniff the first bytes of a file: the %PDF- header must start within
+    SNIFF_BYTES. libmagic, when installed, also checks the data from there
+    """
+    offset = head[:SNIFF_BYTES].find(PDF_MAGIC)
+    if offset < 0:
+        return False
+    try:
+        import magic
+        return magic.from_buffer(head[offset:SNIFF_BYTES], mime=True) == 'application/pdf'
+    except Exception:
+        # python-magic or libmagic unavailable; the header check decides
+        return True
+
+def paper_blob_name(uid: str, filename: str) -> str:
+    timestamp = int(time.time() * 1000)
+    return f"papers/{uid}/{timestamp}_{filename}"
+
+def storage_url(bucket_name: str, blob_name: str) -> str:
+    """Firebase Storage download URL stored as the paper's fileUrl"""
+    return f"https://firebasestorage.googleapis.com/v0/b/{bucket_name}/o/{blob_name.replace('/', '%2F')}?alt=media"
+
+class StreamingBlobUpload:
+    """
+    Write target for one uploaded file that forwards data to a Cloud
+    Storage resumable upload as it arrives, hashing and counting it on the
+    way. Nothing reaches Storage until the first SNIFF_BYTES look like a
+    PDF, and writing past max_bytes raises UploadRejected. Used as the
+    multipart stream factory result, so the file is never buffered whole.
+    """
+
+    def __init__(self, blob, max_bytes: Optional[int] = None, chunk_size: int = UPLOAD_CHUNK_BYTES):
+        self.blob = blob
+        self.max_bytes = max_bytes or max_upload_bytes()
+        self.chunk_size = chunk_size
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._md5 = hashlib.md5()
+        self._head = b''
+        self._writer = None
+        self._finished = False
+
+    def write(self, data: bytes) -> int:
+        if self.size + len(data) > self.max_bytes:
+            raise UploadRejected(too_large_message(self.max_bytes), 413)
+        self.size += len(data)
+        self._digest.update(data)
+        self._md5.update(data)
+        if self._writer is None:
+            self._head += data
+            if len(self._head) >= SNIFF_BYTES:
+                self._start()
+        else:
+            self._writer.write(data)
+        return len(data)
+
+    def _start(self) -> None:
+        """Check the header, open the resumable upload and send the buffered head"""
+        if not is_pdf(self._head):
+            raise UploadRejected('File is not a PDF', 415)
+        # if_generation_match=0: never overwrite an existing object
+        self._writer = self.blob.open(
+            'wb',
+            chunk_size=self.chunk_size,
+            content_type='application/pdf',
+            if_generation_match=0
+        )
+        self._writer.write(self._head)
+        self._head = b''
+
+    # werkzeug rewinds the stream after the part ends; there is nothing to re-read
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self.size
+
+    def tell(self) -> int:
+        return self.size
+
+    def finish(self) -> Dict[str, Any]:
+        """Complete the upload; returns {"sha256", "md5", "size"}"""
+        if self.size == 0:
+            raise UploadRejected('File is empty', 400)
+        if self._writer is None:
+            self._start()
+        self._writer.close()
+        self._finished = True
+        return {'sha256': self._digest.hexdigest(), 'md5': self._md5.hexdigest(), 'size': self.size}
+
+    def abort(self) -> None:
+        """Drop a rejected or failed upload, deleting anything already stored"""
+        if self._writer is None:
+            return
+        try:
+            # A resumable upload can only be ended by finalizing it
+            if not self._finished:
+                self._writer.close()
+            self.blob.delete()
+        except Exception as e:
+            logging.warning(f"Failed to clean up upload {self.blob.name}: {str(e)}")
+        self._writer = None
+
+def stored_blob_digest(blob, max_bytes: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Validate a stored object as a PDF within the size limit from its
+    metadata and first SNIFF_BYTES, without downloading it. Returns
+    {"md5", "crc32c", "size"} as reported by Storage; objects without an
+    MD5 (composite objects) are streamed through hash_blob instead.
+    Raises UploadRejected.
+    """
+    max_bytes = max_bytes or max_upload_bytes()
+    if blob.size is None:
+        blob.reload()
+    if blob.size > max_bytes:
+        raise UploadRejected(too_large_message(max_bytes), 413)
+    if blob.size == 0:
+        raise UploadRejected('File is empty', 400)
+    if not blob.md5_hash:
+        return hash_blob(blob, max_bytes)
+    if not is_pdf(blob.download_as_bytes(start=0, end=SNIFF_BYTES - 1)):
+        raise UploadRejected('File is not a PDF', 415)
+    return {
+        'md5': base64.b64decode(blob.md5_hash).hex(),
+        'crc32c': blob.crc32c,
+        'size': blob.size
+    }
+
+def hash_blob(blob, max_bytes: Optional[int] = None, chunk_size: int = UPLOAD_CHUNK_BYTES) -> Dict[str, Any]:
+    """
+    Validate a stored object as a PDF within the size limit, streaming it
+    to compute SHA-256 and MD5. Returns {"sha256", "md5", "size"}; raises
+    UploadRejected.
+    """
+    max_bytes = max_bytes or max_upload_bytes()
+    if blob.size is not None and blob.size > max_bytes:
+        raise UploadRejected(too_large_message(max_bytes), 413)
+    digest = hashlib.sha256()
+    md5 = hashlib.md5()
+    size = 0
+    with blob.open('rb', chunk_size=chunk_size) as reader:
+        while True:
+            chunk = reader.read(chunk_size)
+            if not chunk:
+                break
+            if size == 0 and not is_pdf(chunk[:SNIFF_BYTES]):
+                raise UploadRejected('File is not a PDF', 415)
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadRejected(too_large_message(max_bytes), 413)
+            digest.update(chunk)
+            md5.update(chunk)
+    if size == 0:
+        raise UploadRejected('File is empty', 400)
+    return {'sha256': digest.hexdigest(), 'md5': md5.hexdigest(), 'size': size}
+
+def signing_credentials() -> Any:
+    """
+    Default credentials refreshed for IAM signBlob, so V4 URLs can be
+    signed on Cloud Functions where there is no private key file
+    """
+    import google.auth
+    from google.auth.transport import requests as auth_requests
+    credentials, _ = google.auth.default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
+    if not credentials.valid:
+        credentials.refresh(auth_requests.Request())
+    return credentials
+
+def signed_upload_url(blob, max_bytes: int, expires_seconds: int = UPLOAD_URL_SECONDS) -> Dict[str, Any]:
+    """
+    URL that starts a resumable upload of exactly this object. The client
+    POSTs to it with the returned headers, then PUTs the file to the
+    session URI in the Location response header. Storage itself enforces
+    the size range, content type and create-only precondition.
+    """
+    headers = {
+        'x-goog-resumable': 'start',
+        'x-goog-content-length-range': f'0,{max_bytes}',
+        'x-goog-if-generation-match': '0'
+    }
+    emulator_host = os.environ.get('STORAGE_EMULATOR_HOST')
+    if emulator_host:
+        # The emulator does not check signatures; start the session directly
+        url = f"{emulator_host.rstrip('/')}/upload/storage/v1/b/{blob.bucket.name}/o?uploadType=resumable&name={quote(blob.name, safe='')}"
+    else:
+        credentials = signing_credentials()
+        url = blob.generate_signed_url(
+            version='v4',
+            expiration=timedelta(seconds=expires_seconds),
+            method='POST',
+            content_type='application/pdf',
+            headers=headers,
+            service_account_email=credentials.service_account_email,
+            access_token=credentials.token
+        )
+    return {
+        'url': url,
+        'method': 'POST',
+        'headers': {**headers, 'Content-Type': 'application/pdf'},
+        'expiresIn': expires_seconds
+    }
+
+def register_uploaded_paper(db, uid: str, blob, filename: str, upload: Dict[str, Any], language: str) -> Tuple[int, Dict[str, Any]]:
+    """
+    Create the paper document for a stored upload and start its analysis.
+    Duplicates are resolved first: the same user's identical file returns
+    the existing paper (and deletes the new object), and a duplicate of an
+    analyzed paper reuses its analysis instead of enqueueing a job.
+    Returns (HTTP status, response body); 503 means the analysis queue is
+    full (the paper exists and analysis can be retried).
+    """
+    from firebase_admin import firestore
+    from src.jobs.backends import QueueFullError
+    fingerprint = runtime.timed_import('src.utils.fingerprint')
+    paper_store = runtime.timed_import('src.utils.paper_store')
+    sha256 = upload.get('sha256')
+    md5 = upload.get('md5')
+    
+    # The same user uploading the same file again gets the existing paper
+    duplicate = None
+    try:
+        duplicate = fingerprint.find_exact_duplicate(db, sha256, uploader_id=uid, md5=md5)
+    except Exception as e:
+        logging.warning(f'Duplicate check failed: {str(e)}')
+    if duplicate and duplicate['uploaderId'] == uid:
+        existing = db.collection('papers').document(duplicate['paperId']).get(field_paths=['fileUrl', 'processingStatus'])
+        if existing.exists:
+            logging.info(f"Upload by {uid} is identical to paper {duplicate['paperId']}, discarding it")
+            blob.delete()
+            return 200, {
+                'success': True,
+                'paperId': duplicate['paperId'],
+                'fileUrl': existing.get('fileUrl'),
+                'processingStatus': existing.get('processingStatus'),
+                'duplicate': True,
+            }
+    
+    # Near-duplicates are found from the text, read back from Storage
+    # in ranges rather than from a buffered copy. The signature is stored
+    # even for another user's exact duplicate so later revisions of the
+    # paper still match this copy
+    signature = None
+    try:
+        with blob.open('rb', chunk_size=SIGNATURE_READ_CHUNK_BYTES) as reader:
+            signature = fingerprint.text_signature(reader)
+        if duplicate is None:
+            duplicate = fingerprint.find_near_duplicate(db, signature, uploader_id=uid)
+    except Exception as e:
+        logging.warning(f'Near-duplicate check failed: {str(e)}')
+    
+    # Make blob publicly readable or use Firebase Storage URL
+    # Since papers should be accessible to authenticated users, we'll use the public URL format
+    url = storage_url(blob.bucket.name, blob.name)
+    
+    # Save to Firestore
+    paper_data = {
+        'uploaderId': uid,
+        'title': filename.replace('.pdf', ''),
+        'authors': [],
+        'fileUrl': url,
+        'fileSize': upload['size'],
+        'sha256': sha256,
+        'md5': md5,
+        'processingStatus': 'pending',
+        'createdAt': firestore.SERVER_TIMESTAMP,
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }
+    
+    # A duplicate of an analyzed paper in the same language reuses its analysis
+    analysis = None
+    details = None
+    embedding = None
+    if duplicate and duplicate.get('language') == language:
+        try:
+            analysis = fingerprint.reusable_analysis(db, duplicate['paperId'])
+            if analysis:
+                details = paper_store.get_analysis_details(db, duplicate['paperId'], analysis)
+                embedding = paper_store.get_embeddings(db, [duplicate['paperId']], {duplicate['paperId']: analysis}).get(duplicate['paperId'])
+        except Exception as e:
+            logging.warning(f"Could not read analysis of paper {duplicate['paperId']}: {str(e)}")
+            analysis = None
+    if analysis:
+        paper_data.update({field: value for field, value in analysis.items() if field not in paper_store.EMBEDDING_FIELDS})
+        paper_data.update(paper_store.summary_fields(analysis))
+        paper_data['duplicateOf'] = duplicate['paperId']
+        paper_data['duplicateMatch'] = {'type': duplicate['match'], 'similarity': duplicate['similarity']}
+    
+    # The paper, its fingerprint and its analysis job are written in one
+    # batch, with the paper already in its final initial state
+    persistence = runtime.timed_import('src.utils.persistence')
+    paper_ref = persistence.new_document(db, 'papers')
+    paper_id = paper_ref.id
+    writes = persistence.WriteGroup(db)
+    fingerprint.save_fingerprint(db, paper_id, uid, sha256, signature, language, batch=writes, md5=md5)
+    
+    if analysis:
+        writes.create(paper_ref, paper_data)
+        if details:
+            writes.set(paper_store.analysis_details_ref(db, paper_id), {
+                **details,
+                'updatedAt': firestore.SERVER_TIMESTAMP
+            })
+        if embedding:
+            writes.set(paper_store.embedding_ref(db, paper_id), embedding)
+        writes.commit()
+        logging.info(f"Paper {paper_id} is a {duplicate['match']} duplicate of {duplicate['paperId']}, reusing its analysis")
+        if embedding:
+            try:
+                similarity_index = runtime.timed_import('src.utils.similarity_index')
+                similarity_index.index_paper(paper_id, {**paper_data, **embedding})
+            except Exception as e:
+                logging.error(f'Failed to index paper {paper_id}: {str(e)}')
+        return 200, {
+            'success': True,
+            'paperId': paper_id,
+            'fileUrl': url,
+            'processingStatus': 'completed',
+            'duplicateOf': duplicate['paperId'],
+            'duplicateMatch': paper_data['duplicateMatch'],
+        }
+    
+    # Enqueue analysis; the job worker picks it up in the background
+    try:
+        job_id = runtime.enqueue_job('analyze_paper', {
+            'paper_id': paper_id,
+            'file_url': url,
+            'uploader_id': uid,
+            'language': language
+        }, batch=writes)
+    except QueueFullError as e:
+        logging.warning(f'Analysis queue full for paper {paper_id}: {str(e)}')
+        writes.create(paper_ref, paper_data)
+        writes.commit()
+        return 503, {
+            'error': 'Analysis queue is full, please retry later',
+            'paperId': paper_id,
+            'fileUrl': url,
+        }
+    
+    writes.create(paper_ref, {
+        **paper_data,
+        'processingStatus': 'processing',
+        'analysisJobId': job_id
+    })
+    writes.commit()
+    
+    return 200, {
+        'success': True,
+        'paperId': paper_id,
+        'fileUrl': url,
+        'jobId': job_id,
+    }
@@ -0,0 +1,66 @@
+"""
+Tests for the authorization of analyze_papers_batch_http. Run from functions/:
+
+    python -m unittest discover tests
+"""
+import importlib.util
+import json
+import unittest
+from unittest import mock
+
+@unittest.skipUnless(
+    importlib.util.find_spec('firebase_admin') and importlib.util.find_spec('firebase_functions'),
+    'firebase_admin and firebase_functions are not installed'
+)
+class BatchAnalysisAuthTest(unittest.TestCase):
+
+    def setUp(self):
+        from firebase_admin import auth, firestore
+        from benchmarks import fakes
+        from src import runtime
+        self.db = fakes.FakeFirestore()
+        for name in ('logging', 'firebase'):
+            runtime.set_client(name, True)
+        runtime.set_client('firestore', self.db)
+        for patcher in (
+            mock.patch.object(firestore, 'transactional', fakes.fake_transactional),
+            mock.patch.object(auth, 'verify_id_token', lambda token: {'uid': token}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.db.collection('papers').document('alice-paper').set({
+            'uploaderId': 'alice',
+            'fileUrl': 'gs://bucket/papers/alice/paper.pdf',
+            'processingStatus': 'completed'
+        })
+
+    def call(self, body, uid=None):
+        from werkzeug.test import EnvironBuilder
+        from firebase_functions import https_fn
+        import main
+        headers = {'Authorization': f'Bearer {uid}'} if uid else {}
+        request = https_fn.Request(EnvironBuilder(method='POST', json=body, headers=headers).get_environ())
+        response = main.analyze_papers_batch_http(request)
+        return response.status_code, json.loads(response.get_data())
+
+    def test_requires_id_token(self):
+        status, _ = self.call({'papers': [{'paper_id': 'alice-paper'}]})
+        self.assertEqual(status, 401)
+
+    def test_other_users_papers_are_not_analyzed(self):
+        for item in (
+            {'paper_id': 'alice-paper'},
+            {'paper_id': 'alice-paper', 'uploader_id': 'mallory'},
+        ):
+            status, body = self.call({'papers': [item]}, uid='mallory')
+            self.assertEqual(status, 200)
+            self.assertEqual(body['results'], [{'paperId': 'alice-paper', 'success': False, 'error': 'Paper not found'}])
+        paper = self.db.collection('papers').document('alice-paper').get().to_dict()
+        self.assertEqual(paper['processingStatus'], 'completed')
+
+    def test_request_cannot_claim_another_uploader(self):
+        status, body = self.call({'papers': [{'paper_id': 'alice-paper', 'uploader_id': 'mallory'}]}, uid='alice')
+        self.assertEqual(body['results'][0]['error'], 'Paper not found')
+
+if __name__ == '__main__':
+    unittest.main()
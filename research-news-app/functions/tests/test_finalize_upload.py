@@ -0,0 +1,164 @@
+"""
+Tests for finalizing direct-to-Storage uploads against the benchmark
+fakes (in-memory Firestore, local-directory bucket). Run from functions/:
+
+    python -m unittest discover tests
+"""
+import importlib.util
+import json
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+from unittest import mock
+
+BUCKET = 'test-bucket'
+
+@unittest.skipUnless(
+    importlib.util.find_spec('firebase_admin') and importlib.util.find_spec('firebase_functions'),
+    'firebase_admin and firebase_functions are not installed'
+)
+class FinalizeUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        from firebase_admin import auth, firestore, storage
+        from benchmarks import fakes
+        from src import runtime
+        from src.jobs.backends import InMemoryJobBackend
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        self.db = fakes.FakeFirestore()
+        self.storage = fakes.LocalStorageClient(root)
+        self.jobs = InMemoryJobBackend()
+        for name in ('logging', 'firebase'):
+            runtime.set_client(name, True)
+        runtime.set_client('firestore', self.db)
+        runtime.set_client('jobs', self.jobs)
+        for patcher in (
+            mock.patch.object(firestore, 'transactional', fakes.fake_transactional),
+            mock.patch.object(auth, 'verify_id_token', lambda token: {'uid': token}),
+            mock.patch.object(storage, 'bucket', self.storage.bucket),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create_session(self, uid: str, data: bytes = None, max_bytes: int = 1024 * 1024) -> str:
+        """Session as issued by upload_url_api, with data already uploaded"""
+        from src.utils import uploads
+        session_id = uuid.uuid4().hex
+        blob_name = f"papers/{uid}/{session_id}.pdf"
+        if data is not None:
+            self.storage.bucket(BUCKET).blob(blob_name).upload_from_string(data, content_type='application/pdf')
+        self.db.collection(uploads.UPLOAD_SESSIONS_COLLECTION).document(session_id).set({
+            'uploaderId': uid,
+            'bucket': BUCKET,
+            'blobName': blob_name,
+            'filename': 'paper.pdf',
+            'language': 'en',
+            'maxBytes': max_bytes,
+            'status': 'pending',
+            'finalizeBy': time.time() + 60
+        })
+        return session_id
+
+    def finalize(self, uid: str, session_id: str):
+        from werkzeug.test import EnvironBuilder
+        from firebase_functions import https_fn
+        from api_finalize_upload import finalize_upload_api
+        request = https_fn.Request(EnvironBuilder(
+            method='POST',
+            json={'sessionId': session_id},
+            headers={'Authorization': f'Bearer {uid}'}
+        ).get_environ())
+        response = finalize_upload_api(request)
+        return response.status_code, json.loads(response.get_data())
+
+    def blob_exists(self, session_id: str) -> bool:
+        from src.utils import uploads
+        session = self.db.collection(uploads.UPLOAD_SESSIONS_COLLECTION).document(session_id).get().to_dict()
+        return self.storage.bucket(BUCKET).get_blob(session['blobName']) is not None
+
+    def papers(self):
+        return list(self.db.collection('papers').stream())
+
+    def test_finalize_is_idempotent(self):
+        from benchmarks.corpus import build_paper_pdf
+        session_id = self.create_session('alice', build_paper_pdf('idempotent', 2))
+        first = self.finalize('alice', session_id)
+        second = self.finalize('alice', session_id)
+
+        self.assertEqual(first[0], 200)
+        self.assertEqual(second, first)
+        self.assertEqual(len(self.papers()), 1)
+        self.assertEqual(len(self.jobs.jobs), 1)
+        paper = self.papers()[0].to_dict()
+        self.assertEqual(paper['processingStatus'], 'processing')
+        self.assertEqual(first[1]['paperId'], self.papers()[0].id)
+
+    def test_missing_object_is_not_finalized(self):
+        session_id = self.create_session('alice')
+        status, body = self.finalize('alice', session_id)
+        self.assertEqual(status, 409)
+        self.assertEqual(body['error'], 'Upload is not complete')
+        self.assertEqual(self.papers(), [])
+
+    def test_other_users_session_is_not_found(self):
+        from benchmarks.corpus import build_paper_pdf
+        session_id = self.create_session('alice', build_paper_pdf('private', 2))
+        self.assertEqual(self.finalize('mallory', session_id)[0], 404)
+        self.assertEqual(self.papers(), [])
+
+    def test_oversized_object_is_rejected_and_deleted(self):
+        from benchmarks.corpus import build_paper_pdf
+        data = build_paper_pdf('oversized', 2)
+        session_id = self.create_session('alice', data, max_bytes=len(data) - 1)
+        status, _ = self.finalize('alice', session_id)
+        self.assertEqual(status, 413)
+        self.assertFalse(self.blob_exists(session_id))
+        self.assertEqual(self.papers(), [])
+        # The rejection is final for the session
+        self.assertEqual(self.finalize('alice', session_id)[0], 413)
+
+    def test_non_pdf_object_is_rejected_and_deleted(self):
+        session_id = self.create_session('alice', b'<html>not a paper</html>' * 10)
+        status, body = self.finalize('alice', session_id)
+        self.assertEqual(status, 415)
+        self.assertEqual(body['error'], 'File is not a PDF')
+        self.assertFalse(self.blob_exists(session_id))
+        self.assertEqual(self.papers(), [])
+
+    def test_same_users_exact_duplicate_reuses_the_paper(self):
+        from benchmarks.corpus import build_paper_pdf
+        data = build_paper_pdf('duplicate', 2)
+        first_session = self.create_session('alice', data)
+        _, first = self.finalize('alice', first_session)
+
+        second_session = self.create_session('alice', data)
+        status, second = self.finalize('alice', second_session)
+        self.assertEqual(status, 200)
+        self.assertTrue(second['duplicate'])
+        self.assertEqual(second['paperId'], first['paperId'])
+        self.assertEqual(len(self.papers()), 1)
+        self.assertEqual(len(self.jobs.jobs), 1)
+        self.assertTrue(self.blob_exists(first_session))
+        self.assertFalse(self.blob_exists(second_session))
+
+    def test_other_users_exact_duplicate_keeps_a_text_signature(self):
+        from benchmarks.corpus import build_paper_pdf
+        from src.utils import fingerprint
+        data = build_paper_pdf('shared', 2)
+        _, first = self.finalize('alice', self.create_session('alice', data))
+        status, second = self.finalize('bob', self.create_session('bob', data))
+        self.assertEqual(status, 200)
+        self.assertNotEqual(second['paperId'], first['paperId'])
+
+        fingerprints = self.db.collection(fingerprint.FINGERPRINTS_COLLECTION)
+        saved = fingerprints.document(second['paperId']).get().to_dict()
+        self.assertEqual(saved['uploaderId'], 'bob')
+        self.assertIsNotNone(fingerprint.decode_signature(saved['minhash']))
+        self.assertEqual(saved['lshBands'], fingerprints.document(first['paperId']).get().to_dict()['lshBands'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+"""
+Tests for duplicate detection: MinHash/LSH near-duplicates, exact
+matches and analysis reuse, against the benchmark's in-memory
+Firestore. Run from functions/:
+
+    python -m unittest discover tests
+"""
+import importlib.util
+import random
+import string
+import unittest
+
+def words(count: int, seed: int) -> str:
+    """count distinct-looking random words, reproducible from seed"""
+    rng = random.Random(seed)
+    return ' '.join(''.join(rng.choices(string.ascii_lowercase, k=8)) for _ in range(count))
+
+@unittest.skipUnless(importlib.util.find_spec('numpy'), 'numpy is not installed')
+class MinHashTest(unittest.TestCase):
+
+    def setUp(self):
+        from src.utils import fingerprint
+        self.fingerprint = fingerprint
+
+    def similarity(self, text_a: str, text_b: str) -> float:
+        return self.fingerprint.estimate_similarity(
+            self.fingerprint.minhash_signature(text_a),
+            self.fingerprint.minhash_signature(text_b)
+        )
+
+    def shared_bands(self, text_a: str, text_b: str) -> int:
+        keys_a = self.fingerprint.lsh_band_keys(self.fingerprint.minhash_signature(text_a))
+        keys_b = self.fingerprint.lsh_band_keys(self.fingerprint.minhash_signature(text_b))
+        return len(set(keys_a) & set(keys_b))
+
+    def test_layout_and_case_do_not_change_the_signature(self):
+        text = words(300, seed=1)
+        reflowed = text.upper().replace(' ', '\n  ', 50)
+        self.assertEqual(self.similarity(text, reflowed), 1.0)
+        self.assertEqual(self.shared_bands(text, reflowed), self.fingerprint.LSH_BANDS)
+
+    def test_short_text_has_no_signature(self):
+        short = words(self.fingerprint.MIN_SHINGLES + self.fingerprint.SHINGLE_SIZE - 2, seed=2)
+        self.assertIsNone(self.fingerprint.minhash_signature(short))
+        self.assertIsNone(self.fingerprint.minhash_signature(''))
+
+    def test_similarity_estimates_jaccard_around_the_threshold(self):
+        base = words(1000, seed=3)
+        # (appended words, expected to pass DUPLICATE_THRESHOLD); Jaccard
+        # is about 1000 / (1000 + appended)
+        cases = [(50, True), (200, True), (1000, False), (3000, False)]
+        for appended, duplicate in cases:
+            with self.subTest(appended=appended):
+                similarity = self.similarity(base, f"{base} {words(appended, seed=4)}")
+                self.assertAlmostEqual(similarity, 1000 / (1000 + appended), delta=0.12)
+                self.assertEqual(similarity >= self.fingerprint.DUPLICATE_THRESHOLD, duplicate)
+
+    def test_near_duplicates_share_a_band_and_unrelated_texts_do_not(self):
+        base = words(1000, seed=5)
+        self.assertGreater(self.shared_bands(base, f"{base} {words(100, seed=6)}"), 0)
+        self.assertEqual(self.shared_bands(base, words(1000, seed=7)), 0)
+
+    def test_signature_encoding_round_trips(self):
+        signature = self.fingerprint.minhash_signature(words(200, seed=8))
+        decoded = self.fingerprint.decode_signature(self.fingerprint.encode_signature(signature))
+        self.assertTrue((decoded == signature).all())
+        self.assertIsNone(self.fingerprint.decode_signature(b''))
+        self.assertIsNone(self.fingerprint.decode_signature(b'\x00' * 8))
+
+@unittest.skipUnless(
+    importlib.util.find_spec('numpy') and importlib.util.find_spec('firebase_admin'),
+    'numpy and firebase_admin are not installed'
+)
+class DuplicateLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        from benchmarks import fakes
+        from src.utils import fingerprint
+        self.fingerprint = fingerprint
+        self.db = fakes.FakeFirestore()
+
+    def add_fingerprint(self, paper_id: str, uploader_id: str, sha256: str = None, md5: str = None, text: str = None, language: str = 'en'):
+        """Fingerprint document as save_fingerprint writes it"""
+        signature = self.fingerprint.minhash_signature(text) if text else None
+        self.db.collection(self.fingerprint.FINGERPRINTS_COLLECTION).document(paper_id).set({
+            'uploaderId': uploader_id,
+            'sha256': sha256,
+            'md5': md5,
+            'minhash': self.fingerprint.encode_signature(signature) if signature is not None else None,
+            'lshBands': self.fingerprint.lsh_band_keys(signature) if signature is not None else [],
+            'language': language
+        })
+
+    def test_exact_match_by_md5_then_sha256(self):
+        self.add_fingerprint('by-md5', 'bob', sha256='sha-a', md5='md5-a')
+        # Saved before MD5 was recorded
+        self.add_fingerprint('legacy', 'bob', sha256='sha-b')
+        self.add_fingerprint('other-sha', 'bob', sha256='sha-c', md5='md5-c')
+
+        cases = [
+            ('md5 match', 'sha-a', 'md5-a', 'by-md5'),
+            ('md5 wins over a different sha256 match', 'sha-c', 'md5-a', 'by-md5'),
+            ('sha256 of a legacy fingerprint', 'sha-b', 'md5-b', 'legacy'),
+            ('md5 only', None, 'md5-c', 'other-sha'),
+            ('no match', 'sha-x', 'md5-x', None),
+            ('no hashes', None, None, None),
+        ]
+        for description, sha256, md5, expected in cases:
+            with self.subTest(description):
+                duplicate = self.fingerprint.find_exact_duplicate(self.db, sha256, uploader_id='alice', md5=md5)
+                self.assertEqual(duplicate and duplicate['paperId'], expected)
+                if duplicate:
+                    self.assertEqual((duplicate['match'], duplicate['similarity']), ('exact', 1.0))
+
+    def test_exact_match_prefers_the_uploaders_copy(self):
+        self.add_fingerprint('bobs', 'bob', sha256='sha', md5='md5')
+        self.add_fingerprint('alices', 'alice', sha256='sha', md5='md5', language='ja')
+        duplicate = self.fingerprint.find_exact_duplicate(self.db, 'sha', uploader_id='alice', md5='md5')
+        self.assertEqual((duplicate['paperId'], duplicate['uploaderId'], duplicate['language']), ('alices', 'alice', 'ja'))
+        self.assertEqual(self.fingerprint.find_exact_duplicate(self.db, 'sha', uploader_id='carol', md5='md5')['paperId'], 'bobs')
+
+    def test_near_duplicate_above_threshold_is_found(self):
+        base = words(1000, seed=10)
+        self.add_fingerprint('revised', 'bob', text=f"{base} {words(100, seed=11)}")
+        self.add_fingerprint('loosely-related', 'bob', text=f"{base} {words(1200, seed=12)}")
+        self.add_fingerprint('unrelated', 'bob', text=words(1000, seed=13))
+
+        duplicate = self.fingerprint.find_near_duplicate(self.db, self.fingerprint.minhash_signature(base), uploader_id='alice')
+        self.assertEqual((duplicate['paperId'], duplicate['match']), ('revised', 'near'))
+        self.assertGreaterEqual(duplicate['similarity'], self.fingerprint.DUPLICATE_THRESHOLD)
+
+        self.assertIsNone(self.fingerprint.find_near_duplicate(self.db, self.fingerprint.minhash_signature(words(1000, seed=14))))
+        self.assertIsNone(self.fingerprint.find_near_duplicate(self.db, None))
+
+    def test_exact_match_is_checked_before_near_duplicates(self):
+        base = words(1000, seed=15)
+        self.add_fingerprint('near', 'bob', text=base)
+        self.add_fingerprint('exact', 'bob', sha256='sha', md5='md5')
+        signature = self.fingerprint.minhash_signature(base)
+        self.assertEqual(self.fingerprint.find_duplicate(self.db, 'sha', signature, md5='md5')['paperId'], 'exact')
+        self.assertEqual(self.fingerprint.find_duplicate(self.db, 'other', signature, md5='other')['paperId'], 'near')
+
+    def test_reusable_analysis(self):
+        papers = self.db.collection('papers')
+        analysis = {'summary': 'Sparse attention scales linearly.'}
+        papers.document('completed').set({
+            'processingStatus': 'completed',
+            'aiAnalysis': analysis,
+            'title': 'Sparse Attention',
+            'fileUrl': 'gs://bucket/papers/bob/completed.pdf',
+            'uploaderId': 'bob'
+        })
+        papers.document('processing').set({'processingStatus': 'processing', 'title': 'Pending'})
+        papers.document('failed').set({'processingStatus': 'completed', 'aiAnalysis': None})
+
+        reused = self.fingerprint.reusable_analysis(self.db, 'completed')
+        self.assertEqual(reused, {'processingStatus': 'completed', 'aiAnalysis': analysis, 'title': 'Sparse Attention'})
+        for paper_id in ('processing', 'failed', 'missing'):
+            with self.subTest(paper_id):
+                self.assertIsNone(self.fingerprint.reusable_analysis(self.db, paper_id))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+Tests for the job worker against the in-memory backend. Run from functions/:
+
+    python -m unittest discover tests
+"""
+import time
+import unittest
+from unittest import mock
+
+from src.jobs import worker as worker_module
+from src.jobs.backends import InMemoryJobBackend, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_DEAD
+from src.jobs.worker import JobWorker, PermanentJobError
+
+class FailingHandler:
+    """Job handler that raises the given error and counts its calls"""
+
+    def __init__(self, error: Exception):
+        self.error = error
+        self.calls = 0
+
+    def __call__(self, payload):
+        self.calls += 1
+        raise self.error
+
+class JobWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = InMemoryJobBackend()
+        self.dead = []
+
+    def make_worker(self, handler, **kwargs) -> JobWorker:
+        return JobWorker(
+            self.backend,
+            {'test': handler},
+            on_dead={'test': lambda payload, error: self.dead.append((payload, error))},
+            **kwargs
+        )
+
+    def make_due(self, job_id: str) -> None:
+        """Skip the backoff of a queued retry"""
+        self.backend.jobs[job_id]['runAfter'] = time.time()
+
+    def test_claim_takes_a_lease(self):
+        job_id = self.backend.enqueue('test', {'n': 1})
+        claimed = self.backend.claim('worker-a', 60, 10)
+        self.assertEqual([job['id'] for job in claimed], [job_id])
+        self.assertEqual(claimed[0]['status'], JOB_RUNNING)
+        self.assertEqual(claimed[0]['attempts'], 1)
+        self.assertEqual(claimed[0]['leaseOwner'], 'worker-a')
+        self.assertEqual(self.backend.claim('worker-b', 60, 10), [])
+
+    def test_expired_lease_is_reclaimed_and_stale_result_discarded(self):
+        job_id = self.backend.enqueue('test', {'n': 1})
+        stale = self.backend.claim('worker-a', 0, 1)[0]
+        reclaimed = self.backend.claim('worker-b', 60, 1)
+        self.assertEqual([job['id'] for job in reclaimed], [job_id])
+        self.assertEqual(reclaimed[0]['attempts'], 2)
+
+        stale_worker = self.make_worker(lambda payload: None, worker_id='worker-a')
+        self.assertEqual(stale_worker.run_job(stale), 'lost')
+        self.assertEqual(self.backend.get(job_id)['leaseOwner'], 'worker-b')
+
+    def test_lease_ends_by_lease_deadline(self):
+        worker = self.make_worker(lambda payload: None, lease_seconds=500)
+        self.assertEqual(worker.lease_seconds_until(), 500)
+        self.assertAlmostEqual(worker.lease_seconds_until(time.time() + 60), 60, delta=1)
+        self.assertEqual(worker.lease_seconds_until(time.time() - 1), 0)
+
+    def test_success(self):
+        handled = []
+        job_id = self.backend.enqueue('test', {'n': 1})
+        stats = self.make_worker(handled.append).run()
+        self.assertEqual(handled, [{'n': 1}])
+        self.assertEqual(stats['succeeded'], 1)
+        job = self.backend.get(job_id)
+        self.assertEqual(job['status'], JOB_SUCCEEDED)
+        self.assertIsNone(job['leaseOwner'])
+        self.assertEqual(len(job['attemptHistory']), 1)
+
+    def test_failures_retry_with_backoff_until_max_attempts(self):
+        handler = FailingHandler(RuntimeError('flaky'))
+        job_id = self.backend.enqueue('test', {'n': 1}, max_attempts=3)
+        worker = self.make_worker(handler)
+
+        # Take the upper bound of the jittered delay
+        with mock.patch.object(worker_module.random, 'uniform', lambda low, high: high):
+            for attempt, backoff in ((1, 30), (2, 60)):
+                before = time.time()
+                worker.run()
+                job = self.backend.get(job_id)
+                self.assertEqual(job['status'], JOB_QUEUED)
+                self.assertEqual(job['attempts'], attempt)
+                self.assertAlmostEqual(job['runAfter'] - before, backoff, delta=1)
+                # Not due yet: nothing is claimed
+                self.assertEqual(worker.run()['claimed'], attempt)
+                self.make_due(job_id)
+            worker.run()
+
+        job = self.backend.get(job_id)
+        self.assertEqual(handler.calls, 3)
+        self.assertEqual(job['status'], JOB_DEAD)
+        self.assertEqual([entry['attempt'] for entry in job['attemptHistory']], [1, 2, 3])
+        self.assertEqual(job['lastError'], 'flaky')
+        self.assertEqual(self.dead, [({'n': 1}, 'flaky')])
+        self.assertEqual(worker.stats['retried'], 2)
+        self.assertEqual(worker.stats['dead'], 1)
+
+    def test_retry_delay_is_capped(self):
+        with mock.patch.object(worker_module.random, 'uniform', lambda low, high: high):
+            self.assertEqual(worker_module.retry_delay(1), worker_module.BASE_BACKOFF_SECONDS)
+            self.assertEqual(worker_module.retry_delay(20), worker_module.MAX_BACKOFF_SECONDS)
+
+    def test_permanent_error_is_not_retried(self):
+        handler = FailingHandler(PermanentJobError('bad payload'))
+        job_id = self.backend.enqueue('test', {'n': 1}, max_attempts=3)
+        self.make_worker(handler).run()
+        job = self.backend.get(job_id)
+        self.assertEqual(handler.calls, 1)
+        self.assertEqual(job['status'], JOB_DEAD)
+        self.assertEqual(job['attempts'], 1)
+        self.assertEqual(self.dead, [({'n': 1}, 'bad payload')])
+
+    def test_unknown_job_type_is_dead(self):
+        job_id = self.backend.enqueue('unknown', {})
+        self.make_worker(lambda payload: None).run()
+        self.assertEqual(self.backend.get(job_id)['status'], JOB_DEAD)
+
+    def test_enqueue_deduplicates_job_id(self):
+        first = self.backend.enqueue('test', {'n': 1}, job_id='analyze-paper-1')
+        second = self.backend.enqueue('test', {'n': 2}, job_id='analyze-paper-1')
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.backend.jobs), 1)
+        self.assertEqual(self.backend.get(first)['payload'], {'n': 1})
+
+        handled = []
+        self.make_worker(handled.append).run()
+        self.assertEqual(handled, [{'n': 1}])
+
+        # A finished job is not re-run by enqueueing it again
+        self.backend.enqueue('test', {'n': 3}, job_id='analyze-paper-1')
+        self.assertEqual(self.backend.get(first)['status'], JOB_SUCCEEDED)
+
+if __name__ == '__main__':
+    unittest.main()
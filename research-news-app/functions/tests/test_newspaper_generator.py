@@ -0,0 +1,114 @@
+"""
+Tests for concurrent newspaper generation. Run from functions/:
+
+    python -m unittest discover tests
+"""
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from src import runtime
+from src.utils import newspaper_generator
+
+class ScriptedModel:
+    """
+    generate_content stand-in: each prompt maps to (delay, text or
+    exception), so completions arrive out of order and some calls fail
+    """
+
+    def __init__(self, script):
+        self.script = script
+        self.lock = threading.Lock()
+        self.completed = []
+
+    def generate_content(self, prompt, **kwargs):
+        delay, outcome = self.script(prompt)
+        time.sleep(delay)
+        with self.lock:
+            self.completed.append(prompt)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(text=outcome)
+
+class GenerateContentBatchTest(unittest.TestCase):
+
+    def test_results_keep_input_order(self):
+        prompts = [f"prompt {i}" for i in range(6)]
+        # Later prompts finish first
+        model = ScriptedModel(lambda prompt: (0.02 * (6 - int(prompt.split()[1])), prompt.upper()))
+        arrivals = []
+        responses = newspaper_generator.generate_content_batch(
+            model, prompts, max_workers=6,
+            on_response=lambda i, response: arrivals.append((i, response.text))
+        )
+        self.assertEqual([response.text for response in responses], [prompt.upper() for prompt in prompts])
+        self.assertNotEqual(model.completed, prompts)
+        # Each response is reported with its own index, in arrival order
+        self.assertEqual(sorted(arrivals), [(i, prompt.upper()) for i, prompt in enumerate(prompts)])
+        self.assertEqual([i for i, _ in arrivals], [prompts.index(prompt) for prompt in model.completed])
+
+    def test_failed_call_fails_the_batch_without_misreporting_others(self):
+        prompts = [f"prompt {i}" for i in range(4)]
+
+        def script(prompt):
+            index = int(prompt.split()[1])
+            if index == 1:
+                return 0.05, RuntimeError('quota exceeded')
+            return 0.01 * (4 - index), prompt.upper()
+
+        arrivals = []
+        with self.assertRaises(RuntimeError):
+            newspaper_generator.generate_content_batch(
+                ScriptedModel(script), prompts, max_workers=4,
+                on_response=lambda i, response: arrivals.append((i, response.text))
+            )
+        self.assertEqual(sorted(arrivals), [(0, 'PROMPT 0'), (2, 'PROMPT 2'), (3, 'PROMPT 3')])
+
+class SubArticleNumberingTest(unittest.TestCase):
+
+    def generate(self, sub_outcomes):
+        """
+        Standard generation of a main paper and one sub paper per outcome;
+        sub article responses arrive in reverse order
+        """
+        papers = [
+            {'id': f'paper-{i}', 'title': f'Paper {i}', 'authors': ['A. Author'], 'aiAnalysis': {'summary': f'Summary {i}'}}
+            for i in range(len(sub_outcomes) + 1)
+        ]
+        relationship = (
+            '{"mainPaperIndex": 0, "overallTheme": "Theme", "newspaperTitle": "Title", '
+            f'"subArticleOrder": {list(range(1, len(papers)))}}}'
+        )
+
+        def script(prompt):
+            for i, outcome in enumerate(sub_outcomes, start=1):
+                if f'Title: Paper {i}\n' in prompt and 'sub-article' in prompt:
+                    return 0.02 * (len(sub_outcomes) - i), outcome
+            if 'mainPaperIndex' in prompt:
+                return 0, relationship
+            return 0, '{"headline": "Main", "content": "Body"}'
+
+        with mock.patch.object(runtime, 'get_generative_model', lambda *args, **kwargs: ScriptedModel(script)):
+            content, _ = newspaper_generator.generate_newspaper_sections(papers, {}, 'newspaper-1', 'en', on_section=lambda section, payload: None)
+        return content['subArticles']
+
+    def test_fallbacks_are_numbered_after_the_kept_articles(self):
+        sub_articles = self.generate([
+            '{"headline": "First", "content": "One"}',
+            'no structured answer',
+            '{"headline": broken json}',
+            '{"headline": also broken}',
+        ])
+        self.assertEqual(
+            [(article['paperId'], article['headline']) for article in sub_articles],
+            [
+                ('paper-1', 'First'),
+                ('paper-3', 'Research Result 2'),
+                ('paper-4', 'Research Result 3'),
+            ]
+        )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+"""
+Tests for the analysis path choices and section selection in
+paper_analysis. Run from functions/:
+
+    python -m unittest discover tests
+"""
+import importlib.util
+import unittest
+
+PAGE_TEXT = "Transformers attend to every token of the input sequence in parallel. " * 40
+
+# (heading line, section name or None, inline body); one row per
+# SECTION_HEADINGS entry, then lines that must not start a section
+HEADING_CASES = [
+    ('5 Conclusions', 'conclusion', ''),
+    ('第4章 実験結果', 'results', ''),
+    ('VI. Discussion', 'discussion', ''),
+    ('Abstract—We propose a sparse attention scheme that scales linearly with length.', 'abstract',
+     'We propose a sparse attention scheme that scales linearly with length.'),
+    ('1. Introduction', 'introduction', ''),
+    ('2 Related Work', 'related', ''),
+    ('3.2 Proposed Method', 'methods', ''),
+    ('References', 'references', ''),
+    ('謝辞', 'acknowledgments', ''),
+    ('Appendix A', 'appendix', ''),
+    ('Results show that the model is faster.', None, ''),
+    ('Approaching the limit of the hardware', None, ''),
+    ('The conclusion follows from Lemma 2', None, ''),
+]
+
+# (line, removed as boilerplate)
+BOILERPLATE_CASES = [
+    ('12', True),
+    ('Page 3 of 10', True),
+    ('- 4 -', True),
+    ('arXiv:2301.01234v2 [cs.CL] 3 Jan 2023', True),
+    ('© 2023 IEEE', True),
+    ('Licensed under CC BY 4.0', True),
+    ('Downloaded from https://example.org/paper', True),
+    ('Preprint. Under review.', True),
+    ('We evaluate on 12 datasets and report page 3 of the results.', False),
+    ('The copyrighted corpus was not used.', False),
+]
+
+def section_body(name: str, tokens: int) -> str:
+    """Distinct sentences (so none look like running headers) of about tokens tokens"""
+    sentences = []
+    while len(' '.join(sentences)) < tokens * 3:
+        sentences.append(f"Sentence {len(sentences)} of the {name} section carries content.")
+    return ' '.join(sentences)
+
+@unittest.skipUnless(importlib.util.find_spec('vertexai'), 'vertexai is not installed')
+class NativeIngestionTest(unittest.TestCase):
+
+    def setUp(self):
+        from src.ai import paper_analysis
+        self.paper_analysis = paper_analysis
+
+    def choose(self, text: str, pages: int = 10, mode: str = "auto", size: int = 1024 * 1024) -> bool:
+        return self.paper_analysis.choose_native_ingestion(mode, pages, size, text)
+
+    def test_auto_uses_text_for_papers_with_a_text_layer(self):
+        for pages in (1, 10, 50):
+            with self.subTest(pages=pages):
+                self.assertFalse(self.choose(PAGE_TEXT * pages, pages))
+
+    def test_auto_uses_native_for_unusable_text(self):
+        cases = [
+            ('scanned', ''),
+            ('almost no text', 'Figure 1'),
+            ('low text per page', PAGE_TEXT[:200] * 10),
+            ('undecoded fonts', ('\x03\x11\ufffd' + 'ab') * 2000),
+        ]
+        for description, text in cases:
+            with self.subTest(description):
+                self.assertTrue(self.choose(text, 10))
+
+    def test_auto_stays_on_text_beyond_native_limits(self):
+        limits = self.paper_analysis
+        self.assertFalse(self.choose('', limits.NATIVE_MAX_PAGES + 1))
+        self.assertFalse(self.choose('', 10, size=limits.NATIVE_MAX_BYTES + 1))
+
+    def test_forced_modes(self):
+        self.assertTrue(self.choose(PAGE_TEXT * 10, mode="native"))
+        self.assertFalse(self.choose('', mode="select"))
+        self.assertFalse(self.choose('', mode="map_reduce"))
+        with self.assertRaises(ValueError):
+            self.choose('', self.paper_analysis.NATIVE_MAX_PAGES + 1, mode="native")
+
+@unittest.skipUnless(importlib.util.find_spec('vertexai'), 'vertexai is not installed')
+class SectionSelectionTest(unittest.TestCase):
+
+    def setUp(self):
+        from src.ai import paper_analysis
+        self.paper_analysis = paper_analysis
+
+    def paper(self, sizes) -> str:
+        parts = ['Sparse Attention at Scale\nA. Author, B. Author']
+        for heading, tokens in sizes:
+            parts.append(f"{heading}\n{section_body(heading, tokens)}")
+        return '\n'.join(parts)
+
+    def test_heading_detection(self):
+        for line, name, inline_body in HEADING_CASES:
+            with self.subTest(line):
+                expected = (name, inline_body) if name else None
+                self.assertEqual(self.paper_analysis.match_heading(line), expected)
+
+    def test_sections_are_split_in_document_order(self):
+        headed = [(line, name) for line, name, _ in HEADING_CASES if name]
+        text = '\n'.join(f"{line}\nBody of {name}." for line, name in headed)
+        sections = self.paper_analysis.split_sections(text)
+        self.assertEqual([section['name'] for section in sections], ['preamble'] + [name for _, name in headed])
+        abstract = next(section for section in sections if section['name'] == 'abstract')
+        self.assertEqual(abstract['heading'], 'Abstract—')
+        self.assertTrue(abstract['body'].startswith('We propose'))
+
+    def test_boilerplate_stripping(self):
+        for line, removed in BOILERPLATE_CASES:
+            with self.subTest(line):
+                kept = self.paper_analysis.strip_boilerplate(f"before\n{line}\nafter")
+                self.assertEqual(kept, 'before\nafter' if removed else f"before\n{line}\nafter")
+
+    def test_running_headers_are_stripped(self):
+        header = 'Journal of Sparse Models, Vol. 3'
+        pages = [f"{header}\nContent of page {page}." for page in range(3)]
+        kept = self.paper_analysis.strip_boilerplate('\n'.join(pages))
+        self.assertNotIn(header, kept)
+        self.assertIn('Content of page 2.', kept)
+        # Twice is not yet a running header
+        self.assertIn(header, self.paper_analysis.strip_boilerplate('\n'.join(pages[:2])))
+
+    def test_small_paper_is_kept_whole_without_back_matter(self):
+        text = self.paper([('Abstract', 100), ('1 Introduction', 300), ('2 Results', 300), ('References', 500)])
+        selection = self.paper_analysis.select_sections(text)
+        self.assertEqual(selection['sections'], ['preamble', 'abstract', 'introduction', 'results'])
+        self.assertEqual(selection['truncatedSections'], [])
+        self.assertNotIn('Sentence 0 of the References', selection['text'])
+
+    def test_budget_overflow_keeps_priority_sections(self):
+        budget = self.paper_analysis.ANALYSIS_TOKEN_BUDGET
+        text = self.paper([
+            ('Abstract', 250),
+            ('1 Introduction', 2000),
+            ('2 Related Work', 1500),
+            ('3 Method', 3000),
+            ('4 Results', 2000),
+            ('5 Conclusion', 400),
+            ('References', 1500),
+        ])
+        selection = self.paper_analysis.select_sections(text, budget)
+
+        # Chosen sections stay in document order; related work ranks last
+        # and gets nothing, methods gets what the capped sections left over
+        self.assertEqual(selection['sections'], ['preamble', 'abstract', 'introduction', 'methods', 'results', 'conclusion'])
+        self.assertEqual(selection['truncatedSections'], ['introduction', 'methods', 'results'])
+        # Blocks are cut to their grants; only the joining blank lines add up
+        self.assertLessEqual(selection['selectedTokens'], budget + len(selection['sections']))
+        self.assertEqual(selection['savedTokens'], selection['sourceTokens'] - selection['selectedTokens'])
+        text = selection['text']
+        self.assertLess(text.index('Abstract'), text.index('1 Introduction'))
+        self.assertLess(text.index('4 Results'), text.index('5 Conclusion'))
+        self.assertIn(section_body('5 Conclusion', 400), text)
+
+    def test_budget_overflow_without_headings_keeps_the_leading_text(self):
+        text = section_body('untitled', 5000)
+        selection = self.paper_analysis.select_sections(text, 1000)
+        self.assertEqual(selection['sections'], ['preamble'])
+        self.assertEqual(selection['truncatedSections'], ['preamble'])
+        self.assertTrue(text.startswith(selection['text']))
+        self.assertLessEqual(selection['selectedTokens'], 1001)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""
+Tests for parallel PDF text extraction. Run from functions/:
+
+    python -m unittest discover tests
+"""
+import importlib.util
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from benchmarks.corpus import build_pdf
+from src.ai import pdf_workers
+
+PAGES = 12
+
+def numbered_pdf() -> bytes:
+    return build_pdf([
+        [f"Page marker {page:02d}", f"Body text of page {page} with some words to extract."]
+        for page in range(PAGES)
+    ])
+
+class PoolContextTest(unittest.TestCase):
+
+    def test_pool_does_not_fork_the_functions_process(self):
+        self.assertIn(pdf_workers.pool_context().get_start_method(), ('forkserver', 'spawn'))
+
+@unittest.skipUnless(importlib.util.find_spec('vertexai'), 'vertexai is not installed')
+class ExtractTextParallelTest(unittest.TestCase):
+
+    def setUp(self):
+        from src.ai import paper_analysis
+        self.paper_analysis = paper_analysis
+        patcher = mock.patch.object(paper_analysis, 'get_extraction_workers', lambda *args, **kwargs: 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_matches_serial(self, text: str, pdf_bytes: bytes) -> None:
+        self.assertEqual(text, self.paper_analysis.extract_text_from_pdf(pdf_bytes))
+        positions = [text.index(f"Page marker {page:02d}") for page in range(PAGES)]
+        self.assertEqual(positions, sorted(positions))
+
+    def test_parallel_matches_serial_in_page_order(self):
+        pdf_bytes = numbered_pdf()
+        # No fallback warning: the pool itself produced the text
+        with self.assertNoLogs(level='WARNING'):
+            text = self.paper_analysis.extract_text_parallel(pdf_bytes)
+        self.assert_matches_serial(text, pdf_bytes)
+
+    def test_parallel_from_a_request_thread(self):
+        pdf_bytes = numbered_pdf()
+        with self.assertNoLogs(level='WARNING'), ThreadPoolExecutor(max_workers=1) as executor:
+            text = executor.submit(self.paper_analysis.extract_text_from_pdf, pdf_bytes, parallel=True).result()
+        self.assert_matches_serial(text, pdf_bytes)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+"""
+Tests for the throttled progress writer. Run from functions/:
+
+    python -m unittest discover tests
+"""
+import importlib.util
+import threading
+import time
+import unittest
+from itertools import count
+from unittest import mock
+
+from src.utils import persistence, progress
+
+_paths = count()
+
+class FakeDocumentReference:
+    """Records update() calls; enough of a DocumentReference for the writer"""
+
+    def __init__(self):
+        self.path = f"newspapers/test-{next(_paths)}"
+        self.updates = []
+        self.written = threading.Event()
+
+    def update(self, fields):
+        self.updates.append(dict(fields))
+        self.written.set()
+
+    def merged(self):
+        merged = {}
+        for fields in self.updates:
+            merged.update(fields)
+        return merged
+
+class ThrottledDocumentWriterTest(unittest.TestCase):
+
+    def test_first_update_is_written_immediately(self):
+        doc_ref = FakeDocumentReference()
+        writer = progress.ThrottledDocumentWriter(doc_ref, max_writes_per_second=10)
+        writer.update({'content.headline': 'a'})
+        self.assertEqual(doc_ref.updates, [{'content.headline': 'a'}])
+
+    def test_last_throttled_update_is_eventually_written(self):
+        doc_ref = FakeDocumentReference()
+        writer = progress.ThrottledDocumentWriter(doc_ref, max_writes_per_second=10)
+        writer.update({'content.headline': 'a'})
+        doc_ref.written.clear()
+        writer.update({'content.mainArticle': 'b'})
+        writer.update({'content.sidebar': 'c'})
+        self.assertEqual(len(doc_ref.updates), 1)
+
+        self.assertTrue(doc_ref.written.wait(2))
+        self.assertEqual(len(doc_ref.updates), 2)
+        self.assertEqual(doc_ref.updates[1], {'content.mainArticle': 'b', 'content.sidebar': 'c'})
+
+    def test_update_after_other_write_is_eventually_written(self):
+        doc_ref = FakeDocumentReference()
+        persistence.record_write(doc_ref)
+        writer = progress.ThrottledDocumentWriter(doc_ref, max_writes_per_second=10)
+        writer.update({'content.headline': 'a'})
+        self.assertEqual(doc_ref.updates, [])
+        self.assertTrue(doc_ref.written.wait(2))
+        self.assertEqual(doc_ref.merged(), {'content.headline': 'a'})
+
+    def test_flush_writes_pending_fields_once(self):
+        doc_ref = FakeDocumentReference()
+        writer = progress.ThrottledDocumentWriter(doc_ref, max_writes_per_second=5)
+        writer.update({'content.headline': 'a'})
+        writer.update({'content.mainArticle': 'b'})
+        writer.flush()
+        self.assertEqual(doc_ref.merged(), {'content.headline': 'a', 'content.mainArticle': 'b'})
+
+        time.sleep(0.3)
+        self.assertEqual(len(doc_ref.updates), 2)
+
+    def test_discard_drops_pending_fields(self):
+        doc_ref = FakeDocumentReference()
+        writer = progress.ThrottledDocumentWriter(doc_ref, max_writes_per_second=10)
+        writer.update({'content.headline': 'a'})
+        writer.update({'content.mainArticle': 'b'})
+        writer.discard()
+
+        time.sleep(0.2)
+        self.assertEqual(doc_ref.updates, [{'content.headline': 'a'}])
+
+    def test_refused_write_stops_the_writer(self):
+        doc_ref = FakeDocumentReference()
+        refused = []
+
+        def refuse(fields):
+            refused.append(fields)
+            return False
+
+        writer = progress.ThrottledDocumentWriter(doc_ref, max_writes_per_second=10, write=refuse)
+        writer.update({'content.headline': 'a'})
+        writer.update({'content.mainArticle': 'b'})
+        writer.flush()
+
+        self.assertTrue(writer.stopped)
+        self.assertEqual(refused, [{'content.headline': 'a'}])
+        self.assertEqual(writer.writes, 0)
+        self.assertEqual(doc_ref.updates, [])
+
+@unittest.skipUnless(importlib.util.find_spec('firebase_admin'), 'firebase_admin is not installed')
+class ProgressAfterClaimTest(unittest.TestCase):
+
+    def setUp(self):
+        from firebase_admin import firestore
+        from benchmarks import fakes
+        patcher = mock.patch.object(firestore, 'transactional', fakes.fake_transactional)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db = fakes.FakeFirestore()
+        self.doc_ref = self.db.collection('newspapers').document(f"claimed-{next(_paths)}")
+        self.doc_ref.set({'processingStatus': 'pending'})
+
+    def test_sections_after_claim_are_written_and_last_one_persists(self):
+        from src.utils import leases
+        claim = leases.claim_lease(self.db, self.doc_ref, 'request-1', 'test')
+        self.assertEqual(claim['state'], leases.LEASE_ACQUIRED)
+
+        writer = progress.ThrottledDocumentWriter(self.doc_ref, max_writes_per_second=10)
+        writer.update({'content.headline': 'a'})
+        self.assertEqual(writer.writes, 1)
+        writer.update({'content.mainArticle': 'b'})
+
+        deadline = time.monotonic() + 2
+        while writer.writes < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        content = self.doc_ref.get().to_dict()['content']
+        self.assertEqual(content, {'headline': 'a', 'mainArticle': 'b'})
+
+    def test_writes_are_refused_after_the_lease_is_lost(self):
+        from src.utils import leases
+        leases.claim_lease(self.db, self.doc_ref, 'request-1', 'test')
+        writer = progress.ThrottledDocumentWriter(
+            self.doc_ref,
+            max_writes_per_second=10,
+            write=lambda fields: leases.update_if_leased(self.db, self.doc_ref, 'request-1', fields)
+        )
+        writer.update({'content.headline': 'a'})
+        # The lease expired and another run took it over
+        self.doc_ref.update({leases.LEASE_FIELD: {'requestId': 'request-2', 'expiresAt': time.time() + 60}})
+        writer.update({'content.headline': 'stale'})
+        writer.flush()
+
+        self.assertTrue(writer.stopped)
+        self.assertEqual(self.doc_ref.get().to_dict()['content'], {'headline': 'a'})
+
+@unittest.skipUnless(
+    importlib.util.find_spec('firebase_admin') and importlib.util.find_spec('firebase_functions'),
+    'firebase_admin and firebase_functions are not installed'
+)
+class GenerationRollbackTest(unittest.TestCase):
+
+    def setUp(self):
+        from firebase_admin import firestore
+        from benchmarks import fakes
+        from src import runtime
+        patcher = mock.patch.object(firestore, 'transactional', fakes.fake_transactional)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db = fakes.FakeFirestore()
+        runtime.set_client('firestore', self.db)
+        self.doc_ref = self.db.collection('newspapers').document(f"rollback-{next(_paths)}")
+
+    def run_failing_generation(self, stored: dict):
+        import main
+        from src.utils import leases, newspaper_generator
+        self.doc_ref.set({'processingStatus': 'completed', **stored})
+        leases.claim_lease(self.db, self.doc_ref, 'request-1', 'test')
+
+        def fail_after_header(*args, on_section=None, **kwargs):
+            on_section('header', {'title': 'partial'})
+            raise RuntimeError('model unavailable')
+
+        generation = {
+            'newspaperId': self.doc_ref.id,
+            'newspaperRef': self.doc_ref,
+            'requestId': 'request-1',
+            'storedContent': stored.get('content'),
+            'papers': [], 'template': {}, 'language': 'en', 'strategy': 'standard'
+        }
+        with mock.patch.object(newspaper_generator, 'generate_newspaper_sections', fail_after_header):
+            with self.assertRaises(RuntimeError):
+                main.run_newspaper_generation(self.db, generation)
+        return self.doc_ref.get().to_dict()
+
+    def test_partial_content_is_removed(self):
+        document = self.run_failing_generation({})
+        self.assertNotIn('content', document)
+        self.assertNotIn('generationProgress', document)
+
+    def test_stored_content_is_restored(self):
+        stored = {'header': {'title': 'previous'}, 'mainArticle': {'title': 'kept'}}
+        document = self.run_failing_generation({'content': stored})
+        self.assertEqual(document['content'], stored)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+"""
+Tests for incremental newspaper regeneration: sections are reused while
+their input fingerprints match the stored generation state. Run from
+functions/:
+
+    python -m unittest discover tests
+"""
+import re
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from src import runtime
+from src.utils import newspaper_generator
+
+RELATIONSHIP = '{"mainPaperIndex": 0, "overallTheme": "Efficient models", "newspaperTitle": "The Sparse Times", "subArticleOrder": [1, 2, 3]}'
+
+class RecordingModel:
+    """Answers each kind of generation prompt and records which were asked"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def generate_content(self, prompt, **kwargs):
+        title = re.search(r'^Title: (.*)$', prompt, re.MULTILINE)
+        if 'Analyze these papers and structure them' in prompt:
+            kind, text = 'relationship', RELATIONSHIP
+        elif 'appear together in one newspaper issue' in prompt:
+            kind, text = 'theme', '{"overallTheme": "Efficient models", "newspaperTitle": "The Sparse Times"}'
+        elif 'newspaper main article' in prompt:
+            kind, text = f"main:{title.group(1)}", '{"headline": "Main", "subheadline": "Sub", "content": "Body"}'
+        elif 'sub-article' in prompt:
+            kind, text = f"sub:{title.group(1)}", f'{{"headline": "{title.group(1)}", "content": "Body"}}'
+        else:
+            kind, text = 'sidebar', 'Keywords: attention, sparsity'
+        with self.lock:
+            self.calls.append(kind)
+        return SimpleNamespace(text=text)
+
+def make_papers(embeddings: bool = False):
+    from src.ai.embeddings import encode_embedding
+    papers = []
+    for i in range(4):
+        paper = {
+            'id': f'paper-{i}',
+            'title': f'Paper {i}',
+            'authors': ['A. Author'],
+            'aiAnalysis': {'summary': f'Summary {i}', 'keypoints': ['Point'], 'significance': 'High'}
+        }
+        if embeddings:
+            paper['embedding'] = encode_embedding([1.0, 0.1 * i, 0.0])
+        papers.append(paper)
+    return papers
+
+def changed(papers, index: int):
+    """Copy of papers with paper index's analysis revised"""
+    papers = [dict(paper) for paper in papers]
+    papers[index]['aiAnalysis'] = {**papers[index]['aiAnalysis'], 'summary': 'Revised summary'}
+    return papers
+
+class RegenerationTest(unittest.TestCase):
+
+    def generate(self, papers, previous=None, refresh=()):
+        """(content, state, model calls in sorted order) of one standard run"""
+        model = RecordingModel()
+        previous_content, previous_state = previous or (None, None)
+        with mock.patch.object(runtime, 'get_generative_model', lambda *args, **kwargs: model):
+            content, state = newspaper_generator.generate_newspaper_sections(
+                papers, {}, 'newspaper-1', 'en',
+                previous_content=previous_content, previous_state=previous_state, refresh=refresh
+            )
+        self.assertEqual(state['llmCalls'], len(model.calls))
+        return content, state, sorted(model.calls)
+
+    def test_first_run_generates_every_section(self):
+        _, _, calls = self.generate(make_papers())
+        self.assertEqual(calls, ['main:Paper 0', 'relationship', 'sidebar', 'sub:Paper 1', 'sub:Paper 2', 'sub:Paper 3'])
+
+    def test_unchanged_inputs_skip_regeneration(self):
+        papers = make_papers()
+        content, state, _ = self.generate(papers)
+        again, again_state, calls = self.generate(papers, (content, state))
+        self.assertEqual(calls, [])
+        self.assertEqual(again, content)
+        for section in ('mainArticle', 'subArticles', 'sidebarContent'):
+            self.assertEqual(again_state['sections'][section], state['sections'][section])
+
+    def test_changed_sub_paper_regenerates_its_article_only(self):
+        papers = make_papers()
+        first = self.generate(papers)[:2]
+        content, _, calls = self.generate(changed(papers, 2), first)
+        # The paper set changed, so the relationship step runs again; the
+        # sections whose prompts did not change are reused
+        self.assertEqual(calls, ['relationship', 'sub:Paper 2'])
+        self.assertEqual([article['paperId'] for article in content['subArticles']], ['paper-1', 'paper-2', 'paper-3'])
+
+    def test_changed_main_paper_regenerates_the_main_article_only(self):
+        papers = make_papers()
+        first = self.generate(papers)[:2]
+        _, _, calls = self.generate(changed(papers, 0), first)
+        self.assertEqual(calls, ['main:Paper 0', 'relationship'])
+
+    def test_changed_paper_with_embeddings_regenerates_its_article_and_theme(self):
+        papers = make_papers(embeddings=True)
+        content, state, calls = self.generate(papers)
+        self.assertNotIn('relationship', calls)
+        self.assertIn('theme', calls)
+
+        self.assertEqual(self.generate(papers, (content, state))[2], [])
+        _, _, calls = self.generate(changed(papers, 3), (content, state))
+        # The theme prompt summarizes every paper
+        self.assertEqual(calls, ['sub:Paper 3', 'theme'])
+
+    def test_prompt_version_change_regenerates_every_section(self):
+        papers = make_papers()
+        first = self.generate(papers)[:2]
+        with mock.patch.object(newspaper_generator, 'GENERATION_PROMPT_VERSION', 'next'):
+            _, state, calls = self.generate(papers, first)
+            self.assertEqual(calls, ['main:Paper 0', 'relationship', 'sidebar', 'sub:Paper 1', 'sub:Paper 2', 'sub:Paper 3'])
+            # Stored under the new version, so the next run reuses everything
+            self.assertEqual(self.generate(papers, (first[0], state))[2], [])
+
+    def test_refresh_regenerates_the_named_sections(self):
+        papers = make_papers()
+        first = self.generate(papers)[:2]
+        self.assertEqual(self.generate(papers, first, refresh=['subArticle:paper-3'])[2], ['sub:Paper 3'])
+        self.assertEqual(self.generate(papers, first, refresh=['sidebarContent'])[2], ['sidebar'])
+
+    def test_state_from_another_language_or_strategy_is_not_used(self):
+        _, state, _ = self.generate(make_papers())
+        self.assertIs(newspaper_generator.usable_previous_state(state, 'en', 'standard'), state)
+        self.assertEqual(newspaper_generator.usable_previous_state(state, 'ja', 'standard'), {})
+        self.assertEqual(newspaper_generator.usable_previous_state(state, 'en', 'compact'), {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+"""
+Tests for the paper similarity index and its Cloud Storage store, with
+an in-memory bucket and the benchmark's in-memory Firestore. Run from
+functions/:
+
+    python -m unittest discover tests
+"""
+import importlib.util
+import unittest
+from typing import Dict, Optional
+from unittest import mock
+
+class MemoryBlob:
+    """Object with a generation number; preconditions fail like GCS's"""
+
+    def __init__(self, bucket: 'MemoryBucket', name: str):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def generation(self) -> int:
+        return self.bucket.objects.get(self.name, (0, b''))[0]
+
+    def _check(self, if_generation_match: Optional[int]) -> None:
+        from google.api_core import exceptions as api_exceptions
+        if if_generation_match is not None and if_generation_match != self.generation:
+            raise api_exceptions.PreconditionFailed(f"{self.name}: {self.generation} != {if_generation_match}")
+
+    def download_as_bytes(self, if_generation_match: Optional[int] = None) -> bytes:
+        self._check(if_generation_match)
+        return self.bucket.objects[self.name][1]
+
+    def upload_from_string(self, data: bytes, content_type: Optional[str] = None, if_generation_match: Optional[int] = None) -> None:
+        self._check(if_generation_match)
+        self.bucket.objects[self.name] = (self.generation + 1, bytes(data))
+        self.bucket.uploads += 1
+
+class MemoryBucket:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.objects: Dict[str, tuple] = {}
+        self.uploads = 0
+
+    def blob(self, name: str) -> MemoryBlob:
+        return MemoryBlob(self, name)
+
+    def get_blob(self, name: str) -> Optional[MemoryBlob]:
+        return MemoryBlob(self, name) if name in self.objects else None
+
+class MemoryStorageClient:
+
+    def __init__(self):
+        self.buckets: Dict[str, MemoryBucket] = {}
+
+    def bucket(self, name: str) -> MemoryBucket:
+        return self.buckets.setdefault(name, MemoryBucket(name))
+
+def unit(*values: float):
+    import numpy as np
+    return np.array(values, dtype=np.float32)
+
+@unittest.skipUnless(importlib.util.find_spec('numpy'), 'numpy is not installed')
+class PaperIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        from src.utils import similarity_index
+        self.similarity_index = similarity_index
+
+    def test_npz_round_trip(self):
+        import numpy as np
+        index = self.similarity_index.PaperIndex()
+        index.upsert('a', unit(1, 0, 0), ['attention', '注意機構'])
+        index.upsert('b', unit(0, 3, 4), [])
+        loaded = self.similarity_index.PaperIndex.from_bytes(index.to_bytes())
+
+        self.assertEqual(loaded.paper_ids, ['a', 'b'])
+        self.assertEqual(loaded.vectors.dtype, np.float32)
+        np.testing.assert_allclose(loaded.vectors, [[1, 0, 0], [0, 0.6, 0.8]], rtol=1e-6)
+        self.assertEqual(loaded.keywords, [{'attention', '注意機構'}, set()])
+        self.assertIn('b', loaded)
+        self.assertEqual(loaded.query(unit(0, 0, 1), [], k=1)[0]['paperId'], 'b')
+
+    def test_empty_index_round_trips(self):
+        loaded = self.similarity_index.PaperIndex.from_bytes(self.similarity_index.PaperIndex().to_bytes())
+        self.assertEqual(len(loaded), 0)
+        self.assertEqual(loaded.query(unit(1, 0), []), [])
+
+    def test_upsert_replaces_and_remove_reindexes(self):
+        index = self.similarity_index.PaperIndex()
+        for paper_id, vector in (('a', unit(1, 0)), ('b', unit(0, 1)), ('c', unit(1, 1))):
+            index.upsert(paper_id, vector, [])
+        index.upsert('a', unit(0, 1), ['new'])
+        self.assertEqual(len(index), 3)
+        self.assertTrue(index.remove('a'))
+        self.assertFalse(index.remove('a'))
+        self.assertEqual(index.paper_ids, ['b', 'c'])
+        self.assertEqual([result['paperId'] for result in index.query(unit(0, 1), [], k=2)], ['b', 'c'])
+
+    def test_vectors_of_another_size_reset_the_index(self):
+        index = self.similarity_index.PaperIndex()
+        index.upsert('old', unit(1, 0), [])
+        index.upsert('new', unit(1, 0, 0), [])
+        self.assertEqual(index.paper_ids, ['new'])
+        self.assertEqual(index.query(unit(1, 0), []), [])
+
+    def test_keyword_overlap_reranks_close_matches(self):
+        index = self.similarity_index.PaperIndex()
+        index.upsert('closer', unit(1, 0.1), ['vision'])
+        index.upsert('shared-topic', unit(1, 0.2), ['attention', 'transformers'])
+        results = index.query(unit(1, 0), ['attention', 'transformers'], k=2, exclude=('missing',))
+        self.assertEqual([result['paperId'] for result in results], ['shared-topic', 'closer'])
+        self.assertEqual(results[0]['keywordOverlap'], 1.0)
+
+@unittest.skipUnless(
+    importlib.util.find_spec('numpy') and importlib.util.find_spec('firebase_admin'),
+    'numpy and firebase_admin are not installed'
+)
+class PaperIndexStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        from benchmarks import fakes
+        from src import runtime
+        from src.utils import similarity_index
+        self.similarity_index = similarity_index
+        self.storage = MemoryStorageClient()
+        self.bucket = self.storage.bucket(similarity_index.INDEX_BUCKET)
+        self.db = fakes.FakeFirestore()
+        runtime.set_client('storage', self.storage)
+        self.store = similarity_index.PaperIndexStore()
+        for patcher in (
+            mock.patch.object(similarity_index, 'paper_index_store', self.store),
+            mock.patch.object(similarity_index.time, 'sleep', lambda seconds: None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def stored(self, scope: str):
+        blob = self.bucket.get_blob(self.store._blob_name(scope))
+        return self.similarity_index.PaperIndex.from_bytes(blob.download_as_bytes())
+
+    def write_concurrently(self, scope: str, paper_id: str) -> None:
+        """Another instance adds paper_id to the stored index"""
+        other = self.similarity_index.PaperIndexStore()
+        other.update(scope, lambda index: index.upsert(paper_id, unit(0, 1), []))
+
+    def test_update_writes_the_index_and_caches_it(self):
+        scope = self.similarity_index.user_scope('alice')
+        index = self.store.update(scope, lambda index: index.upsert('a', unit(1, 0), ['x']))
+        self.assertEqual(self.stored(scope).paper_ids, ['a'])
+        self.assertIs(self.store.load(scope), index)
+        self.assertEqual(self.bucket.uploads, 1)
+
+    def test_update_retries_on_generation_mismatch(self):
+        scope = self.similarity_index.user_scope('alice')
+        self.store.update(scope, lambda index: index.upsert('a', unit(1, 0), []))
+        attempts = []
+
+        def apply(index):
+            attempts.append(list(index.paper_ids))
+            if len(attempts) == 1:
+                # Lands between this writer's read and its conditional write
+                self.write_concurrently(scope, 'b')
+            index.upsert('c', unit(1, 1), [])
+
+        with self.assertLogs(level='INFO'):
+            self.store.update(scope, apply)
+        # The retry saw the concurrent write and kept it
+        self.assertEqual(attempts, [['a'], ['a', 'b']])
+        self.assertEqual(self.stored(scope).paper_ids, ['a', 'b', 'c'])
+
+    def test_creating_the_index_conflicts_with_a_concurrent_create(self):
+        scope = self.similarity_index.group_scope('lab')
+        attempts = []
+
+        def apply(index):
+            attempts.append(len(index))
+            if len(attempts) == 1:
+                self.write_concurrently(scope, 'b')
+            index.upsert('a', unit(1, 0), [])
+
+        with self.assertLogs(level='INFO'):
+            self.store.update(scope, apply)
+        self.assertEqual(attempts, [0, 1])
+        self.assertEqual(self.stored(scope).paper_ids, ['b', 'a'])
+
+    def test_update_gives_up_after_max_attempts(self):
+        scope = self.similarity_index.user_scope('alice')
+        calls = []
+
+        def apply(index):
+            calls.append(1)
+            self.write_concurrently(scope, f"other-{len(calls)}")
+            index.upsert('mine', unit(1, 0), [])
+
+        with self.assertLogs(level='INFO'):
+            with self.assertRaises(RuntimeError):
+                self.store.update(scope, apply)
+        self.assertEqual(len(calls), self.similarity_index.MAX_UPDATE_ATTEMPTS)
+        self.assertNotIn('mine', self.stored(scope))
+
+    def add_paper(self, paper_id: str, uploader_id: str, vector, keywords=(), inline: bool = True) -> Dict:
+        """Analyzed paper; inline embeddings predate details/embedding"""
+        from src.ai.embeddings import encode_embedding
+        from src.utils import paper_store
+        paper = {'uploaderId': uploader_id, 'metadata': {'keywords': list(keywords)}}
+        embedding = {'embedding': encode_embedding(vector), 'embeddingModel': 'test'}
+        if inline:
+            paper.update(embedding)
+        else:
+            paper_store.embedding_ref(self.db, paper_id).set(embedding)
+        self.db.collection('papers').document(paper_id).set(paper)
+        return {**paper, **embedding}
+
+    def test_empty_index_is_rebuilt_from_firestore(self):
+        scope = self.similarity_index.user_scope('alice')
+        seed = self.add_paper('seed', 'alice', unit(1, 0))
+        self.add_paper('near', 'alice', unit(1, 0.1), inline=False)
+        self.add_paper('far', 'alice', unit(0, 1))
+        self.add_paper('bobs', 'bob', unit(1, 0))
+
+        with self.assertLogs(level='INFO'):
+            results = self.similarity_index.suggest_papers(self.db, scope, 'seed', seed, k=5)
+        self.assertEqual([result['paperId'] for result in results], ['near', 'far'])
+        self.assertEqual(sorted(self.stored(scope).paper_ids), ['far', 'near', 'seed'])
+
+    def test_index_missing_the_seed_is_rebuilt(self):
+        scope = self.similarity_index.user_scope('alice')
+        self.similarity_index.index_paper('indexed', self.add_paper('indexed', 'alice', unit(0, 1)))
+        # Analyzed before indexing existed, so only Firestore has it
+        self.add_paper('older', 'alice', unit(1, 0.1))
+        seed = self.add_paper('seed', 'alice', unit(1, 0))
+
+        with self.assertLogs(level='INFO'):
+            results = self.similarity_index.suggest_papers(self.db, scope, 'seed', seed, k=1)
+        self.assertEqual(results[0]['paperId'], 'older')
+        self.assertIn('seed', self.stored(scope))
+
+    def test_seed_from_another_scope_does_not_rebuild(self):
+        scope = self.similarity_index.group_scope('lab')
+        member = self.add_paper('member', 'alice', unit(1, 0))
+        self.similarity_index.index_paper('member', {**member, 'groupIds': ['lab']})
+        uploads = self.bucket.uploads
+        seed = self.add_paper('outsider', 'bob', unit(1, 0))
+
+        results = self.similarity_index.suggest_papers(self.db, scope, 'outsider', seed)
+        self.assertEqual([result['paperId'] for result in results], ['member'])
+        self.assertEqual(self.bucket.uploads, uploads)
+
+if __name__ == '__main__':
+    unittest.main()
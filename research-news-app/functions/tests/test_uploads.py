@@ -0,0 +1,63 @@
+"""
+Tests for upload size limits and PDF sniffing. Run from functions/:
+
+    python -m unittest discover tests
+"""
+import importlib.util
+import sys
+import unittest
+from unittest import mock
+
+from src.utils import uploads
+
+HEAD = b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n'
+
+# (description, first bytes of the file, is a PDF)
+SNIFF_CASES = [
+    ('header at the start', HEAD, True),
+    ('header after junk', b'\x00junk\r\n' * 20 + HEAD, True),
+    ('header cut off by SNIFF_BYTES', b'x' * (uploads.SNIFF_BYTES - 3) + HEAD, False),
+    ('header after SNIFF_BYTES', b'x' * uploads.SNIFF_BYTES + HEAD, False),
+    ('html', b'<html><body>not a paper</body></html>', False),
+    ('empty', b'', False),
+]
+
+def _has_libmagic() -> bool:
+    if not importlib.util.find_spec('magic'):
+        return False
+    try:
+        import magic
+        magic.from_buffer(b'', mime=True)
+        return True
+    except Exception:
+        return False
+
+class IsPdfTest(unittest.TestCase):
+
+    def check_cases(self) -> None:
+        for description, head, expected in SNIFF_CASES:
+            with self.subTest(description):
+                self.assertEqual(uploads.is_pdf(head), expected)
+
+    def test_header_check_without_libmagic(self):
+        with mock.patch.dict(sys.modules, {'magic': None}):
+            self.check_cases()
+
+    @unittest.skipUnless(_has_libmagic(), 'libmagic is not installed')
+    def test_libmagic_agrees_with_header_check(self):
+        self.check_cases()
+
+class UploadLimitTest(unittest.TestCase):
+
+    def test_streamed_uploads_fit_in_a_request(self):
+        with mock.patch.dict('os.environ', {'MAX_UPLOAD_MB': '50'}):
+            self.assertEqual(uploads.max_upload_bytes(), 50 * 1024 * 1024)
+            streamed = uploads.max_streamed_upload_bytes()
+        self.assertLessEqual(streamed + uploads.MULTIPART_OVERHEAD_BYTES, uploads.HTTP_REQUEST_MAX_BYTES)
+
+    def test_smaller_configured_limit_applies_to_streamed_uploads(self):
+        with mock.patch.dict('os.environ', {'MAX_UPLOAD_MB': '10'}):
+            self.assertEqual(uploads.max_streamed_upload_bytes(), 10 * 1024 * 1024)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+"""
+Tests for the Vertex AI rate limiter on a fake clock. Run from functions/:
+
+    python -m unittest discover tests
+"""
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from src.ai import vertex_client
+
+class FakeClock:
+    """Stands in for the time module; sleep() advances monotonic()"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class FakeClockTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(vertex_client, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+class TokenBucketTest(FakeClockTestCase):
+
+    def test_reserve_waits_for_the_deficit(self):
+        bucket = vertex_client.TokenBucket(60)  # 1 token per second
+        self.assertEqual(bucket.reserve(60), 0.0)
+        self.assertEqual(bucket.reserve(30), 30.0)
+        # Later callers queue behind the earlier reservation
+        self.assertEqual(bucket.reserve(1), 31.0)
+
+    def test_refill_is_capped_at_capacity(self):
+        bucket = vertex_client.TokenBucket(60)
+        bucket.reserve(60)
+        self.clock.sleep(10)
+        self.assertEqual(bucket.reserve(10), 0.0)
+        self.clock.sleep(600)
+        bucket.reserve(0)
+        self.assertEqual(bucket.tokens, 60)
+
+    def test_adjust_refunds_and_charges(self):
+        bucket = vertex_client.TokenBucket(60)
+        bucket.reserve(60)
+        bucket.reserve(30)
+        bucket.adjust(30)
+        self.assertEqual(bucket.tokens, 0)
+        bucket.adjust(-5)
+        self.assertEqual(bucket.reserve(1), 6.0)
+
+    def test_refund_never_exceeds_capacity(self):
+        bucket = vertex_client.TokenBucket(60)
+        bucket.reserve(10)
+        bucket.adjust(100)
+        self.assertEqual(bucket.tokens, 60)
+
+class AdaptiveConcurrencyTest(FakeClockTestCase):
+
+    def test_rate_limit_halves_once_per_cooldown(self):
+        concurrency = vertex_client.AdaptiveConcurrency(initial=8)
+        for _ in range(3):
+            self.assertTrue(concurrency.acquire(timeout=1))
+        concurrency.release(throttled=True)
+        self.assertEqual(concurrency.limit, 4)
+        # A burst of 429s inside the cooldown counts once
+        self.clock.sleep(vertex_client.DECREASE_COOLDOWN_SECONDS / 2)
+        concurrency.release(throttled=True)
+        self.assertEqual(concurrency.limit, 4)
+
+        self.clock.sleep(vertex_client.DECREASE_COOLDOWN_SECONDS / 2)
+        concurrency.release(throttled=True)
+        self.assertEqual(concurrency.limit, 2)
+        self.assertEqual(concurrency.in_flight, 0)
+
+    def test_limit_never_drops_below_minimum(self):
+        concurrency = vertex_client.AdaptiveConcurrency(initial=2, minimum=1)
+        for _ in range(3):
+            concurrency.acquire(timeout=1)
+            concurrency.release(throttled=True)
+            self.clock.sleep(vertex_client.DECREASE_COOLDOWN_SECONDS)
+        self.assertEqual(concurrency.limit, 1)
+
+    def test_success_increases_additively_up_to_maximum(self):
+        concurrency = vertex_client.AdaptiveConcurrency(initial=2, maximum=3)
+        concurrency.acquire(timeout=1)
+        concurrency.release()
+        self.assertEqual(concurrency.limit, 2.5)
+        for _ in range(10):
+            concurrency.acquire(timeout=1)
+            concurrency.release()
+        self.assertEqual(concurrency.limit, 3)
+
+    def test_acquire_times_out_when_full(self):
+        concurrency = vertex_client.AdaptiveConcurrency(initial=1)
+        self.assertTrue(concurrency.acquire(timeout=1))
+        self.assertFalse(concurrency.acquire(timeout=0))
+        self.assertEqual(concurrency.in_flight, 1)
+
+class VertexRateLimiterTest(FakeClockTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Longest backoff every time, so retry timing is deterministic
+        patcher = mock.patch.object(vertex_client.random, 'uniform', lambda low, high: high)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = vertex_client.VertexRateLimiter(
+            requests_per_minute=600,
+            tokens_per_minute=6000,
+            concurrency=vertex_client.AdaptiveConcurrency(initial=4),
+            retry_deadline=10,
+            sleep=self.clock.sleep
+        )
+
+    def failing(self, error: Exception, failures: int = None, response=None):
+        calls = []
+
+        def fn():
+            calls.append(self.clock.now)
+            if failures is None or len(calls) <= failures:
+                raise error
+            return response
+
+        return fn, calls
+
+    def test_retries_stop_at_the_deadline(self):
+        fn, calls = self.failing(Exception('429 Quota exceeded'))
+        started = self.clock.now
+        with self.assertLogs(level='WARNING'):
+            with self.assertRaises(Exception):
+                self.limiter.call(fn, estimated_tokens=10)
+
+        # Backoffs of 1s, 2s and 4s fit in the 10s deadline; the next 8s does not
+        self.assertEqual(self.clock.sleeps, [1, 2, 4])
+        self.assertEqual([at - started for at in calls], [0, 1, 3, 7])
+        stats = self.limiter.get_stats()
+        self.assertEqual((stats['attempts'], stats['retries'], stats['failed']), (4, 3, 1))
+        self.assertEqual(stats['rateLimited'], 4)
+        self.assertEqual(stats['inFlight'], 0)
+        # 4 -> 2 at t=0, unchanged at t=1 (cooldown), 1 at t=3, floored at t=7
+        self.assertEqual(self.limiter.concurrency.limit, 1)
+
+    def test_per_call_deadline_overrides_the_default(self):
+        fn, calls = self.failing(Exception('503 UNAVAILABLE'))
+        with self.assertLogs(level='WARNING'):
+            with self.assertRaises(Exception):
+                self.limiter.call(fn, estimated_tokens=10, deadline=3.5)
+        self.assertEqual(self.clock.sleeps, [1, 2])
+        self.assertEqual(len(calls), 3)
+
+    def test_non_retryable_error_is_raised_immediately(self):
+        fn, calls = self.failing(ValueError('bad request'))
+        with self.assertRaises(ValueError):
+            self.limiter.call(fn, estimated_tokens=10)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.clock.sleeps, [])
+        self.assertEqual(self.limiter.concurrency.limit, 4 + 1 / 4)
+
+    def test_retry_then_success_returns_the_response(self):
+        response = SimpleNamespace(usage_metadata=None)
+        fn, calls = self.failing(Exception('RESOURCE_EXHAUSTED'), failures=1, response=response)
+        with self.assertLogs(level='WARNING'):
+            self.assertIs(self.limiter.call(fn, estimated_tokens=10), response)
+        stats = self.limiter.get_stats()
+        self.assertEqual((stats['attempts'], stats['succeeded'], stats['failed']), (2, 1, 0))
+        self.assertEqual(self.limiter.concurrency.limit, 2 + 1 / 2)
+
+    def test_reported_usage_refunds_the_estimate(self):
+        response = SimpleNamespace(usage_metadata=SimpleNamespace(total_token_count=400))
+        fn, _ = self.failing(None, failures=0, response=response)
+        self.limiter.call(fn, estimated_tokens=1000)
+        self.assertEqual(self.limiter.tokens.tokens, 6000 - 400)
+
+    def test_usage_above_the_estimate_is_charged(self):
+        response = SimpleNamespace(usage_metadata=SimpleNamespace(total_token_count=1500))
+        fn, _ = self.failing(None, failures=0, response=response)
+        self.limiter.call(fn, estimated_tokens=1000)
+        self.assertEqual(self.limiter.tokens.tokens, 6000 - 1500)
+
+    def test_quota_wait_past_the_deadline_refunds_the_reservation(self):
+        fn, calls = self.failing(None, failures=0)
+        # A minute of tokens is gone; 6000 more need 60s, past the 10s deadline
+        self.limiter.tokens.reserve(6000)
+        with self.assertRaises(vertex_client.RateLimitTimeout):
+            self.limiter.call(fn, estimated_tokens=6000)
+        self.assertEqual(calls, [])
+        self.assertEqual(self.limiter.tokens.tokens, 0)
+        self.assertEqual(self.limiter.requests.tokens, 600)
+        self.assertEqual(self.limiter.get_stats()['timeouts'], 1)
+
+    def test_quota_wait_within_the_deadline_sleeps(self):
+        fn, calls = self.failing(None, failures=0)
+        self.limiter.tokens.reserve(6000)
+        started = self.clock.now
+        self.limiter.call(fn, estimated_tokens=500)
+        self.assertEqual(self.clock.sleeps, [5.0])
+        self.assertEqual(calls, [started + 5.0])
+        self.assertEqual(self.limiter.get_stats()['queueSecondsMax'], 5.0)
+
+if __name__ == '__main__':
+    unittest.main()
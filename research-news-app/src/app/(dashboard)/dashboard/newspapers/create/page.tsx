@@ -3,7 +3,7 @@
 import { useState, useEffect, useCallback } from 'react';
 import { useRouter } from 'next/navigation';
 import { useAuth } from '@/contexts/AuthContext';
-import { storage, db, analyzePaperFunction, generateNewspaperFunction } from '@/lib/firebase';
+import { storage, db, analyzePaperFunction } from '@/lib/firebase';
 import { ref, uploadBytes, getDownloadURL } from 'firebase/storage';
 import { collection, addDoc, serverTimestamp, query, getDocs, doc, getDoc, onSnapshot } from 'firebase/firestore';
 import { Template } from '@/types';
@@ -286,19 +286,9 @@ export default function CreateNewspaperPage() {
         throw new Error(error.error || 'Failed to create newspaper');
       }
 
+      // Generation is queued server-side; the view page follows its progress
       const { newspaperId } = await response.json();
       
-      // Trigger newspaper generation in Firebase Function
-      try {
-        await generateNewspaperFunction({ 
-          newspaper_id: newspaperId 
-        });
-        console.log('Newspaper generation triggered successfully');
-      } catch (error) {
-        console.error('Error triggering newspaper generation:', error);
-        // Continue anyway - the generation can be retried later
-      }
-      
       router.push(`/dashboard/newspapers/view?id=${newspaperId}`);
     } catch (error) {
       const errorMessage = error instanceof Error ? error.message : '新聞の作成に失敗しました';
@@ -184,6 +184,26 @@ export default function NewspaperViewPage() {
                 <p className="text-sm text-gray-500 mt-2">
                   しばらくお待ちください
                 </p>
+                {/* 生成済みのセクションを順次表示 */}
+                {newspaper.content?.header && (
+                  <div className="mt-8 text-left border-t pt-6">
+                    <h2 className="text-3xl font-newspaper font-black text-center">
+                      {newspaper.content.header.newspaperName}
+                    </h2>
+                    <div className="text-sm text-gray-500 text-center mb-4">{newspaper.content.header.date}</div>
+                    {newspaper.content.mainArticle && (
+                      <div className="mb-4">
+                        <h3 className="text-2xl font-bold">{newspaper.content.mainArticle.headline}</h3>
+                        <p className="text-gray-600">{newspaper.content.mainArticle.subheadline}</p>
+                      </div>
+                    )}
+                    {newspaper.content.subArticles?.map((article, index) => (
+                      <h4 key={index} className="text-lg font-semibold text-gray-800">
+                        {article.headline}
+                      </h4>
+                    ))}
+                  </div>
+                )}
               </>
             ) : newspaper.processingStatus === 'failed' ? (
               <>
@@ -75,6 +75,41 @@ export const analyzePaperFunction = async (data: AnalyzePaperParams): Promise<An
   return await response.json() as AnalyzePaperResponse;
 };
 
+interface AnalyzePapersBatchItemResult {
+  paperId: string;
+  success: boolean;
+  result?: PaperAnalysisResult;
+  error?: string;
+}
+
+interface AnalyzePapersBatchResponse {
+  success: boolean;
+  succeeded: number;
+  failed: number;
+  results: AnalyzePapersBatchItemResult[];
+  error?: string;
+}
+
+export const analyzePapersBatchFunction = async (papers: AnalyzePaperParams[], maxConcurrency?: number): Promise<AnalyzePapersBatchResponse> => {
+  const token = await auth.currentUser?.getIdToken();
+  const response = await fetch(`${FUNCTIONS_BASE_URL}/analyze_papers_batch_http`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'Authorization': `Bearer ${token}`
+    },
+    body: JSON.stringify({ papers, max_concurrency: maxConcurrency }),
+    mode: 'cors',
+    credentials: 'same-origin'
+  });
+  
+  if (!response.ok) {
+    throw new Error('Function call failed');
+  }
+  
+  return await response.json() as AnalyzePapersBatchResponse;
+};
+
 interface NewspaperContent {
   title: string;
   date: string;
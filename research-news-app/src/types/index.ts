@@ -33,6 +33,7 @@ export interface Paper {
   doi?: string;
   fileUrl: string;
   fileSize: number;
+  // abstract and extractedText are only in papers/{id}/details/analysis
   metadata?: {
     abstract?: string;
     keywords?: string[];
@@ -104,6 +105,11 @@ export interface Newspaper {
   };
   processingStatus: 'pending' | 'processing' | 'completed' | 'failed';
   processingError?: string;
+  generationProgress?: {
+    completedSections: string[];
+    subArticlesCompleted: number;
+    subArticlesTotal: number | null;
+  };
   exportHistory?: ExportRecord[];
   createdAt: Timestamp;
   updatedAt: Timestamp;